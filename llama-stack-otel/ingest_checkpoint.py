@@ -0,0 +1,85 @@
+"""
+Progress of an ingestion, so an interrupted run resumes instead of starting over.
+
+The checkpoint is a file of JSON lines: the vector database being filled,
+then the ID of every document inserted into it, appended and synced to disk
+as soon as its insert returns. A run that dies halfway has lost at most the
+document it was inserting, which the next run inserts again; a line cut
+short by the crash is ignored.
+
+This is a copy of llama-stack-rag/ingest_checkpoint.py, as the scripts in
+each directory are run from that directory on their own. Make any change to
+both.
+"""
+
+import json
+import os
+from pathlib import Path
+
+
+class IngestCheckpoint:
+    """The vector database an ingestion fills and the documents already in it."""
+
+    def __init__(self, path):
+        """
+        Args:
+            path: File the checkpoint is kept in, one per script so scripts sharing a
+                directory do not resume each other's ingestion
+        """
+        self.path = Path(path)
+        self.vector_db_id = None
+        self.done = set()
+
+    def resume(self, registered):
+        """
+        Pick up the checkpoint of an interrupted run.
+
+        Args:
+            registered: IDs of the vector databases the server has
+
+        Returns:
+            True if there was a checkpoint and its vector database is still registered
+        """
+        if not self.path.exists():
+            return False
+        lines = self.path.read_text(encoding="utf-8").splitlines()
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                break  # the last write was cut short
+        if not records or records[0].get("vector_db_id") not in registered:
+            print("Vector database from the checkpoint is gone, starting over")
+            return False
+        self.vector_db_id = records[0]["vector_db_id"]
+        self.done = {record["document_id"] for record in records[1:]}
+        if len(records) < len(lines):
+            self._write(records)  # so records are not appended to the broken line
+        return True
+
+    def start(self, vector_db_id):
+        """Start a checkpoint for an ingestion into a new vector database."""
+        self.vector_db_id = vector_db_id
+        self.done = set()
+        self._write([{"vector_db_id": vector_db_id}])
+
+    def _write(self, records):
+        # write a new file and rename it so a crash never leaves a half written checkpoint
+        tmp_file = self.path.with_name(f"{self.path.name}.tmp")
+        tmp_file.write_text(
+            "".join(json.dumps(record) + "\n" for record in records), encoding="utf-8"
+        )
+        tmp_file.replace(self.path)
+
+    def record(self, document_id):
+        """Record that a document has been inserted."""
+        with self.path.open("a", encoding="utf-8") as f:
+            f.write(json.dumps({"document_id": document_id}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.done.add(document_id)
+
+    def finish(self):
+        """Drop the checkpoint once every document has been inserted."""
+        self.path.unlink(missing_ok=True)
@@ -0,0 +1,155 @@
+"""
+Packed, memory-mappable copy of the preprocessed docs corpus.
+
+The plain text of every markdown file is stored back to back in a single file
+behind a JSON header which holds, for each document, its ID and where its
+text is, along with the size and modification time of every source file.
+Opening the pack maps the file and reads the header, the text of a document
+is only decoded when it is used. The pack is rebuilt when a source file is
+added, removed or changed, converting only the files that changed.
+
+This is a copy of llama-stack-rag/packed_corpus.py, as the scripts in each
+directory are run from that directory on their own. Make any change to both.
+"""
+
+import json
+import mmap
+import struct
+from pathlib import Path
+
+MAGIC = b"RAGPACK1"
+# magic followed by the length of the JSON header
+PREFIX = struct.Struct("<8sQ")
+
+
+def scan_sources(docs_path):
+    """Size and modification time of every markdown file, keyed by relative path."""
+    sources = {}
+    for file_path in sorted(docs_path.rglob("*.md")):
+        if file_path.is_file():
+            stat = file_path.stat()
+            sources[file_path.relative_to(docs_path).as_posix()] = [
+                stat.st_mtime_ns,
+                stat.st_size,
+            ]
+    return sources
+
+
+class PackedCorpus:
+    """Read-only view of a packed corpus file."""
+
+    def __init__(self, pack_path):
+        # the mapping stays valid once the file is closed
+        with open(pack_path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, header_length = PREFIX.unpack_from(self._map, 0)
+            if magic != MAGIC:
+                raise ValueError(f"{pack_path} is not a packed corpus")
+            header = json.loads(self._map[PREFIX.size : PREFIX.size + header_length])
+        except Exception:
+            self._map.close()
+            raise
+        self._base = PREFIX.size + header_length
+        self.sources = header["sources"]
+        self.documents = header["documents"]
+
+    @classmethod
+    def open(cls, docs_path, pack_path, convert):
+        """
+        Open the pack for a docs tree, (re)building it first if the docs have changed.
+
+        Args:
+            docs_path: Root of the markdown docs tree
+            pack_path: File the pack is kept in
+            convert: Function turning the markdown of a file into the text to keep
+
+        Returns:
+            The opened PackedCorpus
+        """
+        docs_path = Path(docs_path)
+        pack_path = Path(pack_path)
+        sources = scan_sources(docs_path)
+
+        previous = None
+        if pack_path.exists():
+            try:
+                previous = cls(pack_path)
+            except (OSError, ValueError, struct.error):
+                previous = None  # unreadable, build it again from scratch
+            if previous is not None and previous.sources == sources:
+                return previous
+
+        cls.build(docs_path, pack_path, sources, convert, previous)
+        if previous is not None:
+            previous.close()
+        return cls(pack_path)
+
+    @staticmethod
+    def build(docs_path, pack_path, sources, convert, previous=None):
+        """Write a new pack, reusing the text of unchanged files from the previous one."""
+        unchanged = {}
+        if previous is not None:
+            unchanged = {
+                document["source"]: document
+                for document in previous.documents
+                if previous.sources.get(document["source"])
+                == sources.get(document["source"])
+            }
+
+        documents = []
+        blobs = []
+        offset = 0
+        for source in sources:
+            if source in unchanged:
+                data = previous.raw(unchanged[source])
+            else:
+                with open(docs_path / source, "r", encoding="utf-8") as f:
+                    data = convert(f.read()).encode("utf-8")
+            documents.append(
+                {
+                    # stable ID derived from the path, as when reading the files directly
+                    "document_id": Path(source).with_suffix("").as_posix(),
+                    "source": source,
+                    "offset": offset,
+                    "length": len(data),
+                }
+            )
+            blobs.append(data)
+            offset += len(data)
+
+        header = json.dumps({"sources": sources, "documents": documents}).encode(
+            "utf-8"
+        )
+        # write a new file and rename it so a reader never sees a half written pack
+        tmp_path = pack_path.with_suffix(pack_path.suffix + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(PREFIX.pack(MAGIC, len(header)))
+            f.write(header)
+            for data in blobs:
+                f.write(data)
+        tmp_path.replace(pack_path)
+        print(
+            f"Packed {len(documents)} documents into {pack_path} "
+            f"({len(documents) - len(unchanged)} converted)"
+        )
+
+    def raw(self, document):
+        """The UTF-8 encoded text of a document."""
+        start = self._base + document["offset"]
+        return self._map[start : start + document["length"]]
+
+    def text(self, document):
+        """The text of a document."""
+        return self.raw(document).decode("utf-8")
+
+    def __iter__(self):
+        """Yield (document_id, text) for every document."""
+        for document in self.documents:
+            yield document["document_id"], self.text(document)
+
+    def __len__(self):
+        return len(self.documents)
+
+    def close(self):
+        self._map.close()
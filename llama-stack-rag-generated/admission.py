@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Admission control and load shedding for the query path.
+
+A bounded number of questions run at once and a bounded number wait in a
+FIFO queue. Questions that find the queue full, or that wait longer than
+the queue deadline, are rejected straight away instead of piling up until
+the request timeout. Questions admitted while the queue is deep are marked
+as degraded so they can take a cheaper path.
+"""
+
+import asyncio
+import contextlib
+from collections import deque
+from typing import Optional
+
+
+class OverloadedError(Exception):
+    """Raised when a question is shed instead of being admitted."""
+
+
+class Ticket:
+    """Handed to an admitted question."""
+
+    def __init__(self, degraded: bool):
+        self.degraded = degraded
+
+
+class AdmissionController:
+    """Bounded queue + concurrency limit with queue-time deadlines and fast rejection."""
+
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        max_queue: int = 32,
+        queue_timeout: float = 10.0,
+        degrade_queue_depth: Optional[int] = None,
+    ):
+        """
+        Args:
+            max_concurrency: Number of questions allowed to run at the same time
+            max_queue: Number of questions allowed to wait for a free slot
+            queue_timeout: Seconds a question may wait before it is shed
+            degrade_queue_depth: Queue depth at which admitted questions are marked degraded
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.degrade_queue_depth = degrade_queue_depth
+
+        self.in_flight = 0
+        self._waiters: deque = deque()
+
+        self.admitted = 0
+        self.degraded = 0
+        self.shed_queue_full = 0
+        self.shed_deadline = 0
+        self.max_queue_depth = 0
+
+    @contextlib.asynccontextmanager
+    async def admit(self):
+        """Wait for a slot, raising OverloadedError if the question is shed."""
+        queue_depth = len(self._waiters)
+        degraded = self.degrade_queue_depth is not None and queue_depth >= self.degrade_queue_depth
+
+        if self.in_flight < self.max_concurrency and not self._waiters:
+            self.in_flight += 1
+        elif queue_depth >= self.max_queue:
+            self.shed_queue_full += 1
+            raise OverloadedError(f"queue full ({queue_depth} waiting)")
+        else:
+            await self._wait_for_slot()
+
+        self.admitted += 1
+        if degraded:
+            self.degraded += 1
+        try:
+            yield Ticket(degraded)
+        finally:
+            self._release()
+
+    async def _wait_for_slot(self) -> None:
+        """Queue up until a slot is handed over or the queue deadline passes."""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self.max_queue_depth = max(self.max_queue_depth, len(self._waiters))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done():
+                # the slot was handed over just as we gave up, give it back
+                self._release()
+            else:
+                self._waiters.remove(future)
+                future.cancel()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.shed_deadline += 1
+            raise OverloadedError(f"waited more than {self.queue_timeout}s for a slot") from None
+
+    def _release(self) -> None:
+        """Hand the slot to the next waiter, or free it."""
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self) -> dict:
+        """Queue depth and shed counts."""
+        return {
+            "in_flight": self.in_flight,
+            "queue_depth": len(self._waiters),
+            "max_queue_depth": self.max_queue_depth,
+            "admitted": self.admitted,
+            "degraded": self.degraded,
+            "shed_queue_full": self.shed_queue_full,
+            "shed_deadline": self.shed_deadline,
+        }
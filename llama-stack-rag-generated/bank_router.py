@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Picking the knowledge banks a question is likely to be answered from.
+
+Each bank has a profile: the centroid of the embeddings of its document
+summaries, built when the bank is ingested and kept with the profiles of the
+other banks in one small JSON file. A question is embedded locally and
+compared with every centroid. If the best bank stands out from the rest by
+`margin` it is searched alone; failing that, if the best two stand out, the
+two of them; otherwise the router is not confident and every bank is
+searched. Banks without a profile are always searched.
+
+How well the routing works is measured against which banks end up with
+chunks in the answer. A sample of confident questions (`audit_rate`) is sent
+to every bank anyway, and only those count: on a routed question the picked
+banks are nearly the only ones searched, so they would seem to always be
+right. Precision is the share of the banks picked that contributed, recall
+the share of the banks that contributed that the router picked.
+"""
+
+import json
+import random
+import threading
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+
+class Route(NamedTuple):
+    """Where the router sends a question."""
+
+    banks: list  # the banks to search
+    picked: Optional[list]  # the banks the router picked, None if it was not confident
+    candidates: int  # the number of banks it chose from
+    audit: bool = False  # searching every bank to check the pick
+
+
+class BankRouter:
+    """Centroid profile per knowledge bank and the routing decisions made with them."""
+
+    def __init__(
+        self,
+        embedder,
+        *,
+        top: int = 2,
+        min_score: float = 0.1,
+        margin: float = 0.05,
+        audit_rate: float = 0.05,
+        seed: Optional[int] = None,
+    ):
+        """
+        Args:
+            embedder: Callable embedding a list of texts, with `name` and `dimension`
+            top: Most banks a confident route sends a question to
+            min_score: Lowest similarity to a centroid a picked bank can have
+            margin: How far the picked banks have to be ahead of the next bank
+            audit_rate: Share of confident routes that still search every bank
+            seed: Seed for picking the audited questions
+        """
+        self.embedder = embedder
+        self.top = top
+        self.min_score = min_score
+        self.margin = margin
+        self.audit_rate = audit_rate
+        self.profiles: dict = {}
+        self._random = random.Random(seed)
+
+        self._lock = threading.Lock()
+        self.questions = 0
+        self.routed = 0
+        self.fanned_out = 0
+        self.searches_saved = 0
+        self._precision = [0.0, 0]  # sum, count
+        self._recall = [0.0, 0]
+
+    def set_profile(self, knowledge_bank_id: str, embeddings: np.ndarray) -> None:
+        """
+        Set the profile of a bank from embeddings of its documents.
+
+        Args:
+            knowledge_bank_id: The bank
+            embeddings: One embedding per document, such as of its summary
+        """
+        embeddings = np.array(embeddings, dtype=np.float32).reshape(-1, self.embedder.dimension)
+        embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        centroid = embeddings.mean(axis=0)
+        self.profiles[knowledge_bank_id] = {
+            "centroid": centroid / max(float(np.linalg.norm(centroid)), 1e-12),
+            "documents": len(embeddings),
+        }
+
+    def route(self, question: str, knowledge_bank_ids: list) -> Route:
+        """
+        Pick the banks to search for a question.
+
+        Args:
+            question: The question
+            knowledge_bank_ids: The banks it could be searched in
+
+        Returns:
+            The Route, its banks in the order given
+        """
+        known = [bank for bank in knowledge_bank_ids if bank in self.profiles]
+        if len(known) < 2:
+            return Route(list(knowledge_bank_ids), None, len(knowledge_bank_ids))
+
+        query = np.array(self.embedder([question])[0], dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        ranked = sorted(
+            ((float(self.profiles[bank]["centroid"] @ query), bank) for bank in known),
+            reverse=True,
+        )
+        picked = None
+        for count in range(1, min(self.top, len(ranked) - 1) + 1):
+            score, next_score = ranked[count - 1][0], ranked[count][0]
+            if score >= self.min_score and score - next_score >= self.margin:
+                picked = {bank for _, bank in ranked[:count]}
+                break
+        if picked is None:
+            return Route(list(knowledge_bank_ids), None, len(knowledge_bank_ids))
+
+        audit = self._random.random() < self.audit_rate
+        banks = [
+            bank
+            for bank in knowledge_bank_ids
+            if audit or bank in picked or bank not in self.profiles
+        ]
+        picked = [bank for bank in knowledge_bank_ids if bank in picked]
+        return Route(banks, picked, len(knowledge_bank_ids), audit)
+
+    def record(self, route: Route, contributing: set) -> None:
+        """
+        Account for a routed question once its answer is known.
+
+        Args:
+            route: What route returned for it
+            contributing: The banks with chunks in the answer
+        """
+        with self._lock:
+            self.questions += 1
+            self.searches_saved += route.candidates - len(route.banks)
+            if route.picked is None:
+                self.fanned_out += 1
+                return
+            self.routed += 1
+            # only on an audit were the banks left out searched too, so it is known whether
+            # they would have contributed; banks without a profile are searched either way
+            profiled = contributing.intersection(self.profiles)
+            if not route.audit or not profiled:
+                return
+            hits = len(profiled.intersection(route.picked))
+            self._precision[0] += hits / len(route.picked)
+            self._precision[1] += 1
+            self._recall[0] += hits / len(profiled)
+            self._recall[1] += 1
+
+    def save(self, path: str) -> None:
+        """Write the profiles atomically to a JSON file."""
+        path = Path(path)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "embedder": self.embedder.name,
+                    "profiles": {
+                        bank: {
+                            "centroid": profile["centroid"].round(6).tolist(),
+                            "documents": profile["documents"],
+                        }
+                        for bank, profile in self.profiles.items()
+                    },
+                },
+                f,
+            )
+        tmp_path.replace(path)
+
+    def load(self, path: str) -> None:
+        """Read the profiles written by save, if they were built with this router's embedder."""
+        with Path(path).open(encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("embedder") != self.embedder.name:
+            raise ValueError(f"profiles in {path} were not built with {self.embedder.name}")
+        self.profiles = {
+            bank: {
+                "centroid": np.asarray(profile["centroid"], dtype=np.float32),
+                "documents": profile["documents"],
+            }
+            for bank, profile in data.get("profiles", {}).items()
+        }
+
+    def stats(self) -> dict:
+        """How often questions were routed, what that saved and how well it picked."""
+        with self._lock:
+            return {
+                "banks": len(self.profiles),
+                "questions": self.questions,
+                "routed": self.routed,
+                "fanned_out": self.fanned_out,
+                "searches_saved": self.searches_saved,
+                "precision": (
+                    round(self._precision[0] / self._precision[1], 4)
+                    if self._precision[1]
+                    else None
+                ),
+                "audits": self._recall[1],
+                "recall": round(self._recall[0] / self._recall[1], 4) if self._recall[1] else None,
+            }
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Smaller and cheaper to produce request bodies for bulk inserts.
+
+CompactPayloadClient is an httpx client to hand to LlamaStackClient. JSON
+bodies are encoded with orjson when it is installed (compact stdlib json
+otherwise) and large bodies can be sent gzip or zstd compressed. Request
+compression only works if something in front of the server decompresses
+request bodies, so if a compressed request is rejected and the same request
+uncompressed is not, compression is switched off for the rest of the run.
+The bytes sent and the time spent serializing and compressing are counted.
+
+Only llama-stack-rag1.py uses this client. The example scripts in
+llama-stack-rag and llama-stack-otel are left with the stock one: they insert
+the corpus once, one document per request, and are kept to the plain client
+library calls they demonstrate.
+"""
+
+import gzip
+import json
+import threading
+import time
+
+import httpx
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# statuses a server that can not decode the compressed body answers with
+COMPRESSION_REJECTED_STATUS_CODES = {400, 415, 422}
+
+
+def encode_json(data) -> bytes:
+    """Encode a request body as compact JSON, with orjson if it is available."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            pass  # something orjson does not handle, such as non-string keys
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), allow_nan=False).encode()
+
+
+class CompactPayloadClient(httpx.Client):
+    """httpx client sending fast-encoded and, optionally, compressed JSON bodies."""
+
+    def __init__(self, *, compression=None, min_size: int = 16 * 1024, **kwargs):
+        """
+        Args:
+            compression: "gzip", "zstd" or None to send bodies uncompressed
+            min_size: Bodies smaller than this many bytes are never compressed
+            **kwargs: Passed on to httpx.Client
+        """
+        kwargs.setdefault("follow_redirects", True)
+        super().__init__(**kwargs)
+        self.min_size = min_size
+        self.compression = None
+        self.set_compression(compression)
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.json_bytes = 0
+        self.sent_bytes = 0
+        self.compressed_requests = 0
+        self.serialize_seconds = 0.0
+        self.compress_seconds = 0.0
+
+    def set_compression(self, compression) -> None:
+        """Choose the compression for large bodies, falling back to gzip if zstd is missing."""
+        if compression == "zstd" and zstandard is None:
+            print("⚠️  zstandard is not installed, compressing requests with gzip")
+            compression = "gzip"
+        if compression not in {None, "gzip", "zstd"}:
+            raise ValueError(f"unknown compression: {compression}")
+        self.compression = compression
+
+    def _compress(self, body: bytes) -> bytes:
+        if self.compression == "zstd":
+            return zstandard.ZstdCompressor(level=3).compress(body)
+        return gzip.compress(body, compresslevel=5)
+
+    def build_request(self, method, url, *, json=None, content=None, headers=None, **kwargs):
+        """Build the request, encoding a JSON body ourselves rather than with httpx."""
+        if json is not None and content is None:
+            start = time.perf_counter()
+            content = encode_json(json)
+            elapsed = time.perf_counter() - start
+            headers = httpx.Headers(headers)
+            headers["Content-Type"] = "application/json"
+            with self._lock:
+                self.serialize_seconds += elapsed
+                self.json_bytes += len(content)
+            json = None
+        return super().build_request(method, url, content=content, headers=headers, **kwargs)
+
+    def send(self, request: httpx.Request, **kwargs) -> httpx.Response:
+        """Send the request, compressed if it is large enough and compression is on."""
+        compression = self.compression
+        try:
+            body = request.content if request.method in {"POST", "PUT", "PATCH"} else b""
+        except httpx.RequestNotRead:
+            body = b""  # a streamed upload, such as a multipart file, is sent as it is
+        if compression is None or len(body) < self.min_size:
+            return self._send_counted(request, len(body), **kwargs)
+
+        start = time.perf_counter()
+        compressed_body = self._compress(body)
+        with self._lock:
+            self.compress_seconds += time.perf_counter() - start
+        headers = httpx.Headers(request.headers)
+        del headers["Content-Length"]
+        headers["Content-Encoding"] = compression
+        compressed = httpx.Request(
+            request.method,
+            request.url,
+            headers=headers,
+            content=compressed_body,
+            extensions=request.extensions,
+        )
+
+        response = self._send_counted(compressed, len(compressed_body), compressed=True, **kwargs)
+        if response.status_code not in COMPRESSION_REJECTED_STATUS_CODES:
+            return response
+
+        # The server may not be able to decode compressed bodies, see if it takes the plain one
+        response.close()
+        response = self._send_counted(request, len(body), **kwargs)
+        if response.status_code not in COMPRESSION_REJECTED_STATUS_CODES:
+            print(f"⚠️  Server does not accept {compression} request bodies, sending them as is")
+            self.compression = None
+        return response
+
+    def _send_counted(
+        self, request: httpx.Request, size: int, compressed: bool = False, **kwargs
+    ) -> httpx.Response:
+        with self._lock:
+            self.requests += 1
+            self.sent_bytes += size
+            self.compressed_requests += compressed
+        return super().send(request, **kwargs)
+
+    def stats(self) -> dict:
+        """Bytes sent against bytes of JSON produced, and the cost of producing them."""
+        with self._lock:
+            megabytes = self.json_bytes / 1e6
+            return {
+                "encoder": "orjson" if orjson is not None else "json",
+                "compression": self.compression,
+                "requests": self.requests,
+                "compressed_requests": self.compressed_requests,
+                "json_mb": round(megabytes, 3),
+                "sent_mb": round(self.sent_bytes / 1e6, 3),
+                "sent_ratio": round(self.sent_bytes / self.json_bytes, 3) if self.json_bytes else 0,
+                "serialize_ms_per_mb": (
+                    round(self.serialize_seconds * 1000 / megabytes, 2) if megabytes else 0
+                ),
+                "compress_ms_per_mb": (
+                    round(self.compress_seconds * 1000 / megabytes, 2) if megabytes else 0
+                ),
+            }
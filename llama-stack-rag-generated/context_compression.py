@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Extractive compression of retrieved context before it goes in the prompt.
+
+Usually only a sentence or two of a retrieved chunk answers the question, the
+rest costs prefill time. The chunks are split into sentences (list items,
+headings and code blocks count as one sentence each), every sentence is
+scored against the question, and the best ones are kept until a token
+budget is used up. Kept sentences stay in the chunk they came from and in
+their original order, so each document in the prompt is still attributable
+to its source; chunks left with no sentences are dropped.
+
+Sentences are scored by lexical overlap with the question (question keywords
+weighted by how rare they are among the sentences), or by the cosine
+similarity of their embeddings when an embedder is given, ideally one that
+caches so sentences seen for earlier questions are not embedded again.
+
+To show what compression does to answer latency, a share of the questions
+(`holdout`) is answered with the context uncompressed, and answer times are
+kept for both.
+"""
+
+import math
+import random
+import re
+import threading
+import time
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from query_expansion import keywords
+
+_FENCE = re.compile(r"^ {0,3}(```|~~~)")
+_BLOCK_START = re.compile(r"^\s*(#{1,6}\s|[-*+]\s|\d+[.)]\s|\|)")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9`*_\[(\"'])")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough number of tokens in a text, about four characters per token."""
+    return max(1, math.ceil(len(text) / 4))
+
+
+def split_sentences(text: str) -> list:
+    """
+    Split markdown into sentences.
+
+    Returns:
+        Sentences in order, each list item, heading, table row and code block being one
+    """
+    sentences = []
+    paragraph: list = []
+    fence: list = []
+
+    def flush() -> None:
+        if paragraph:
+            sentences.extend(_SENTENCE_END.split(" ".join(paragraph)))
+            paragraph.clear()
+
+    for line in text.splitlines():
+        if fence:
+            fence.append(line)
+            if _FENCE.match(line):
+                sentences.append("\n".join(fence))
+                fence = []
+        elif _FENCE.match(line):
+            flush()
+            fence = [line]
+        elif not line.strip():
+            flush()
+        else:
+            if _BLOCK_START.match(line):
+                flush()
+            paragraph.append(line.strip())
+    flush()
+    if fence:
+        sentences.append("\n".join(fence))  # code block left open
+    return [sentence for sentence in sentences if sentence.strip()]
+
+
+class Compression(NamedTuple):
+    """The compressed context of one question."""
+
+    documents: list  # the documents to put in the prompt
+    kept: list  # positions of the original documents they came from
+    tokens_before: int
+    tokens_after: int
+    compressed: bool  # False if held out and left as it was
+
+
+class ContextCompressor:
+    """Keeps the sentences of retrieved documents that best match the question."""
+
+    def __init__(
+        self,
+        budget_tokens: int,
+        embedder=None,
+        *,
+        holdout: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        """
+        Args:
+            budget_tokens: Estimated tokens of context to keep
+            embedder: Scores sentences by embedding similarity, lexical overlap if None
+            holdout: Share of questions left uncompressed to compare answer latency with
+            seed: Seed for picking the questions held out
+        """
+        self.budget_tokens = budget_tokens
+        self.embedder = embedder
+        self.holdout = holdout
+        self._random = random.Random(seed)
+
+        self._lock = threading.Lock()
+        self.questions = 0
+        self.held_out = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self.compress_seconds = 0.0
+        self._answers = {True: [0, 0.0], False: [0, 0.0]}  # compressed -> count, seconds
+
+    def _score(self, question: str, sentences: list) -> np.ndarray:
+        """How well each sentence matches the question."""
+        if self.embedder is not None:
+            vectors = np.asarray(self.embedder([question, *sentences]), dtype=np.float32)
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            return vectors[1:] @ vectors[0]
+
+        words = [set(keywords(sentence).split()) for sentence in sentences]
+        wanted = set(keywords(question).split())
+        frequency = {word: sum(word in sentence for sentence in words) for word in wanted}
+        return np.array(
+            [
+                sum(math.log(1 + len(sentences) / frequency[word]) for word in wanted & sentence)
+                / math.sqrt(len(sentence) + 1)
+                for sentence in words
+            ],
+            dtype=np.float32,
+        )
+
+    def compress(
+        self, question: str, documents: list, budget_tokens: Optional[int] = None
+    ) -> Compression:
+        """
+        Compress the documents retrieved for a question.
+
+        Args:
+            question: The question
+            documents: The contents of the retrieved documents, most relevant first
+            budget_tokens: Estimated tokens to keep, the compressor's budget if None
+
+        Returns:
+            The Compression, with the documents unchanged if the question was held out
+        """
+        start = time.perf_counter()
+        tokens_before = sum(estimate_tokens(str(document)) for document in documents)
+        if self._random.random() < self.holdout:
+            with self._lock:
+                self.questions += 1
+                self.held_out += 1
+            return Compression(
+                list(documents), list(range(len(documents))), tokens_before, tokens_before, False
+            )
+
+        units = [
+            (position, index, sentence)
+            for position, document in enumerate(documents)
+            for index, sentence in enumerate(split_sentences(str(document)))
+        ]
+        budget_tokens = self.budget_tokens if budget_tokens is None else budget_tokens
+        chosen = set()
+        if units:
+            scores = self._score(question, [sentence for _, _, sentence in units])
+            used = 0
+            # best first; equal scores favour the more relevant document, then earlier text
+            for unit in sorted(range(len(units)), key=lambda unit: -scores[unit]):
+                tokens = estimate_tokens(units[unit][2])
+                if used + tokens <= budget_tokens or not chosen:
+                    chosen.add(unit)
+                    used += tokens
+
+        kept_sentences: dict = {}
+        for unit in sorted(chosen):
+            position, _, sentence = units[unit]
+            kept_sentences.setdefault(position, []).append(sentence)
+        kept = sorted(kept_sentences)
+        compressed = ["\n".join(kept_sentences[position]) for position in kept]
+        tokens_after = sum(estimate_tokens(document) for document in compressed)
+
+        with self._lock:
+            self.questions += 1
+            self.tokens_before += tokens_before
+            self.tokens_after += tokens_after
+            self.compress_seconds += time.perf_counter() - start
+        return Compression(compressed, kept, tokens_before, tokens_after, True)
+
+    def record_answer(self, compressed: bool, seconds: float) -> None:
+        """Account for how long answering took, with or without compressed context."""
+        with self._lock:
+            self._answers[compressed][0] += 1
+            self._answers[compressed][1] += seconds
+
+    def stats(self) -> dict:
+        """How much the context shrank and the answer latency with and without compression."""
+        with self._lock:
+            compressed = self.questions - self.held_out
+            return {
+                "questions": self.questions,
+                "held_out": self.held_out,
+                "tokens_before": self.tokens_before,
+                "tokens_after": self.tokens_after,
+                "compression_ratio": (
+                    round(self.tokens_before / self.tokens_after, 2) if self.tokens_after else None
+                ),
+                "avg_compress_ms": (
+                    round(self.compress_seconds * 1000 / compressed, 3) if compressed else 0
+                ),
+                **{
+                    f"avg_answer_ms_{name}": (round(total * 1000 / count, 1) if count else None)
+                    for name, (count, total) in (
+                        ("compressed", self._answers[True]),
+                        ("uncompressed", self._answers[False]),
+                    )
+                },
+            }
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Watch a docs tree and report the files that were created, changed or deleted.
+
+On Linux the tree is watched with inotify (through ctypes, so nothing needs to
+be installed), elsewhere or if inotify can not be set up it is polled. Bursts
+of changes, such as an editor saving or a git checkout, are debounced into a
+single batch of paths handed to a callback on the watcher thread.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+# inotify event masks from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class _Inotify:
+    """Recursive inotify watch on a directory tree."""
+
+    def __init__(self, root: Path):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.root = root
+        self._dirs: dict = {}
+        self.watch_tree(root)
+
+    def watch_tree(self, directory: Path) -> None:
+        """Watch directory and every directory below it."""
+        for path, _dirs, _files in os.walk(directory):
+            wd = self._add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+            self._dirs[wd] = Path(path)
+
+    def read(self, timeout: float) -> set:
+        """Paths with events, waiting at most timeout seconds for the first one."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        paths = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                paths.add(self.root)  # events were lost, look at everything again
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            directory = self._dirs.get(wd)
+            if directory is None:
+                continue
+            path = directory / name
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and path.is_dir():
+                    self.watch_tree(path)
+                paths.add(path)  # files may have landed before the watch was added
+            elif name.endswith(".md"):
+                paths.add(path)
+        return paths
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class _Poller:
+    """Finds changes by comparing the modification time and size of the files."""
+
+    def __init__(self, root: Path, interval: float):
+        self.root = root
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self) -> dict:
+        snapshot = {}
+        for path in self.root.rglob("*.md"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def read(self, timeout: float) -> set:
+        """Paths that changed since the last call, waiting at most timeout seconds."""
+        time.sleep(min(timeout, self.interval))
+        snapshot = self._scan()
+        changed = {
+            path
+            for path in snapshot.keys() | self._snapshot.keys()
+            if snapshot.get(path) != self._snapshot.get(path)
+        }
+        self._snapshot = snapshot
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+class CorpusWatcher:
+    """Background thread reporting debounced batches of changed markdown paths."""
+
+    def __init__(
+        self,
+        directory: str,
+        on_change: Callable[[list], None],
+        debounce: float = 1.0,
+        max_delay: float = 10.0,
+        poll_interval: float = 2.0,
+    ):
+        """
+        Args:
+            directory: Root of the docs tree to watch
+            on_change: Called on the watcher thread with the sorted list of changed paths;
+                a path is a markdown file or a directory whose contents should be rescanned
+            debounce: Seconds without further changes before a batch is reported
+            max_delay: Longest a change waits while changes keep arriving
+            poll_interval: Seconds between scans when inotify is not available
+        """
+        self.directory = Path(directory)
+        self.on_change = on_change
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+
+        self.backend: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.events = 0
+        self.batches = 0
+        self.errors = 0
+
+    def _open(self):
+        """Set up inotify, falling back to polling."""
+        if sys.platform.startswith("linux"):
+            try:
+                source = _Inotify(self.directory)
+                self.backend = "inotify"
+                return source
+            except (OSError, AttributeError) as e:
+                print(f"⚠️  inotify not available ({e}), polling every {self.poll_interval}s")
+        self.backend = "polling"
+        return _Poller(self.directory, self.poll_interval)
+
+    def start(self) -> None:
+        """Start watching on a daemon thread."""
+        self._thread = threading.Thread(target=self._run, name="corpus-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop watching and wait for a batch in progress to finish."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        source = self._open()
+        print(f"👀 Watching {self.directory} for changes ({self.backend})")
+        pending: set = set()
+        first_change = last_change = 0.0
+        try:
+            while not self._stop.is_set():
+                if pending:
+                    now = time.monotonic()
+                    flush_at = min(last_change + self.debounce, first_change + self.max_delay)
+                    timeout = max(0.0, flush_at - now)
+                else:
+                    timeout = self.poll_interval
+
+                paths = source.read(timeout) if timeout > 0 else set()
+                now = time.monotonic()
+                if paths:
+                    self.events += len(paths)
+                    if not pending:
+                        first_change = now
+                    pending |= paths
+                    last_change = now
+
+                if pending and (
+                    now - last_change >= self.debounce or now - first_change >= self.max_delay
+                ):
+                    batch, pending = sorted(pending), set()
+                    self.batches += 1
+                    try:
+                        self.on_change(batch)
+                    except Exception as e:
+                        self.errors += 1
+                        print(f"❌ Error applying changes from {self.directory}: {e}")
+        finally:
+            source.close()
+
+    def stats(self) -> dict:
+        """Backend in use and the number of changes seen and batches applied."""
+        return {
+            "backend": self.backend,
+            "events": self.events,
+            "batches": self.batches,
+            "errors": self.errors,
+        }
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Maximal marginal relevance (MMR) selection of retrieved chunks.
+
+The chunks closest to a question are often close to each other too, several
+pieces of the same region of one document, and each one after the first adds
+prompt tokens but little new information. MMR picks chunks one at a time,
+each time taking the one with the best trade-off between its similarity to
+the question and its similarity to the chunks already picked:
+
+    lambda * sim(chunk, question) - (1 - lambda) * max sim(chunk, picked)
+
+Chunks nearly identical to one already picked can also be dropped
+altogether, so fewer chunks cover the same ground.
+"""
+
+from typing import Optional
+
+import numpy as np
+
+from local_index import normalize
+
+
+def mmr_select(
+    query: np.ndarray,
+    candidates: np.ndarray,
+    k: int,
+    lambda_: float = 0.5,
+    max_similarity: Optional[float] = None,
+) -> list:
+    """
+    Pick a relevant but diverse subset of candidates.
+
+    Args:
+        query: Embedding of the question
+        candidates: Embeddings of the candidates, one row each
+        k: Most candidates to pick
+        lambda_: Weight of relevance against diversity, 1 ranks by relevance only
+        max_similarity: Candidates at least this similar to a picked one are never
+            picked, None to keep them in the running
+
+    Returns:
+        Positions of the picked candidates, in the order they were picked
+    """
+    if len(candidates) == 0 or k <= 0:
+        return []
+    candidates = normalize(candidates)
+    relevance = candidates @ normalize(query)
+    similarity = candidates @ candidates.T
+
+    picked = []
+    redundancy = np.zeros(len(candidates), dtype=np.float32)  # max similarity to the picked
+    available = np.ones(len(candidates), dtype=bool)
+    while len(picked) < k and available.any():
+        scores = np.where(available, lambda_ * relevance - (1 - lambda_) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        picked.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+        if max_similarity is not None:
+            available &= redundancy < max_similarity
+    return picked
@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""
+Stable document IDs and a local manifest giving upsert/delete semantics.
+
+Document IDs are derived from the path of a file relative to the root of the
+docs tree, so they do not collide between directories and do not shift when
+files are added. The manifest records the content hash and version of every
+document in the knowledge bank: unchanged documents are not sent again, a
+changed document is inserted under a new version, and a removed document is
+tombstoned. The vector_io API has no way to delete chunks, so chunks carry
+their document version in their metadata and retrieval drops chunks whose
+version is no longer current.
+
+Documents are split into heading-delimited sections, each with a stable ID
+and its own hash and version, so a change to one section of a large
+document only re-embeds that section. Each document also gets a short
+summary (title, headings and lead paragraph) for picking out the documents
+worth searching before searching their chunks.
+"""
+
+import bisect
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from pathlib import Path
+
+_HEADING = re.compile(r"^ {0,3}(#{1,6})\s+(.*?)\s*#*\s*$")
+_FENCE = re.compile(r"^ {0,3}(```|~~~)")
+
+
+def document_id_for(path, root) -> str:
+    """Stable ID for a file: its POSIX path relative to root without the .md suffix."""
+    relative = Path(path).resolve().relative_to(Path(root).resolve()).as_posix()
+    return relative[: -len(".md")] if relative.endswith(".md") else relative
+
+
+def content_hash(content: str) -> str:
+    """Hash identifying a version of a document's content."""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def split_sections(content: str) -> list:
+    """
+    Split markdown into sections, each starting at a heading.
+
+    Args:
+        content: Markdown text of a document
+
+    Returns:
+        List of (section_id, heading, text) tuples in document order. The ID is a
+        slug of the heading, numbered if the heading repeats; text before the first
+        heading gets the ID "intro". Sections with no text are left out.
+    """
+    sections = []
+    heading, lines = "", []
+    in_fence = False
+    for line in content.splitlines(keepends=True):
+        match = None if in_fence else _HEADING.match(line)
+        if _FENCE.match(line):
+            in_fence = not in_fence  # headings inside code blocks are not headings
+        if match:
+            sections.append((heading, "".join(lines)))
+            heading, lines = match.group(2), []
+        lines.append(line)
+    sections.append((heading, "".join(lines)))
+
+    result = []
+    seen: dict = {}
+    for heading, text in sections:
+        if not text.strip():
+            continue
+        slug = re.sub(r"[^a-z0-9]+", "-", heading.lower()).strip("-") or "intro"
+        seen[slug] = seen.get(slug, 0) + 1
+        section_id = slug if seen[slug] == 1 else f"{slug}-{seen[slug]}"
+        result.append((section_id, heading, text))
+    return result
+
+
+def overlapped_chunks(text: str, window_tokens: int, overlap_tokens: int) -> list:
+    """
+    Split text into overlapping windows the way rag_tool.insert chunks a document.
+
+    A window starts every window_tokens - overlap_tokens tokens and holds the words
+    starting within window_tokens of it. Tokens are estimated at about four characters
+    each, where rag_tool counts them with the model's tokenizer, so the windows only
+    line up roughly with its chunks.
+
+    Args:
+        text: Text to split
+        window_tokens: Tokens per window
+        overlap_tokens: Tokens a window shares with the next one
+
+    Returns:
+        The text of each window, in order
+    """
+    words = re.findall(r"\s*\S+", text)
+    starts = []  # token each word starts at
+    position = 0
+    for word in words:
+        starts.append(position)
+        position += max(1, math.ceil(len(word.strip()) / 4))
+    chunks = []
+    for begin in range(0, position, window_tokens - overlap_tokens):
+        first = bisect.bisect_left(starts, begin)
+        last = bisect.bisect_left(starts, begin + window_tokens)
+        chunks.append("".join(words[first:last]).strip())
+    return [chunk for chunk in chunks if chunk]
+
+
+def document_summary(content: str, title: str, lead_chars: int = 500) -> str:
+    """
+    Coarse text standing for a whole document: its title, headings and lead paragraph.
+
+    Args:
+        content: Markdown text of the document
+        title: Title to use if the document does not start with a heading
+        lead_chars: Longest the lead paragraph is kept
+
+    Returns:
+        The summary text
+    """
+    sections = split_sections(content)
+    headings = [heading for _, heading, _ in sections if heading]
+    if sections and sections[0][1]:
+        title = headings.pop(0)
+
+    lead = ""
+    for _, heading, text in sections:
+        # the heading line is not part of the lead paragraph
+        body = text.partition("\n")[2] if heading else text
+        paragraphs = [
+            paragraph.strip()
+            for paragraph in re.split(r"\n\s*\n", body)
+            if paragraph.strip() and not _FENCE.match(paragraph.strip())
+        ]
+        if paragraphs:
+            lead = paragraphs[0][:lead_chars]
+            break
+
+    summary = title
+    if headings:
+        summary += "\nSections: " + "; ".join(headings)
+    if lead:
+        summary += "\n" + lead
+    return summary
+
+
+class DocumentManifest:
+    """
+    Content hash and version of every document ingested into a knowledge bank.
+
+    Every change is also appended to a journal next to the manifest and synced to
+    disk before the call returns, so a run that dies halfway resumes from the last
+    document it finished rather than from the start. Before sections are inserted
+    their versions are reserved in the journal, so chunks from an insert that was
+    cut short are never mistaken for current ones. save() folds the journal into
+    the manifest.
+
+    Several processes can ingest into the same manifest at once as long as they
+    work on different documents and each has a journal of its own (use_journal).
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: JSON file the manifest is kept in
+        """
+        self.path = Path(path)
+        self.journal_path = self.path.with_suffix(self.path.suffix + ".journal")
+        self._lock = threading.Lock()
+        self.documents: dict = {}
+        # documents checkpointed in the journal by a run that did not finish
+        self.recovered: set = set()
+        self._load()
+
+    def _journals(self) -> list:
+        """Every journal of this manifest, including those of other processes."""
+        return sorted(self.path.parent.glob(f"{self.path.name}.journal*"))
+
+    def _load(self) -> None:
+        """Read the manifest and apply the changes journaled since it was last saved."""
+        self.documents = {}
+        self.recovered = set()
+        if self.path.exists():
+            with self.path.open(encoding="utf-8") as f:
+                self.documents = json.load(f).get("documents", {})
+        for journal_path in self._journals():
+            with journal_path.open(encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        break  # the last write was cut short
+                    op = record.pop("op")
+                    if op == "reserve":
+                        self._apply_reserve(**record)
+                    elif op == "upsert":
+                        self._apply_upsert(**record)
+                        self.recovered.add(record["doc_id"])
+                    elif op == "delete":
+                        self._apply_delete(**record)
+
+    def reload(self) -> None:
+        """Pick up changes other processes have journaled since the manifest was loaded."""
+        with self._lock:
+            self._load()
+
+    def use_journal(self, name: str) -> None:
+        """Journal to a file of this process's own, when several processes ingest at once."""
+        with self._lock:
+            self.journal_path = self.path.with_suffix(f"{self.path.suffix}.journal.{name}")
+
+    def _journal(self, record: dict) -> None:
+        """Durably append a change to the journal (called with the lock held)."""
+        with self.journal_path.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def clear(self) -> None:
+        """Forget everything, used when the knowledge bank turns out to be empty."""
+        with self._lock:
+            self.documents = {}
+            self.recovered = set()
+            for journal_path in self._journals():
+                journal_path.unlink(missing_ok=True)
+
+    def replace(self, documents: dict) -> None:
+        """Take over the documents of another manifest, used when loading a snapshot."""
+        with self._lock:
+            self.documents = documents
+            self.recovered = set()
+            for journal_path in self._journals():
+                journal_path.unlink(missing_ok=True)
+
+    def is_unchanged(self, doc_id: str, digest: str) -> bool:
+        """Whether the current version of doc_id already has this content."""
+        entry = self.documents.get(doc_id)
+        return (
+            entry is not None
+            and not entry.get("deleted")
+            and not entry.get("pending")
+            and entry["hash"] == digest
+        )
+
+    def changed_sections(self, doc_id: str, section_hashes: dict) -> dict:
+        """
+        Work out which sections of a document have to be (re-)inserted.
+
+        Args:
+            doc_id: ID of the document
+            section_hashes: Map of section ID to the hash of its current text
+
+        Returns:
+            Map of section ID to the version to insert it under, for new and changed
+            sections only
+        """
+        entry = self.documents.get(doc_id) or {}
+        known = entry.get("sections", {})
+        changed = {}
+        for section_id, digest in section_hashes.items():
+            previous = known.get(section_id)
+            if previous is None:
+                changed[section_id] = 1
+            elif entry.get("deleted") or previous.get("removed") or previous["hash"] != digest:
+                # versions keep counting up so chunks of an older version never come back,
+                # including versions reserved by an insert that may have half happened
+                changed[section_id] = max(previous["version"], previous.get("reserved", 0)) + 1
+        return changed
+
+    def record_pending(self, doc_id: str, inserted: dict) -> None:
+        """
+        Reserve the versions sections of doc_id are about to be inserted under.
+
+        Args:
+            doc_id: ID of the document
+            inserted: Map of section ID to the version it will be inserted under
+        """
+        with self._lock:
+            self._journal({"op": "reserve", "doc_id": doc_id, "inserted": inserted})
+            self._apply_reserve(doc_id, inserted)
+
+    def _apply_reserve(self, doc_id: str, inserted: dict) -> None:
+        entry = self.documents.setdefault(
+            doc_id, {"hash": None, "version": 0, "source": None, "sections": {}}
+        )
+        sections = entry.setdefault("sections", {})
+        for section_id, version in inserted.items():
+            # a placeholder section with no hash and version 0 matches no chunk
+            sections.setdefault(section_id, {"hash": None, "version": 0})["reserved"] = version
+        entry["pending"] = True
+
+    def record_upsert(
+        self, doc_id: str, digest: str, source: str, section_hashes: dict, inserted: dict
+    ) -> None:
+        """
+        Record that the changed sections of doc_id have been inserted.
+
+        Args:
+            doc_id: ID of the document
+            digest: Hash of the whole document
+            source: Path the document was read from
+            section_hashes: Map of section ID to hash for every section now in the document
+            inserted: Map of section ID to version for the sections that were inserted
+        """
+        with self._lock:
+            self._journal(
+                {
+                    "op": "upsert",
+                    "doc_id": doc_id,
+                    "digest": digest,
+                    "source": source,
+                    "section_hashes": section_hashes,
+                    "inserted": inserted,
+                }
+            )
+            self._apply_upsert(doc_id, digest, source, section_hashes, inserted)
+
+    def _apply_upsert(
+        self, doc_id: str, digest: str, source: str, section_hashes: dict, inserted: dict
+    ) -> None:
+        entry = self.documents.get(doc_id) or {}
+        sections = entry.get("sections", {})
+        for section_id, section in sections.items():
+            if section_id not in section_hashes:
+                section["removed"] = True
+        for section_id, version in inserted.items():
+            sections[section_id] = {"hash": section_hashes[section_id], "version": version}
+        self.documents[doc_id] = {
+            "hash": digest,
+            "version": entry.get("version", 0) + 1,
+            "source": source,
+            "sections": sections,
+        }
+
+    def invalidate_section(self, doc_id: str, section_id: str) -> None:
+        """Make the next ingestion insert a section again, when its chunks went missing."""
+        with self._lock:
+            entry = self.documents.get(doc_id)
+            if entry and section_id in entry.get("sections", {}):
+                entry["sections"][section_id]["hash"] = None
+                entry["pending"] = True
+
+    def record_delete(self, doc_id: str) -> None:
+        """Tombstone doc_id so that none of its chunks are used any more."""
+        with self._lock:
+            if doc_id in self.documents:
+                self._journal({"op": "delete", "doc_id": doc_id})
+                self._apply_delete(doc_id)
+
+    def _apply_delete(self, doc_id: str) -> None:
+        if doc_id in self.documents:
+            self.documents[doc_id]["deleted"] = True
+
+    def _entries(self) -> list:
+        """A snapshot of the (ID, entry) pairs, safe to iterate while ingestion adds more."""
+        with self._lock:
+            return list(self.documents.items())
+
+    def live_ids(self) -> set:
+        """IDs of the documents that have not been deleted."""
+        return {doc_id for doc_id, entry in self._entries() if not entry.get("deleted")}
+
+    def has_superseded(self) -> bool:
+        """Whether the knowledge bank holds chunks that retrieval has to drop."""
+        return any(
+            entry["version"] > 1 or entry.get("deleted") or entry.get("pending")
+            for _, entry in self._entries()
+        )
+
+    def is_current(self, metadata: dict) -> bool:
+        """Whether a retrieved chunk belongs to the current version of its document."""
+        section_id = metadata.get("section_id")
+        if section_id is not None:
+            doc_id, _, section_id = section_id.rpartition("#")
+            entry = self.documents.get(doc_id)
+            if entry is None:
+                return True
+            section = entry.get("sections", {}).get(section_id)
+            return (
+                not entry.get("deleted")
+                and section is not None
+                and not section.get("removed")
+                and int(metadata.get("section_version", 0)) == section["version"]
+            )
+
+        # chunks inserted before documents were split into sections
+        doc_id = metadata.get("document_id")
+        version = metadata.get("document_version")
+        if doc_id is None or version is None:
+            return True  # inserted without versioning, nothing to compare against
+        entry = self.documents.get(doc_id)
+        if entry is None:
+            return True
+        return not entry.get("deleted") and int(version) == entry["version"]
+
+    def save(self) -> None:
+        """Write the manifest atomically and start new journals."""
+        with self._lock:
+            tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+            with tmp_path.open("w", encoding="utf-8") as f:
+                json.dump({"documents": self.documents}, f, indent=1, sort_keys=True)
+                f.flush()
+                os.fsync(f.fileno())
+            tmp_path.replace(self.path)
+            for journal_path in self._journals():
+                journal_path.unlink(missing_ok=True)
+            self.recovered = set()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Retrieval from several knowledge banks at once, merged into one ranked list.
+
+Every bank is searched in a thread of its own, started for the fan-out, and
+has a deadline of its own, counted from when its search starts. A bank that
+has not answered by its deadline, or that fails, is left out and the others
+are merged without it, so a slow bank costs at most its deadline rather than
+the whole question. The search is told the seconds it has so it can give up
+then too; one that does not keeps only its own thread busy.
+
+Scores from different banks are not comparable as they are (different
+collections, different providers), so each bank's scores are normalized
+before merging: min-max scales them to [0, 1] within the bank, z-score
+centers them on the bank's mean in units of its standard deviation. Either
+way a bank's best hit scores high even if nothing it has is relevant, since
+scores are only compared within the bank. A bank with fewer than two distinct
+scores has nothing to scale them by and keeps its raw scores.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Callable, NamedTuple, Optional, Union
+
+
+class BankResult(NamedTuple):
+    """What one knowledge bank returned to a fan-out."""
+
+    knowledge_bank_id: str
+    hits: list
+    seconds: float
+    error: Optional[str] = None  # why there are no hits, None if the bank answered
+
+
+def fan_out(
+    search: Callable[[str, float], list],
+    knowledge_bank_ids: list,
+    deadline: Union[float, dict],
+) -> list:
+    """
+    Search several knowledge banks concurrently.
+
+    Args:
+        search: Searches one knowledge bank, given its ID and the seconds it has,
+            returning hits best first
+        knowledge_bank_ids: The banks to search
+        deadline: Seconds every bank has to answer, or a dict of seconds by bank ID
+            with a "default" entry for the banks not in it
+
+    Returns:
+        One BankResult per bank, in the order given
+    """
+    deadlines = deadline if isinstance(deadline, dict) else {"default": deadline}
+    started: dict = {}  # bank ID -> when its search started
+
+    def timed(knowledge_bank_id: str) -> tuple:
+        started[knowledge_bank_id] = time.monotonic()
+        hits = search(knowledge_bank_id, deadlines.get(knowledge_bank_id, deadlines["default"]))
+        return hits, time.monotonic() - started[knowledge_bank_id]
+
+    # a pool of the fan-out's own, so no search waits for a thread, and searches that
+    # miss their deadline do not hold up the searches of other questions
+    executor = ThreadPoolExecutor(
+        max_workers=max(1, len(knowledge_bank_ids)), thread_name_prefix="fan-out"
+    )
+    futures = {bank: executor.submit(timed, bank) for bank in knowledge_bank_ids}
+    executor.shutdown(wait=False)
+    results = {}
+    # wait on the earliest deadline first so no bank is waited on past its own
+    for bank in sorted(futures, key=lambda bank: deadlines.get(bank, deadlines["default"])):
+        bank_deadline = deadlines.get(bank, deadlines["default"])
+        try:
+            hits, seconds = futures[bank].result(
+                timeout=max(
+                    0.0, started.get(bank, time.monotonic()) + bank_deadline - time.monotonic()
+                )
+            )
+            results[bank] = BankResult(bank, hits, seconds)
+        except FutureTimeoutError:
+            results[bank] = BankResult(
+                bank, [], bank_deadline, f"missed its {bank_deadline}s deadline"
+            )
+        except Exception as e:
+            results[bank] = BankResult(
+                bank, [], time.monotonic() - started[bank], str(e) or type(e).__name__
+            )
+    return [results[bank] for bank in knowledge_bank_ids]
+
+
+def normalize_scores(scores: list, method: str = "minmax") -> list:
+    """
+    Put the scores of one bank on a scale comparable with other banks.
+
+    With fewer than two distinct scores there is no spread to scale by, and a single
+    hit would get the top score whatever it is, so the raw scores are kept instead.
+
+    Args:
+        scores: Scores of a bank's hits
+        method: "minmax" or "zscore"
+
+    Returns:
+        The normalized scores, in the same order
+    """
+    if method not in ("minmax", "zscore"):
+        raise ValueError(f"unknown score normalization: {method}")
+    if len(set(scores)) < 2:
+        return list(scores)
+    if method == "minmax":
+        low, high = min(scores), max(scores)
+        return [(score - low) / (high - low) for score in scores]
+    mean = sum(scores) / len(scores)
+    deviation = (sum((score - mean) ** 2 for score in scores) / len(scores)) ** 0.5
+    return [(score - mean) / deviation for score in scores]
+
+
+def merge_ranked(
+    bank_results: list, limit: int, method: str = "minmax", key: Optional[Callable] = None
+) -> list:
+    """
+    Merge the hits of several banks into one list by normalized score.
+
+    Args:
+        bank_results: BankResults from fan_out, hits need a `score`
+        limit: Most hits to return
+        method: Score normalization, see normalize_scores
+        key: Identifies the same hit from different banks, which is kept once
+
+    Returns:
+        Hits, best first; equal scores are ordered by rank within their bank, then
+        by the order of the banks
+    """
+    scored = []
+    for order, result in enumerate(bank_results):
+        normalized = normalize_scores([float(hit.score) for hit in result.hits], method)
+        scored.extend(
+            (-score, rank, order, hit)
+            for rank, (hit, score) in enumerate(zip(result.hits, normalized))
+        )
+    scored.sort(key=lambda entry: entry[:3])
+
+    merged = []
+    seen = set()
+    for _, _, _, hit in scored:
+        if key is not None:
+            identity = key(hit)
+            if identity in seen:
+                continue
+            seen.add(identity)
+        merged.append(hit)
+        if len(merged) == limit:
+            break
+    return merged
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Rate control for ingestion against a possibly overloaded Llama Stack server.
+
+The number of in-flight insert requests is adjusted with additive-increase /
+multiplicative-decrease (AIMD): every request that completes quickly grows the
+limit by about one request per round trip, and a transient error or a latency
+well above the best seen so far halves it. Transient failures are retried with
+jittered exponential backoff.
+
+The insert path (RAG tool or vector_io) is probed once and then kept behind a
+circuit breaker that only switches paths if the chosen one starts failing.
+"""
+
+import contextlib
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+from llama_stack_client import APIConnectionError, APIStatusError
+
+# HTTP status codes worth retrying, the server is overloaded or restarting
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+def is_transient(error: Exception) -> bool:
+    """Whether a failed request is worth retrying."""
+    if isinstance(error, APIStatusError):
+        return error.status_code in TRANSIENT_STATUS_CODES
+    return isinstance(error, (APIConnectionError, ConnectionError, TimeoutError))
+
+
+class AIMDLimiter:
+    """In-flight request limit adapted to the latency and errors seen."""
+
+    def __init__(
+        self,
+        initial: float = 2,
+        minimum: float = 1,
+        maximum: float = 32,
+        decrease_factor: float = 0.5,
+        latency_tolerance: float = 3.0,
+    ):
+        """
+        Args:
+            initial: Starting in-flight limit
+            minimum: Lowest in-flight limit
+            maximum: Highest in-flight limit
+            decrease_factor: Factor the limit is multiplied by on a congestion signal
+            latency_tolerance: Latency above this multiple of the baseline counts as congestion
+        """
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+
+        self.baseline: Optional[float] = None
+        self.in_flight = 0
+        self._last_decrease = float("-inf")
+        self._condition = threading.Condition()
+
+        self.increases = 0
+        self.decreases = 0
+        self.peak_limit = self.limit
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Hold one of the in-flight slots for the duration of the block."""
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+    def record(self, started: float, ok: bool) -> None:
+        """
+        Adjust the limit for a request that has finished.
+
+        Args:
+            started: time.monotonic() when the request was sent
+            ok: False if the request failed in a way that signals an overloaded server.
+                Requests that failed for any other reason should not be recorded, as how
+                quickly they fail says nothing about the load.
+        """
+        latency = time.monotonic() - started
+        with self._condition:
+            if ok:
+                if self.baseline is None or latency < self.baseline:
+                    self.baseline = latency
+                else:
+                    # let the baseline drift up slowly so one lucky request does not pin it
+                    self.baseline += 0.01 * (latency - self.baseline)
+            congested = not ok or latency > self.baseline * self.latency_tolerance
+
+            if congested:
+                # only back off once per round trip, requests sent before the last
+                # decrease were already in flight when it happened
+                if started >= self._last_decrease:
+                    self.limit = max(self.minimum, self.limit * self.decrease_factor)
+                    self._last_decrease = time.monotonic()
+                    self.decreases += 1
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                self.increases += 1
+                self.peak_limit = max(self.peak_limit, self.limit)
+            self._condition.notify_all()
+
+    def stats(self) -> dict:
+        """Current and peak limit along with the adjustments made."""
+        return {
+            "limit": round(self.limit, 2),
+            "peak_limit": round(self.peak_limit, 2),
+            "in_flight": self.in_flight,
+            "increases": self.increases,
+            "decreases": self.decreases,
+            "baseline_ms": round(self.baseline * 1000, 1) if self.baseline else None,
+        }
+
+
+def retry_with_backoff(
+    func: Callable,
+    attempts: int = 5,
+    base_delay: float = 0.5,
+    max_delay: float = 30.0,
+    should_retry: Callable[[Exception], bool] = is_transient,
+):
+    """
+    Call func, retrying transient failures with jittered exponential backoff.
+
+    Args:
+        func: The call to make
+        attempts: Maximum number of attempts
+        base_delay: Delay cap in seconds before the first retry, doubled for each retry
+        max_delay: Largest delay cap in seconds
+        should_retry: Decides whether a failure is worth retrying
+
+    Returns:
+        The result of func
+
+    Raises:
+        Exception: The last failure if it was not transient or no attempts were left
+    """
+    for attempt in range(attempts):
+        try:
+            return func()
+        except Exception as e:
+            if attempt == attempts - 1 or not should_retry(e):
+                raise
+            # "full jitter" spreads the retries of many workers out over the whole window
+            delay = random.uniform(0, min(max_delay, base_delay * 2**attempt))
+            print(f"   🔁 Transient error ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+    return None
+
+
+class InsertPathBreaker:
+    """
+    Circuit breaker choosing between alternative insert paths.
+
+    The paths are configured once, in order of preference, from a capability
+    probe. The first path is used until it fails failure_threshold times in a
+    row, after which the breaker opens and the next path is used. After
+    retry_after seconds a single insert is sent down the preferred path again
+    and the breaker closes if it succeeds.
+    """
+
+    def __init__(self, failure_threshold: int = 3, retry_after: float = 60.0):
+        """
+        Args:
+            failure_threshold: Consecutive failures that open the breaker
+            retry_after: Seconds before the preferred path is tried again
+        """
+        self.failure_threshold = failure_threshold
+        self.retry_after = retry_after
+
+        self.paths: list = []
+        self._active = 0
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self.switches = 0
+
+    def configure(self, probe: Callable[[], list]) -> None:
+        """Set the paths in order of preference, calling probe only the first time."""
+        with self._lock:
+            if not self.paths:
+                self.paths = list(probe())
+
+    def current(self) -> str:
+        """The path the next insert should use."""
+        with self._lock:
+            if (
+                self._active != 0
+                and not self._trial_in_flight
+                and time.monotonic() - self._opened_at >= self.retry_after
+            ):
+                self._trial_in_flight = True
+                return self.paths[0]
+            return self.paths[self._active]
+
+    def record(self, path: str, ok: bool) -> None:
+        """Record the outcome of an insert sent down path."""
+        with self._lock:
+            if path != self.paths[self._active]:
+                if not (self._trial_in_flight and path == self.paths[0]):
+                    return  # a late outcome from before the last switch
+                # the outcome of a trial of the preferred path
+                self._trial_in_flight = False
+                if ok:
+                    print(f"   🔌 Insert path '{path}' is working again, switching back")
+                    self._active = 0
+                    self._failures = 0
+                    self.switches += 1
+                else:
+                    self._opened_at = time.monotonic()
+                return
+
+            if ok:
+                self._failures = 0
+                return
+            self._failures += 1
+            if self._failures >= self.failure_threshold and len(self.paths) > 1:
+                self._active = (self._active + 1) % len(self.paths)
+                self._failures = 0
+                self._opened_at = time.monotonic()
+                self.switches += 1
+                print(
+                    f"   🔌 Insert path '{path}' keeps failing, switching to '{self.paths[self._active]}'"
+                )
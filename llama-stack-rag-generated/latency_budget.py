@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Context size chosen per question to hold a p95 answer latency.
+
+Most of what a question costs the model server is prefill, and prefill time
+grows with the prompt, so the amount of retrieved context is the lever for
+answer latency. The controller keeps the answer latencies of recent
+questions with the size of their prompts. Every `adjust_every` answers it
+compares their p95 with the latency SLO.
+
+- Above the SLO, the context token budget is cut by `decrease_factor`.
+- Above the target (`headroom` times the SLO) but within the SLO, the budget
+  is cut by the tokens the excess latency buys at the measured prefill rate.
+- Clearly below the target, the budget grows by what the spare latency
+  buys, one chunk's worth at most.
+
+top_k follows the budget in proportion. The budget shrinks fast during a
+spike and grows back slowly after it.
+
+Prefill tokens/sec is measured from the time to the first token when
+answers are streamed. Otherwise it is the inverse of the slope of answer
+latency against prompt tokens over the recent answers.
+"""
+
+import math
+import threading
+from collections import deque
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from context_compression import estimate_tokens
+
+
+class Budget(NamedTuple):
+    """How much context one question gets."""
+
+    top_k: int  # chunks to retrieve
+    context_tokens: int  # estimated tokens of context to put in the prompt
+
+
+def trim_documents(documents: list, context_tokens: int) -> list:
+    """The leading documents that fit in context_tokens, at least the first one."""
+    kept = []
+    used = 0
+    for document in documents:
+        used += estimate_tokens(str(document))
+        if kept and used > context_tokens:
+            break
+        kept.append(document)
+    return kept
+
+
+class ContextBudgetController:
+    """Context token budget and top_k adapted to the recent p95 answer latency."""
+
+    def __init__(
+        self,
+        slo_seconds: float,
+        *,
+        top_k: int = 5,
+        context_tokens: int = 640,
+        min_context_tokens: int = 128,
+        max_context_tokens: int = 2048,
+        max_top_k: int = 10,
+        headroom: float = 0.8,
+        decrease_factor: float = 0.5,
+        adjust_every: int = 20,
+        window: int = 200,
+    ):
+        """
+        Args:
+            slo_seconds: p95 answer latency to hold
+            top_k: Chunks retrieved at the starting budget
+            context_tokens: Starting context token budget
+            min_context_tokens: Smallest budget, the context is never cut below it
+            max_context_tokens: Largest budget
+            max_top_k: Most chunks retrieved
+            headroom: p95 aimed at, as a share of the SLO
+            decrease_factor: Factor the budget is multiplied by when the SLO is missed
+            adjust_every: Answers between adjustments, their p95 decides the next one
+            window: Recent answers prefill tokens/sec is estimated from
+        """
+        self.slo_seconds = slo_seconds
+        self.initial = Budget(top_k, context_tokens)
+        self.min_context_tokens = min_context_tokens
+        self.max_context_tokens = max_context_tokens
+        self.max_top_k = max_top_k
+        self.headroom = headroom
+        self.decrease_factor = decrease_factor
+        self.adjust_every = adjust_every
+
+        self.context_tokens = float(context_tokens)
+        self._recent: list = []  # answer seconds since the last adjustment
+        self._answers: deque = deque(maxlen=window)  # (prompt tokens, answer seconds)
+        self._first_token_rate: Optional[float] = None
+
+        self._lock = threading.Lock()
+        self.answered = 0
+        self.shrinks = 0
+        self.expansions = 0
+        self.last_p95: Optional[float] = None
+
+    def budget(self) -> Budget:
+        """The context to give the next question."""
+        with self._lock:
+            context_tokens = int(self.context_tokens)
+        scaled = round(self.initial.top_k * context_tokens / self.initial.context_tokens)
+        return Budget(min(self.max_top_k, max(1, scaled)), context_tokens)
+
+    def prefill_tokens_per_second(self) -> Optional[float]:
+        """Measured prefill speed, None until there is enough to measure it from."""
+        if self._first_token_rate is not None:
+            return self._first_token_rate
+        if len(self._answers) < 2:
+            return None
+        tokens, seconds = np.array(self._answers, dtype=np.float64).T
+        spread = tokens.var()
+        if spread == 0:
+            return None
+        slope = float(((tokens - tokens.mean()) * (seconds - seconds.mean())).mean() / spread)
+        return 1 / slope if slope > 0 else None
+
+    def record(
+        self, prompt_tokens: int, seconds: float, first_token_seconds: Optional[float] = None
+    ) -> None:
+        """
+        Account for an answered question, adjusting the budget every adjust_every answers.
+
+        Args:
+            prompt_tokens: Estimated tokens of the prompt
+            seconds: Answer latency
+            first_token_seconds: Time to the first answer token if the answer was streamed
+        """
+        with self._lock:
+            self.answered += 1
+            self._answers.append((prompt_tokens, seconds))
+            if first_token_seconds:
+                rate = prompt_tokens / first_token_seconds
+                self._first_token_rate = (
+                    rate
+                    if self._first_token_rate is None
+                    else self._first_token_rate + 0.2 * (rate - self._first_token_rate)
+                )
+            self._recent.append(seconds)
+            if len(self._recent) >= self.adjust_every:
+                self._adjust(float(np.percentile(self._recent, 95)))
+                self._recent = []
+
+    def _adjust(self, p95: float) -> None:
+        """Move the budget towards the target latency (called with the lock held)."""
+        self.last_p95 = p95
+        target = self.slo_seconds * self.headroom
+        rate = self.prefill_tokens_per_second()
+        step = self.initial.context_tokens / self.initial.top_k  # about one chunk
+        if p95 > target:
+            cut = (p95 - target) * rate if rate else step
+            if p95 > self.slo_seconds:
+                cut = max(cut, self.context_tokens * (1 - self.decrease_factor))
+            budget = max(self.min_context_tokens, self.context_tokens - cut)
+            if budget < self.context_tokens:
+                self.context_tokens = budget
+                self.shrinks += 1
+        elif p95 < target * 0.9:  # a dead band so the budget does not oscillate at the target
+            grow = min(step, (target - p95) * rate) if rate else step
+            budget = min(self.max_context_tokens, self.context_tokens + grow)
+            if budget > self.context_tokens:
+                self.context_tokens = budget
+                self.expansions += 1
+
+    def stats(self) -> dict:
+        """The current budget, what it was chosen from and how often it moved."""
+        budget = self.budget()
+        with self._lock:
+            rate = self.prefill_tokens_per_second()
+            return {
+                "slo_ms": round(self.slo_seconds * 1000, 1),
+                "p95_ms": round(self.last_p95 * 1000, 1) if self.last_p95 is not None else None,
+                "prefill_tokens_per_second": (
+                    round(rate, 1) if rate and math.isfinite(rate) else None
+                ),
+                "top_k": budget.top_k,
+                "context_tokens": budget.context_tokens,
+                "answered": self.answered,
+                "shrinks": self.shrinks,
+                "expansions": self.expansions,
+            }
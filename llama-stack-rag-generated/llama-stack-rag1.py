@@ -1,12 +1,59 @@
 #!/usr/bin/env python3
 
+import argparse
+import asyncio
+import functools
 import os
+import socket
+import subprocess
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Optional
 
+import numpy as np
 from llama_stack_client import LlamaStackClient
 from llama_stack_client.types.shared_params import Document
 
+import rag_daemon
+from admission import AdmissionController
+from bank_router import BankRouter
+from compact_payloads import CompactPayloadClient
+from context_compression import ContextCompressor
+from corpus_watcher import CorpusWatcher
+from diversity import mmr_select
+from doc_manifest import (
+    DocumentManifest,
+    content_hash,
+    document_id_for,
+    document_summary,
+    overlapped_chunks,
+    split_sections,
+)
+from fan_out import fan_out, merge_ranked
+from ingest_control import AIMDLimiter, InsertPathBreaker, is_transient, retry_with_backoff
+from latency_budget import ContextBudgetController
+from local_index import (
+    CachedEmbedder,
+    HashingEmbedder,
+    Hit,
+    LocalVectorIndex,
+    SentenceTransformerEmbedder,
+)
+from metadata_filter import MetadataFilter
+from micro_batcher import MicroBatcher
+from query_expansion import (
+    local_variants,
+    model_variant_prompt,
+    parse_model_variants,
+    reciprocal_rank_fusion,
+)
+from scheduler import BULK, INTERACTIVE, PriorityScheduler
+from shard_queue import ShardQueue, plan_shards
+from vector_snapshot import load_snapshot, save_snapshot
+
 # Configuration
 LLAMA_STACK_URL = "http://10.1.2.128:8321"
 MODEL_NAME = "meta-llama/Llama-3.1-8B-Instruct"
@@ -14,6 +61,162 @@ TIMEOUT = 120
 QUESTION = "Should I use npm to start a node.js application?"
 KNOWLEDGE_BANK_ID = "nodejs-reference-architecture"
 MARKDOWN_DIR = "nodejs-reference-architecture"
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBEDDING_DIMENSION = 384
+# Records what has been ingested so that only changed documents are sent again
+MANIFEST_FILE = f".{KNOWLEDGE_BANK_ID}-manifest.json"
+
+# Daemon configuration (used with --serve)
+DAEMON_HOST = "127.0.0.1"
+DAEMON_PORT = 8765
+DAEMON_AGENT_SESSIONS = 4
+# Concurrent retrievals arriving within this window are dispatched together
+RETRIEVAL_BATCH_MAX_WAIT_MS = 5
+RETRIEVAL_BATCH_MAX_SIZE = 16
+# Admission control: questions beyond the concurrency limit queue up, questions that
+# find the queue full or wait longer than the timeout are rejected straight away
+ADMISSION_MAX_CONCURRENCY = 4
+ADMISSION_MAX_QUEUE = 32
+ADMISSION_QUEUE_TIMEOUT = 10
+# Questions admitted while this many others are waiting take the cheaper degraded path
+DEGRADE_QUEUE_DEPTH = 8
+DEGRADED_MAX_TOKENS = 200
+DEGRADED_SKIP_RAG = False
+
+# Requests allowed in flight against the Llama Stack server, shared between interactive
+# questions and ingestion. Ingestion only uses the slots questions are not using.
+SERVER_SLOTS = 8
+# Ingestion retries transient failures up to INGEST_RETRY_ATTEMPTS times with jittered
+# backoff, the client does not retry them on top
+INGEST_RETRY_ATTEMPTS = 5
+
+# Compression for large request bodies ("gzip", "zstd" or None). Only use this if the
+# server, or a proxy in front of it, decompresses request bodies
+REQUEST_COMPRESSION = None
+REQUEST_COMPRESSION_MIN_BYTES = 16 * 1024
+
+SCHEDULER = PriorityScheduler(total_slots=SERVER_SLOTS)
+# Ingestion adapts its in-flight inserts (AIMD) between 1 and the most slots the scheduler
+# gives bulk traffic, more would only wait for the scheduler
+INGEST_MAX_IN_FLIGHT = SCHEDULER.idle_bulk_slots
+INGEST_LIMITER = AIMDLimiter(maximum=INGEST_MAX_IN_FLIGHT)
+# Which insert path (rag_tool or vector_io) to use, probed once per process
+INSERT_PATHS = InsertPathBreaker()
+# rag_tool chunks sections into windows of this many tokens, overlapping by a quarter
+RAG_TOOL_CHUNK_TOKENS = 128
+RAG_TOOL_CHUNK_OVERLAP = RAG_TOOL_CHUNK_TOKENS // 4
+# HTTP client used by the Llama Stack client, encodes and compresses request bodies
+HTTP_CLIENT = CompactPayloadClient(
+    compression=REQUEST_COMPRESSION,
+    min_size=REQUEST_COMPRESSION_MIN_BYTES,
+    # also used directly for calls the client library has no method for
+    base_url=LLAMA_STACK_URL,
+    timeout=TIMEOUT,
+)
+MANIFEST = DocumentManifest(MANIFEST_FILE)
+# Full ingestion runs and watch mode updates take turns
+INGEST_LOCK = threading.Lock()
+
+# Watch mode, seconds without further changes before they are pushed to the knowledge bank
+WATCH_DEBOUNCE = 1.0
+WATCH_POLL_INTERVAL = 2.0  # used when inotify is not available
+
+# Snapshots, chunks per embeddings request when exporting and per insert when importing
+SNAPSHOT_EMBED_BATCH = 32
+SNAPSHOT_INSERT_BATCH = 256
+
+# Retrieval from a vector index kept next to the client (--retrieval local or auto)
+RETRIEVAL_MODE = "server"
+RETRIEVAL_SERVER_TIMEOUT = 2.0  # with auto, slower server queries are answered locally
+LOCAL_INDEX_FILE = f".{KNOWLEDGE_BANK_ID}-local-index.npz"
+LOCAL_INDEX_IVF_MIN_CHUNKS = 20000  # smaller indexes are searched exhaustively
+LOCAL_INDEX_NPROBE = 8
+# Quantize the local index to fit it on small query nodes: None, "int8" (4x smaller)
+# or "pq" (product quantization, 32x smaller with 48 subvectors of 384 dimensions)
+LOCAL_INDEX_QUANTIZATION = None
+LOCAL_INDEX_PQ_SUBVECTORS = 48
+LOCAL_INDEX_RESCORE = 4  # candidates per result rescored with the float32 vectors, 0 to skip
+
+# Retrieval restricted by chunk metadata (--filter)
+FILTER_OVERFETCH = 4  # chunks asked for per result when the server can only filter afterwards
+FILTER_PUSHDOWN: dict = {}  # knowledge bank ID -> whether the server filters by metadata
+
+# Two-stage retrieval (--hierarchical): the documents closest to the question are
+# picked from a coarse index of document summaries, then only their chunks are searched.
+# The summaries cost an insert per document, so they are only kept, in a vector database
+# of their own, for the banks in DOCUMENT_INDEX_BANKS (added by --hierarchical) or for
+# every bank with DOCUMENT_INDEX
+DOCUMENT_INDEX = False
+DOCUMENT_INDEX_BANKS: set = set()
+HIERARCHICAL_RETRIEVAL = False
+HIERARCHICAL_DOCUMENTS = 5  # documents whose chunks are searched
+DOCUMENT_KEYS = ("document_id", "doc_id", "source", "title", "type")  # metadata summaries carry
+
+# Multi-query retrieval (--query-expansion): a few variants of the question are searched
+# at once and their results fused with reciprocal rank fusion
+QUERY_EXPANSION = None  # None, "local" (keywords and parts of the question) or "model"
+QUERY_EXPANSION_VARIANTS = 3  # searches per question, the question itself included
+QUERY_EXPANSION_MODEL = MODEL_NAME  # rephrasing a question does not need a large model
+QUERY_EXPANSION_MAX_TOKENS = 100
+RRF_K = 60
+QUERY_EXECUTOR = ThreadPoolExecutor(max_workers=SERVER_SLOTS, thread_name_prefix="retrieval")
+
+# Retrieval from more knowledge banks than KNOWLEDGE_BANK_ID (--knowledge-bank), searched
+# concurrently and merged by normalized score
+FAN_OUT_DEADLINE = 3.0  # seconds a bank has to answer before it is left out
+FAN_OUT_DEADLINES: dict = {}  # knowledge bank ID -> a deadline of its own
+FAN_OUT_NORMALIZATION = "minmax"  # or "zscore"
+# when the bank searched in this thread must have answered by (time.monotonic()), so
+# the time spent waiting for a server slot comes out of the request's timeout
+SEARCH_DEADLINE = threading.local()
+
+# Routing questions to the knowledge banks likely to answer them (--route), by the
+# centroid of each bank's document summaries, recorded when the bank is ingested
+ROUTER_FILE = ".knowledge-bank-router.json"  # shared by the banks ingested from here
+ROUTER_TOP = 2  # most banks a confident route searches
+ROUTER_MIN_SCORE = 0.1
+ROUTER_MARGIN = 0.05  # lead over the next bank needed to leave it out
+ROUTER_AUDIT_RATE = 0.05  # confident routes still searching every bank, to measure recall
+# Banks with no recorded profile are profiled at startup from the chunks these return
+ROUTER_PROBE_QUERIES = (
+    "overview",
+    "getting started",
+    "configuration",
+    "example",
+    "best practices",
+    "troubleshooting",
+)
+ROUTER_PROBE_CHUNKS = 20  # chunks kept per probe query
+
+# Maximal marginal relevance selection of the retrieved chunks (--mmr), so chunks that
+# repeat each other do not take up the prompt
+MMR_SELECTION = False
+MMR_FETCH_FACTOR = 3  # candidates retrieved per chunk kept
+MMR_LAMBDA = 0.5  # 1 ranks by relevance only, lower values favour diversity
+MMR_MAX_SIMILARITY = 0.95  # chunks this similar to a kept one are dropped
+EMBEDDING_CACHE_SIZE = 10000  # texts whose local embeddings are remembered
+
+# Extractive compression of the retrieved context (--compress-context), only the sentences
+# that best match the question go in the prompt
+CONTEXT_COMPRESSION = None  # None, "lexical" (word overlap) or "embedding" (local embeddings)
+CONTEXT_TOKEN_BUDGET = 300  # estimated tokens of context kept
+CONTEXT_COMPRESSION_HOLDOUT = 0.05  # questions answered uncompressed, to compare latency with
+
+# Context sized to hold a p95 answer latency (--latency-slo, with --serve): top_k and the
+# context token budget shrink when answers get slow and grow back when there is headroom
+LATENCY_SLO = None  # seconds
+LATENCY_CONTEXT_TOKENS = 640  # budget to start from without --compress-context, 5 chunks
+LATENCY_MIN_CONTEXT_TOKENS = 128
+LATENCY_MAX_CONTEXT_TOKENS = 2048
+LATENCY_MAX_TOP_K = 10
+LATENCY_HEADROOM = 0.8  # p95 aimed at, as a share of the SLO
+
+# Sharded ingestion, worker processes (on this host or others sharing the directory)
+# claim shards of the corpus from a file-based queue
+SHARD_QUEUE_DIR = f".{KNOWLEDGE_BANK_ID}-shards"
+SHARD_LEASE_SECONDS = 120  # a claim not renewed for this long is handed to another worker
+SHARD_WORKERS = 4
+SHARDS_PER_WORKER = 4  # more shards than workers evens out the finishing times
 
 
 def _create_vector_database(client: LlamaStackClient, knowledge_bank_id: str) -> None:
@@ -24,8 +227,8 @@ def _create_vector_database(client: LlamaStackClient, knowledge_bank_id: str) ->
             json={
                 "vector_db_id": knowledge_bank_id,
                 "provider_id": "faiss",
-                "embedding_model": "all-MiniLM-L6-v2",
-                "embedding_dimension": 384,
+                "embedding_model": EMBEDDING_MODEL,
+                "embedding_dimension": EMBEDDING_DIMENSION,
             },
         )
         if vector_db_response.status_code == 200:
@@ -41,6 +244,16 @@ def _create_vector_database(client: LlamaStackClient, knowledge_bank_id: str) ->
             print("💾 Proceeding with existing configuration")
 
 
+def _document_bank_id(knowledge_bank_id: str) -> str:
+    """ID of the vector database holding the document summaries of a knowledge bank."""
+    return f"{knowledge_bank_id}-documents"
+
+
+def _keeps_document_index(knowledge_bank_id: str) -> bool:
+    """Whether the summaries of the documents of a knowledge bank are kept."""
+    return DOCUMENT_INDEX or knowledge_bank_id in DOCUMENT_INDEX_BANKS
+
+
 def _find_markdown_files(directory: str) -> list:
     """Find all markdown files in the directory."""
     md_files = []
@@ -51,6 +264,119 @@ def _find_markdown_files(directory: str) -> list:
     return md_files
 
 
+def _bulk_request(func):
+    """
+    Send an ingestion request to the server.
+
+    The request waits for a slot from the AIMD limiter and for spare capacity from
+    the scheduler, and is retried with jittered exponential backoff if it fails
+    with a transient error.
+
+    Args:
+        func: Makes the request
+
+    Returns:
+        The result of func
+    """
+
+    def attempt():
+        with INGEST_LIMITER.slot(), SCHEDULER.slot(BULK):
+            started = time.monotonic()
+            try:
+                result = func()
+            except Exception as e:
+                # a request refused as it is (a 400 or 404) says nothing about the load
+                if is_transient(e):
+                    INGEST_LIMITER.record(started, ok=False)
+                raise
+            INGEST_LIMITER.record(started, ok=True)
+            return result
+
+    return retry_with_backoff(attempt, attempts=INGEST_RETRY_ATTEMPTS)
+
+
+def _bulk_client(client: LlamaStackClient) -> LlamaStackClient:
+    """The client for ingestion requests, which _bulk_request retries instead of the client."""
+    return client.with_options(max_retries=0)
+
+
+def _probe_insert_paths(client: LlamaStackClient) -> list:
+    """
+    Find out once whether the server provides the RAG tool, rather than paying for a
+    failed rag_tool.insert for every document on servers that do not.
+
+    Args:
+        client: The Llama Stack client instance
+
+    Returns:
+        The insert paths in order of preference
+    """
+    try:
+        toolgroups = client.toolgroups.list()
+    except Exception as e:
+        print(f"⚠️  Could not probe the ingestion capability, assuming the RAG tool: {e}")
+        return ["rag_tool", "vector_io"]
+
+    if any(toolgroup.identifier == "builtin::rag" for toolgroup in toolgroups):
+        print("🔧 RAG tool available, inserting documents with rag_tool.insert")
+        return ["rag_tool", "vector_io"]
+    print("🔧 RAG tool not available, inserting documents with vector_io.insert")
+    return ["vector_io", "rag_tool"]
+
+
+def _section_metadata(
+    doc_id: str, section_id: str, version: int, heading: str, source: str
+) -> dict:
+    """Metadata stored with the chunks of a section."""
+    return {
+        "document_id": doc_id,
+        # rag_tool.insert overwrites document_id with the section's ID, doc_id is left alone
+        "doc_id": doc_id,
+        "section_id": f"{doc_id}#{section_id}",
+        "section_version": version,
+        "section": heading,
+        "source": source,
+        "type": "markdown",
+        "title": Path(source).name.replace(".md", ""),
+    }
+
+
+def _document_metadata(doc_id: str, version: int, source: str) -> dict:
+    """Metadata stored with the summary of a document."""
+    return {
+        "document_id": doc_id,
+        "doc_id": doc_id,
+        "document_version": version,
+        "source": source,
+        "type": "markdown",
+        "title": Path(source).name.replace(".md", ""),
+    }
+
+
+def _insert_document_summary(
+    client: LlamaStackClient,
+    knowledge_bank_id: str,
+    doc_id: str,
+    content: str,
+    source: str,
+    *,
+    version: Optional[int] = None,
+) -> None:
+    """Insert the summary of a document into the document index."""
+    if version is None:
+        # the summary belongs to the version the upsert is about to record
+        version = MANIFEST.documents.get(doc_id, {}).get("version", 0) + 1
+    metadata = _document_metadata(doc_id, version, source)
+    _bulk_request(
+        lambda: client.vector_io.insert(
+            vector_db_id=_document_bank_id(knowledge_bank_id),
+            chunks=[
+                {"content": document_summary(content, metadata["title"]), "metadata": metadata}
+            ],
+        )
+    )
+
+
 def _process_markdown_file(
     client: LlamaStackClient, md_file: str, directory: str, knowledge_bank_id: str
 ) -> tuple[bool, int]:
@@ -60,149 +386,1493 @@ def _process_markdown_file(
             content = f.read()
 
         if not content.strip():  # Skip empty files
-            return False, 0
+            return True, 0
 
         # Convert Path to string to ensure JSON serialization
         md_file_str = str(md_file)
 
-        # Create document ID from file path
-        doc_id = (
-            Path(md_file).name.replace(directory + "/", "").replace("/", "_").replace(".md", "")
+        # Create a stable document ID from the path relative to the docs directory
+        doc_id = document_id_for(md_file, directory)
+
+        # Upsert: documents whose content has not changed are not sent again
+        digest = content_hash(content)
+        if MANIFEST.is_unchanged(doc_id, digest):
+            return True, 0
+
+        # Only the sections that changed are re-embedded, each under a stable chunk ID
+        # and a new version which supersedes the chunks of the old one
+        sections = split_sections(content)
+        section_hashes = {section_id: content_hash(text) for section_id, _, text in sections}
+        changed = MANIFEST.changed_sections(doc_id, section_hashes)
+
+        print(f"📝 Processing: {md_file_str} ({len(changed)} of {len(sections)} sections changed)")
+
+        section_chunks = [
+            (
+                f"{doc_id}#{section_id}",
+                text,
+                _section_metadata(doc_id, section_id, changed[section_id], heading, md_file_str),
+            )
+            for section_id, heading, text in sections
+            if section_id in changed
+        ]
+
+        if not section_chunks:
+            # Only sections were removed, there is nothing to insert but the summary
+            if _keeps_document_index(knowledge_bank_id):
+                _insert_document_summary(client, knowledge_bank_id, doc_id, content, md_file_str)
+            MANIFEST.record_upsert(doc_id, digest, md_file_str, section_hashes, changed)
+            return True, 0
+
+        # Reserve the versions first so a crash mid-insert can never leave chunks
+        # behind that a later run mistakes for current ones
+        MANIFEST.record_pending(doc_id, changed)
+
+        insert_path = INSERT_PATHS.current()
+        try:
+            if insert_path == "rag_tool":
+                # Create a Document object for each changed section using the Llama Stack
+                # client types, this lets Llama Stack handle the chunking internally
+                documents = [
+                    Document(
+                        document_id=chunk_id,
+                        content=text,
+                        mime_type="text/markdown",
+                        metadata=metadata,
+                    )
+                    for chunk_id, text, metadata in section_chunks
+                ]
+                # Use the RAG tool to insert the sections with automatic chunking
+                print("   📄 Sending changed sections to Llama Stack for automatic chunking")
+                _bulk_request(
+                    lambda: client.tool_runtime.rag_tool.insert(
+                        documents=documents,
+                        vector_db_id=knowledge_bank_id,
+                        chunk_size_in_tokens=RAG_TOOL_CHUNK_TOKENS,
+                    )
+                )
+                print(
+                    "   ✅ Document processed successfully (Llama Stack created chunks automatically)"
+                )
+            else:
+                # Use vector_io.insert as the RAG tool is not available, one chunk per section
+                _bulk_request(
+                    lambda: client.vector_io.insert(
+                        vector_db_id=knowledge_bank_id,
+                        chunks=[
+                            {"content": text, "metadata": metadata}
+                            for _, text, metadata in section_chunks
+                        ],
+                    )
+                )
+                print("   ✅ Document processed with vector_io.insert (manual chunking)")
+        except Exception:
+            INSERT_PATHS.record(insert_path, ok=False)
+            raise
+        INSERT_PATHS.record(insert_path, ok=True)
+        if _keeps_document_index(knowledge_bank_id):
+            _insert_document_summary(client, knowledge_bank_id, doc_id, content, md_file_str)
+        MANIFEST.record_upsert(doc_id, digest, md_file_str, section_hashes, changed)
+        return True, len(section_chunks)  # Number of sections re-embedded
+
+    except Exception as e:
+        print(f"❌ Error processing {md_file}: {e}")
+        return False, 0
+
+
+def _prepare_document_index(client: LlamaStackClient, knowledge_bank_id: str) -> None:
+    """
+    Create the document index of a knowledge bank if it is kept, filling in a new one.
+
+    Documents ingested while no document index was kept are unchanged the next time,
+    so a document index that is empty gets the summaries of the current documents here
+    rather than each one when its document next changes.
+
+    Args:
+        client: The Llama Stack client instance
+        knowledge_bank_id: ID of the knowledge bank
+    """
+    if not _keeps_document_index(knowledge_bank_id):
+        return
+    _create_vector_database(client, _document_bank_id(knowledge_bank_id))
+    live_ids = sorted(MANIFEST.live_ids())
+    if not live_ids or _check_vector_database_exists_and_has_content(
+        client, _document_bank_id(knowledge_bank_id)
+    ):
+        return
+
+    print(f"🗂️  Summarizing {len(live_ids)} document(s) ingested without a document index")
+
+    def summarize(doc_id: str) -> None:
+        entry = MANIFEST.documents[doc_id]
+        try:
+            content = Path(entry["source"]).read_text(encoding="utf-8")
+            _insert_document_summary(
+                client,
+                knowledge_bank_id,
+                doc_id,
+                content,
+                entry["source"],
+                version=entry["version"],
+            )
+        except (OSError, TypeError):
+            pass  # gone since it was ingested, the ingestion tombstones it
+        except Exception as e:
+            print(f"⚠️  Could not summarize {doc_id}, it gets its summary when it changes: {e}")
+
+    with ThreadPoolExecutor(max_workers=INGEST_MAX_IN_FLIGHT) as executor:
+        list(executor.map(summarize, live_ids))
+
+
+def _ingest_markdown_documents(
+    client: LlamaStackClient,
+    directory: str,
+    knowledge_bank_id: str,
+    verify_checkpoint: bool = False,
+):
+    """
+    Ingest markdown documents from a directory into Llama Stack's knowledge bank.
+    Uses Llama Stack's built-in document splitting functionality.
+
+    Every finished document is checkpointed, so an ingestion that was interrupted
+    picks up where it stopped the next time it is run.
+
+    Args:
+        client: The Llama Stack client instance
+        directory: Directory containing markdown files
+        knowledge_bank_id: ID for the knowledge bank to store documents
+        verify_checkpoint: Check that checkpointed documents really are in the knowledge bank
+    """
+    print(f"📚 Ingesting markdown documents from {directory}...")
+    print("🔧 Using Llama Stack's built-in document splitting functionality")
+    client = _bulk_client(client)
+
+    try:
+        with INGEST_LOCK:
+            # Create vector database using the faiss provider
+            _create_vector_database(client, knowledge_bank_id)
+            _prepare_document_index(client, knowledge_bank_id)
+
+            # Decide (once per process) how documents are inserted
+            INSERT_PATHS.configure(lambda: _probe_insert_paths(client))
+
+            if MANIFEST.recovered:
+                print(
+                    f"⏯️  Resuming an interrupted ingestion, {len(MANIFEST.recovered)} document(s) already done"
+                )
+                if verify_checkpoint:
+                    missing = _verify_checkpoint(client, knowledge_bank_id)
+                    print(
+                        f"🔎 Verified checkpoint, {missing} section(s) missing will be re-inserted"
+                    )
+
+            # Find all markdown files
+            md_files = _find_markdown_files(directory)
+            print(f"📄 Found {len(md_files)} markdown files")
+
+            # Process the markdown files in parallel, the AIMD limiter finds the rate the
+            # server can sustain and the scheduler keeps the inserts to the capacity not
+            # being used by interactive questions
+            documents_added = 0
+            sections_added = 0
+            executor = ThreadPoolExecutor(max_workers=INGEST_MAX_IN_FLIGHT)
+            try:
+                results = list(
+                    executor.map(
+                        lambda md_file: _process_markdown_file(
+                            client, md_file, directory, knowledge_bank_id
+                        ),
+                        md_files,
+                    )
+                )
+            except KeyboardInterrupt:
+                # Stop starting new files, the ones finished so far are checkpointed
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+            executor.shutdown()
+
+            # Give files that still failed one more go, one at a time, rather than dropping them
+            failed_files = [
+                md_file for md_file, (success, _) in zip(md_files, results) if not success
+            ]
+            if failed_files:
+                print(f"🔁 Retrying {len(failed_files)} failed file(s) sequentially")
+                for md_file in failed_files:
+                    results.append(
+                        _process_markdown_file(client, md_file, directory, knowledge_bank_id)
+                    )
+                    if not results[-1][0]:
+                        print(f"❌ Giving up on {md_file}")
+
+            for success, section_count in results:
+                if success and section_count:
+                    documents_added += 1
+                    sections_added += section_count
+
+            # Documents that are no longer on disk are deleted from the knowledge bank
+            current_ids = {document_id_for(md_file, directory) for md_file in md_files}
+            deleted_ids = MANIFEST.live_ids() - current_ids
+            for doc_id in deleted_ids:
+                MANIFEST.record_delete(doc_id)
+            MANIFEST.save()
+            _update_router_profile(
+                directory, knowledge_bank_id, bool(documents_added or deleted_ids)
+            )
+
+            print(
+                f"✅ Successfully ingested {sections_added} changed sections of {documents_added} documents (Llama Stack created chunks automatically) into knowledge bank"
+            )
+            if deleted_ids:
+                print(f"🗑️  Deleted {len(deleted_ids)} document(s) no longer in {directory}")
+            print(f"📈 Ingestion rate control: {INGEST_LIMITER.stats()}")
+            print(f"📦 Request payloads: {HTTP_CLIENT.stats()}")
+            return True
+
+    except Exception as e:
+        print(f"❌ Error during document ingestion: {e}")
+        return False
+
+
+def _verify_checkpoint(client: LlamaStackClient, knowledge_bank_id: str) -> int:
+    """
+    Check that the documents checkpointed by an interrupted run made it into the knowledge bank.
+
+    Chunks can not be fetched by ID, so each checkpointed section is searched for with its
+    own text and has to come back with its section ID and version. Sections that do not are
+    inserted again by the ingestion that follows.
+
+    Args:
+        client: The Llama Stack client instance
+        knowledge_bank_id: ID of the knowledge bank to check
+
+    Returns:
+        Number of sections that were missing
+    """
+    missing = 0
+    for doc_id in sorted(MANIFEST.recovered):
+        entry = MANIFEST.documents.get(doc_id)
+        if not entry or entry.get("deleted") or not entry.get("source"):
+            continue
+        try:
+            content = Path(entry["source"]).read_text(encoding="utf-8")
+        except OSError:
+            continue  # deleted since, the ingestion tombstones it
+
+        for section_id, _, text in split_sections(content):
+            section = entry["sections"].get(section_id)
+            if section is None or section["hash"] != content_hash(text):
+                continue  # changed since, the ingestion inserts it again anyway
+            results = _bulk_request(
+                lambda text=text: client.vector_io.query(
+                    vector_db_id=knowledge_bank_id, query=text, params={"limit": 10}
+                )
+            )
+            found = any(
+                chunk.metadata.get("section_id") == f"{doc_id}#{section_id}"
+                and int(chunk.metadata.get("section_version", 0)) == section["version"]
+                for chunk in results.chunks or []
+            )
+            if not found:
+                MANIFEST.invalidate_section(doc_id, section_id)
+                missing += 1
+    return missing
+
+
+def _apply_corpus_changes(
+    client: LlamaStackClient, directory: str, knowledge_bank_id: str, paths: list
+) -> None:
+    """
+    Bring the knowledge bank up to date with the changes reported by the corpus watcher.
+
+    Args:
+        client: The Llama Stack client instance
+        directory: Directory containing markdown files
+        knowledge_bank_id: ID of the knowledge bank to update
+        paths: Markdown files that changed, or directories whose contents should be rescanned
+    """
+    client = _bulk_client(client)
+    if _has_untracked_content(client, knowledge_bank_id):
+        return
+    with INGEST_LOCK:
+        INSERT_PATHS.configure(lambda: _probe_insert_paths(client))
+
+        updated = 0
+        affected = []
+        for path in map(Path, paths):
+            if path.is_dir():
+                md_files = _find_markdown_files(path)
+            elif path.is_file():
+                md_files = [path]
+            else:
+                md_files = []  # deleted, or moved out of the tree
+            affected.append(document_id_for(path, directory))
+            for md_file in md_files:
+                success, section_count = _process_markdown_file(
+                    client, md_file, directory, knowledge_bank_id
+                )
+                updated += bool(success and section_count)
+
+        # Documents in the affected files and directories that are no longer on disk
+        def affected_by_change(doc_id: str) -> bool:
+            return any(
+                prefix in {".", doc_id} or doc_id.startswith(prefix + "/") for prefix in affected
+            )
+
+        deleted = [
+            doc_id
+            for doc_id in MANIFEST.live_ids()
+            if affected_by_change(doc_id) and not (Path(directory) / f"{doc_id}.md").exists()
+        ]
+        for doc_id in deleted:
+            MANIFEST.record_delete(doc_id)
+        MANIFEST.save()
+
+    print(f"🔄 Applied changes: {updated} document(s) updated, {len(deleted)} deleted")
+
+
+def _start_corpus_watcher(client: LlamaStackClient) -> CorpusWatcher:
+    """
+    Keep the knowledge bank in sync with MARKDOWN_DIR from a background thread.
+
+    Args:
+        client: The Llama Stack client instance
+
+    Returns:
+        The running watcher
+    """
+    watcher = CorpusWatcher(
+        MARKDOWN_DIR,
+        on_change=lambda paths: _apply_corpus_changes(
+            client, MARKDOWN_DIR, KNOWLEDGE_BANK_ID, paths
+        ),
+        debounce=WATCH_DEBOUNCE,
+        poll_interval=WATCH_POLL_INTERVAL,
+    )
+    watcher.start()
+    return watcher
+
+
+def _run_ingest_worker(client: LlamaStackClient, worker_id: str, workers: int) -> None:
+    """
+    Claim shards from the shard queue and ingest them until none are left.
+
+    Every worker process has a limiter of its own, so each takes its share of
+    INGEST_MAX_IN_FLIGHT to keep the workers together within it.
+
+    Args:
+        client: The Llama Stack client instance
+        worker_id: Name of this worker, unique across the hosts sharing the queue
+        workers: Number of workers ingesting into the server at the same time
+    """
+    max_in_flight = max(1, INGEST_MAX_IN_FLIGHT // workers)
+    INGEST_LIMITER.maximum = max_in_flight
+    INGEST_LIMITER.limit = min(INGEST_LIMITER.limit, max_in_flight)
+    client = _bulk_client(client)
+    # Workers ingest different documents, so each can keep a journal of its own
+    MANIFEST.use_journal(worker_id)
+    INSERT_PATHS.configure(lambda: _probe_insert_paths(client))
+    queue = ShardQueue(SHARD_QUEUE_DIR, lease=SHARD_LEASE_SECONDS)
+
+    shards_done = 0
+    while not queue.finished():
+        shard = queue.claim(worker_id)
+        if shard is None:
+            # The remaining shards are claimed, wait in case a worker dies and its come back
+            time.sleep(SHARD_LEASE_SECONDS / 4)
+            continue
+
+        # See what other workers, including one that held this shard before, ingested
+        MANIFEST.reload()
+        print(f"🧩 {worker_id}: ingesting {shard.shard_id} ({len(shard.files)} files)")
+
+        def ingest(md_file, shard=shard):
+            success, _ = _process_markdown_file(client, md_file, MARKDOWN_DIR, KNOWLEDGE_BANK_ID)
+            shard.advance(md_file, success)
+
+        with queue.hold(shard), ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            list(executor.map(ingest, shard.files))
+        queue.complete(shard)
+        shards_done += 1
+
+    print(f"✅ {worker_id}: finished after {shards_done} shard(s), {INGEST_LIMITER.stats()}")
+    print(f"📦 {worker_id}: request payloads {HTTP_CLIENT.stats()}")
+
+
+def _coordinate_sharded_ingest(
+    client: LlamaStackClient, workers: int, shards: int, *, worker_flags: Optional[list] = None
+) -> bool:
+    """
+    Split the corpus into shards balanced by size and ingest them with worker processes.
+
+    Workers are started on this host, more can join from other hosts sharing this
+    directory by running the script with --ingest-worker. Files the workers failed
+    on are retried here, one at a time, once all shards are done.
+
+    Args:
+        client: The Llama Stack client instance
+        workers: Number of worker processes to start on this host
+        shards: Number of shards to split the corpus into
+        worker_flags: Ingestion flags given to the workers, such as --compress
+
+    Returns:
+        True if every file was ingested
+    """
+    if _has_untracked_content(client, KNOWLEDGE_BANK_ID):
+        return False
+    _create_vector_database(client, KNOWLEDGE_BANK_ID)
+    _prepare_document_index(client, KNOWLEDGE_BANK_ID)
+    md_files = _find_markdown_files(MARKDOWN_DIR)
+    queue = ShardQueue(SHARD_QUEUE_DIR, lease=SHARD_LEASE_SECONDS)
+    planned = plan_shards(md_files, shards)
+    queue.create(planned)
+    print(
+        f"🧩 Split {len(md_files)} files into {len(planned)} shards of about "
+        f"{sum(shard['bytes'] for shard in planned) // len(planned)} bytes"
+    )
+
+    host = socket.gethostname().split(".")[0]
+    processes = [
+        subprocess.Popen(
+            [
+                sys.executable,
+                __file__,
+                "--ingest-worker",
+                "--worker-id",
+                f"{host}-{i}",
+                "--workers",
+                str(workers),
+                *(worker_flags or []),
+            ]
+        )
+        for i in range(workers)
+    ]
+
+    started = time.monotonic()
+    while not queue.finished():
+        time.sleep(5)
+        queue.reclaim_stale()
+        status = queue.status()
+        elapsed = time.monotonic() - started
+        print(
+            f"📊 {status['done']}/{len(planned)} shards done, "
+            f"{status['done_bytes'] / 1e6:.1f}/{status['bytes'] / 1e6:.1f} MB "
+            f"({status['done_bytes'] / 1e6 / elapsed:.2f} MB/s), workers: {status['workers']}"
+        )
+        if (
+            status["pending"]
+            and not status["claimed"]
+            and all(process.poll() is not None for process in processes)
+        ):
+            print("❌ Local workers exited with shards left, run again to resume")
+            return False
+
+    for process in processes:
+        process.wait()
+
+    # Fold the workers' journals into the manifest and tombstone documents no longer on disk
+    MANIFEST.reload()
+    status = queue.status()
+    failed_files = 0
+    if status["failed"]:
+        print(f"🔁 Retrying {len(status['failed'])} failed file(s) sequentially")
+        client = _bulk_client(client)
+        INSERT_PATHS.configure(lambda: _probe_insert_paths(client))
+        for md_file in map(Path, status["failed"]):
+            if not _process_markdown_file(client, md_file, MARKDOWN_DIR, KNOWLEDGE_BANK_ID)[0]:
+                print(f"❌ Giving up on {md_file}")
+                failed_files += 1
+    current_ids = {document_id_for(md_file, MARKDOWN_DIR) for md_file in md_files}
+    deleted_ids = MANIFEST.live_ids() - current_ids
+    for doc_id in deleted_ids:
+        MANIFEST.record_delete(doc_id)
+    MANIFEST.save()
+    _update_router_profile(MARKDOWN_DIR, KNOWLEDGE_BANK_ID)
+
+    elapsed = time.monotonic() - started
+    print(
+        f"✅ Ingested {status['bytes'] / 1e6:.1f} MB in {elapsed:.1f}s "
+        f"({status['bytes'] / 1e6 / elapsed:.2f} MB/s), {failed_files} file(s) failed, "
+        f"{len(deleted_ids)} document(s) deleted"
+    )
+    return not failed_files
+
+
+def _snapshot_chunks(doc_id: str, entry: dict, content: str, windowed: bool) -> tuple[list, set]:
+    """
+    The chunks a document's ingested sections are stored as, for a snapshot.
+
+    Args:
+        doc_id: ID of the document
+        entry: Its manifest entry
+        content: Its current text
+        windowed: Whether the sections were chunked by rag_tool rather than inserted whole
+
+    Returns:
+        Tuple of (chunks, IDs of the sections they are from), sections changed since they
+        were ingested are left out
+    """
+    chunks = []
+    exported = set()
+    sections = entry.get("sections", {})
+    for section_id, heading, text in split_sections(content):
+        section = sections.get(section_id)
+        if section is None or section.get("removed") or section["hash"] != content_hash(text):
+            continue  # changed since it was ingested
+        metadata = _section_metadata(
+            doc_id, section_id, section["version"], heading, entry["source"]
+        )
+        if windowed:
+            # rag_tool stamps the ID of the section, the Document it was sent, on its chunks
+            chunks.extend(
+                {"content": window, "metadata": {**metadata, "document_id": metadata["section_id"]}}
+                for window in overlapped_chunks(text, RAG_TOOL_CHUNK_TOKENS, RAG_TOOL_CHUNK_OVERLAP)
+            )
+        else:
+            chunks.append({"content": text, "metadata": metadata})
+        exported.add(section_id)
+    return chunks, exported
+
+
+def _embed_for_snapshot(client: LlamaStackClient, texts: list) -> np.ndarray:
+    """Embed texts with the knowledge bank's embedding model, SNAPSHOT_EMBED_BATCH at a time."""
+    batches = [
+        texts[start : start + SNAPSHOT_EMBED_BATCH]
+        for start in range(0, len(texts), SNAPSHOT_EMBED_BATCH)
+    ]
+    with ThreadPoolExecutor(max_workers=INGEST_MAX_IN_FLIGHT) as executor:
+        embedded = executor.map(
+            lambda contents: _bulk_request(
+                lambda: client.inference.embeddings(model_id=EMBEDDING_MODEL, contents=contents)
+            ).embeddings,
+            batches,
+        )
+        embeddings = [embedding for batch in embedded for embedding in batch]
+    return np.array(embeddings, dtype=np.float32).reshape(len(texts), EMBEDDING_DIMENSION)
+
+
+def _export_snapshot(client: LlamaStackClient, path: str) -> bool:
+    """
+    Export the current chunks of the knowledge bank, with their embeddings, to a snapshot.
+
+    Llama Stack has no way to list the chunks in a vector database, so the chunks are
+    rebuilt from the sections the manifest records as current, chunked the way the
+    insert path in use stores them, and embedded once with the knowledge bank's
+    embedding model. The summary of every document goes in the snapshot too, for the
+    document index and the router profile.
+
+    Args:
+        client: The Llama Stack client instance
+        path: Snapshot file to write
+
+    Returns:
+        True if the snapshot was written
+    """
+    client = _bulk_client(client)
+    INSERT_PATHS.configure(lambda: _probe_insert_paths(client))
+    windowed = INSERT_PATHS.current() == "rag_tool"
+    chunks = []
+    summaries = []
+    documents = {}
+    for doc_id in sorted(MANIFEST.live_ids()):
+        entry = MANIFEST.documents[doc_id]
+        try:
+            content = Path(entry["source"]).read_text(encoding="utf-8")
+        except (OSError, TypeError):
+            continue  # gone since it was ingested, the next ingestion tombstones it
+
+        document_chunks, exported = _snapshot_chunks(doc_id, entry, content, windowed)
+        if not exported:
+            continue
+        chunks.extend(document_chunks)
+        metadata = _document_metadata(doc_id, entry["version"], entry["source"])
+        summaries.append(
+            {"content": document_summary(content, metadata["title"]), "metadata": metadata}
+        )
+
+        # The snapshot's manifest only vouches for the sections in it, the rest are
+        # inserted by the first ingestion after it is imported
+        sections = entry.get("sections", {})
+        documents[doc_id] = {
+            **entry,
+            "sections": {
+                section_id: section
+                for section_id, section in sections.items()
+                if section_id in exported or section.get("removed")
+            },
+        }
+        if any(
+            section_id not in exported and not section.get("removed")
+            for section_id, section in sections.items()
+        ):
+            documents[doc_id]["pending"] = True
+
+    print(
+        f"🧮 Embedding {len(chunks)} chunks and {len(summaries)} summaries with {EMBEDDING_MODEL}..."
+    )
+    try:
+        embeddings = _embed_for_snapshot(client, [item["content"] for item in chunks + summaries])
+    except Exception as e:
+        print(f"❌ Error embedding chunks for the snapshot: {e}")
+        return False
+
+    save_snapshot(
+        path,
+        embeddings[: len(chunks)],
+        chunks,
+        {
+            "embedding_model": EMBEDDING_MODEL,
+            "embedding_dimension": EMBEDDING_DIMENSION,
+            "knowledge_bank_id": KNOWLEDGE_BANK_ID,
+            "chunking": (
+                {"window_tokens": RAG_TOOL_CHUNK_TOKENS, "overlap_tokens": RAG_TOOL_CHUNK_OVERLAP}
+                if windowed
+                else "section"
+            ),
+            "manifest": documents,
+        },
+        summary_embeddings=embeddings[len(chunks) :],
+        summaries=summaries,
+    )
+    print(f"✅ Exported {len(chunks)} chunks of {len(documents)} documents to {path}")
+    return True
+
+
+def _insert_embedded(
+    client: LlamaStackClient, vector_db_id: str, chunks: list, embeddings: np.ndarray
+) -> None:
+    """Insert chunks with precomputed embeddings, SNAPSHOT_INSERT_BATCH at a time."""
+
+    def insert(start: int) -> None:
+        end = start + SNAPSHOT_INSERT_BATCH
+        batch = [
+            {**chunk, "embedding": embedding.tolist()}
+            for chunk, embedding in zip(chunks[start:end], embeddings[start:end])
+        ]
+        _bulk_request(lambda: client.vector_io.insert(vector_db_id=vector_db_id, chunks=batch))
+
+    with ThreadPoolExecutor(max_workers=INGEST_MAX_IN_FLIGHT) as executor:
+        list(executor.map(insert, range(0, len(chunks), SNAPSHOT_INSERT_BATCH)))
+
+
+def _import_snapshot(client: LlamaStackClient, path: str) -> bool:
+    """
+    Load a snapshot into a new knowledge bank, inserting the chunks with their embeddings.
+
+    The document summaries in the snapshot fill the document index, if one is kept, and
+    give the knowledge bank its router profile.
+
+    Args:
+        client: The Llama Stack client instance
+        path: Snapshot file to read
+
+    Returns:
+        True if the snapshot was loaded
+    """
+    snapshot = load_snapshot(path)
+    info = snapshot.info
+    if (info["embedding_model"], info["embedding_dimension"]) != (
+        EMBEDDING_MODEL,
+        EMBEDDING_DIMENSION,
+    ):
+        print(
+            f"❌ Snapshot was embedded with {info['embedding_model']} "
+            f"({info['embedding_dimension']} dimensions), not {EMBEDDING_MODEL}"
+        )
+        return False
+    if _check_vector_database_exists_and_has_content(client, KNOWLEDGE_BANK_ID):
+        print("❌ Snapshots can only be loaded into a new, empty knowledge bank")
+        return False
+
+    client = _bulk_client(client)
+    _create_vector_database(client, KNOWLEDGE_BANK_ID)
+    print(f"📥 Loading {len(snapshot.chunks)} chunks with precomputed embeddings from {path}...")
+    try:
+        _insert_embedded(client, KNOWLEDGE_BANK_ID, snapshot.chunks, snapshot.embeddings)
+        if snapshot.summaries and _keeps_document_index(KNOWLEDGE_BANK_ID):
+            document_bank_id = _document_bank_id(KNOWLEDGE_BANK_ID)
+            _create_vector_database(client, document_bank_id)
+            _insert_embedded(
+                client, document_bank_id, snapshot.summaries, snapshot.summary_embeddings
+            )
+    except Exception as e:
+        print(f"❌ Error loading the snapshot: {e}")
+        return False
+
+    # Later ingestion runs only send what changed since the snapshot was taken
+    MANIFEST.replace(info["manifest"])
+    MANIFEST.save()
+    try:
+        _set_router_profile(
+            KNOWLEDGE_BANK_ID, [summary["content"] for summary in snapshot.summaries]
+        )
+    except Exception as e:
+        print(f"⚠️  Could not update the router profile of '{KNOWLEDGE_BANK_ID}': {e}")
+    print(f"✅ Loaded {len(snapshot.chunks)} chunks into knowledge bank '{KNOWLEDGE_BANK_ID}'")
+    return True
+
+
+@functools.cache
+def _local_embedder():
+    """Embedder for the local index, the knowledge bank's model if it can be run here."""
+    try:
+        return SentenceTransformerEmbedder(EMBEDDING_MODEL)
+    except ImportError:
+        print(
+            f"⚠️  sentence-transformers is not installed, the local index uses "
+            f"hashed words instead of {EMBEDDING_MODEL}"
+        )
+        return HashingEmbedder(EMBEDDING_DIMENSION)
+
+
+def _load_local_index(
+    directory: str, quantization: Optional[str] = LOCAL_INDEX_QUANTIZATION
+) -> Optional[LocalVectorIndex]:
+    """
+    Load the local vector index, building it again if the markdown files changed.
+
+    Rebuilding only embeds the sections (and document summaries) that changed, the
+    others keep their embeddings from the previous index. When the knowledge bank keeps
+    a document index, so does the local index: the summaries of the markdown files, for
+    two-stage retrieval.
+
+    Args:
+        directory: Directory containing the markdown files
+        quantization: How to quantize the vectors, None, "int8" or "pq"
+
+    Returns:
+        The index, or None if there are no documents to index
+    """
+    if not Path(directory).exists():
+        return None
+
+    md_files = _find_markdown_files(directory)
+    digests = [
+        f"{document_id_for(md_file, directory)}:"
+        f"{content_hash(Path(md_file).read_text(encoding='utf-8'))}\n"
+        for md_file in md_files
+    ]
+    corpus = content_hash("".join(digests))
+
+    embedder = _local_embedder()
+    previous = None
+    if Path(LOCAL_INDEX_FILE).exists():
+        try:
+            previous = LocalVectorIndex.load(LOCAL_INDEX_FILE, embedder)
+            if (
+                previous.info.get("corpus") == corpus
+                and previous.quantization == quantization
+                and (previous.documents is not None or not _keeps_document_index(KNOWLEDGE_BANK_ID))
+            ):
+                previous.nprobe = LOCAL_INDEX_NPROBE
+                previous.rescore = LOCAL_INDEX_RESCORE
+                print(f"✅ Loaded local index of {len(previous)} chunks from {LOCAL_INDEX_FILE}")
+                return previous
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️  Could not load the local index, building it again: {e}")
+
+    chunks = []
+    documents = []
+    for md_file in md_files:
+        content = Path(md_file).read_text(encoding="utf-8")
+        doc_id = document_id_for(md_file, directory)
+        entry = MANIFEST.documents.get(doc_id, {})
+        versions = entry.get("sections", {})
+        for section_id, heading, text in split_sections(content):
+            version = versions.get(section_id, {}).get("version", 0)
+            metadata = _section_metadata(doc_id, section_id, version, heading, str(md_file))
+            chunks.append({"content": text, "metadata": metadata})
+        metadata = _document_metadata(doc_id, entry.get("version", 0), str(md_file))
+        documents.append(
+            {"content": document_summary(content, metadata["title"]), "metadata": metadata}
+        )
+
+    index = LocalVectorIndex(embedder, {"corpus": corpus})
+    if chunks:
+        embeddings, embedded = (
+            previous.embeddings_for(chunks, "section_id")
+            if previous is not None
+            else (None, len(chunks))
+        )
+        print(
+            f"🧮 Building local index of {len(chunks)} chunks with {embedder.name}, "
+            f"embedding {embedded} new or changed..."
         )
-        doc_title = Path(md_file).name.replace(".md", "")
+        index.add(chunks, embeddings)
+    if len(index) >= LOCAL_INDEX_IVF_MIN_CHUNKS:
+        index.build_ivf()
+    index.nprobe = LOCAL_INDEX_NPROBE
+    index.rescore = LOCAL_INDEX_RESCORE
+    if quantization and len(index):
+        report = index.quantize(quantization, subvectors=LOCAL_INDEX_PQ_SUBVECTORS)
+        print(f"🗜️  Quantized the local index: {report}")
+    if _keeps_document_index(KNOWLEDGE_BANK_ID) and documents:
+        index.documents = LocalVectorIndex(embedder)
+        index.documents.add(
+            documents,
+            (
+                previous.documents.embeddings_for(documents, "document_id")[0]
+                if previous is not None and previous.documents is not None
+                else None
+            ),
+        )
+    index.save(LOCAL_INDEX_FILE)
+    print(f"✅ Local index saved to {LOCAL_INDEX_FILE} ({index.stats()['mode']} search)")
+    return index
+
+
+@functools.cache
+def _cached_embedder() -> CachedEmbedder:
+    """The local embedder, remembering recent texts, for chunks and questions seen again."""
+    return CachedEmbedder(_local_embedder(), EMBEDDING_CACHE_SIZE)
+
+
+def _context_compressor(method: Optional[str]) -> Optional[ContextCompressor]:
+    """The context compressor for a --compress-context method, None if not compressing."""
+    if method is None:
+        return None
+    return ContextCompressor(
+        CONTEXT_TOKEN_BUDGET,
+        _cached_embedder() if method == "embedding" else None,
+        holdout=CONTEXT_COMPRESSION_HOLDOUT,
+    )
+
+
+def _context_budget(
+    slo_seconds: Optional[float], compressor: Optional[ContextCompressor]
+) -> Optional[ContextBudgetController]:
+    """The context budget controller for a --latency-slo, None if there is none."""
+    if slo_seconds is None:
+        return None
+    return ContextBudgetController(
+        slo_seconds,
+        context_tokens=compressor.budget_tokens if compressor else LATENCY_CONTEXT_TOKENS,
+        min_context_tokens=LATENCY_MIN_CONTEXT_TOKENS,
+        max_context_tokens=LATENCY_MAX_CONTEXT_TOKENS,
+        max_top_k=LATENCY_MAX_TOP_K,
+        headroom=LATENCY_HEADROOM,
+    )
+
+
+def _open_router() -> BankRouter:
+    """The knowledge bank router with the profiles saved in ROUTER_FILE."""
+    router = BankRouter(
+        _local_embedder(),
+        top=ROUTER_TOP,
+        min_score=ROUTER_MIN_SCORE,
+        margin=ROUTER_MARGIN,
+        audit_rate=ROUTER_AUDIT_RATE,
+    )
+    if Path(ROUTER_FILE).exists():
+        try:
+            router.load(ROUTER_FILE)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️  Ignoring the knowledge bank profiles in {ROUTER_FILE}: {e}")
+    return router
+
+
+def _update_router_profile(directory: str, knowledge_bank_id: str, changed: bool = True) -> None:
+    """
+    Record the router profile of a knowledge bank from the summaries of its documents.
+
+    Args:
+        directory: Directory containing the markdown files of the bank
+        knowledge_bank_id: ID of the bank
+        changed: Whether the documents changed, otherwise an existing profile is kept
+    """
+    try:
+        if not changed and knowledge_bank_id in _open_router().profiles:
+            return
+        summaries = []
+        for md_file in _find_markdown_files(directory):
+            content = Path(md_file).read_text(encoding="utf-8")
+            summaries.append(document_summary(content, Path(md_file).stem))
+        _set_router_profile(knowledge_bank_id, summaries)
+    except Exception as e:
+        print(f"⚠️  Could not update the router profile of '{knowledge_bank_id}': {e}")
+
+
+def _set_router_profile(knowledge_bank_id: str, summaries: list) -> None:
+    """Record the router profile of a knowledge bank from the summaries of its documents."""
+    if not summaries:
+        return
+    router = _open_router()
+    router.set_profile(knowledge_bank_id, router.embedder(summaries))
+    router.save(ROUTER_FILE)
+    print(f"🧭 Updated the router profile of '{knowledge_bank_id}' ({len(summaries)} documents)")
+
 
-        print(f"📝 Processing: {md_file_str}")
+def _profile_unknown_banks(
+    client: LlamaStackClient, router: BankRouter, knowledge_bank_ids: list
+) -> None:
+    """
+    Give the router a profile for each knowledge bank it has none recorded for.
+
+    A bank ingested elsewhere has no documents here to summarize, so the chunks it
+    returns for ROUTER_PROBE_QUERIES stand in for them. These profiles are not saved:
+    they are sampled again at every start, following changes made to the bank.
+
+    Args:
+        client: The Llama Stack client instance
+        router: The router to add the profiles to
+        knowledge_bank_ids: The banks questions are routed between
+    """
+    for knowledge_bank_id in knowledge_bank_ids:
+        if knowledge_bank_id in router.profiles:
+            continue
+        contents: dict = {}  # chunk contents in the order found, without duplicates
+        try:
+            for query in ROUTER_PROBE_QUERIES:
+                for hit in _query_server(client, query, knowledge_bank_id, ROUTER_PROBE_CHUNKS):
+                    contents.setdefault(str(hit.content), None)
+        except Exception as e:
+            print(
+                f"⚠️  Could not sample '{knowledge_bank_id}' for the router, always searching it: {e}"
+            )
+            continue
+        if not contents:
+            continue
+        router.set_profile(knowledge_bank_id, router.embedder(list(contents)))
+        print(f"🧭 Profiled '{knowledge_bank_id}' from {len(contents)} sampled chunks")
+
+
+def _check_vector_database_exists_and_has_content(
+    client: LlamaStackClient, knowledge_bank_id: str
+) -> bool:
+    """
+    Check if the vector database exists and contains documents.
+
+    Args:
+        client: The Llama Stack client instance
+        knowledge_bank_id: ID of the knowledge bank to check
+
+    Returns:
+        True if the database exists and has content, False otherwise
+    """
+    try:
+        # Try to query the vector database with a simple test query
+        results = client.vector_io.query(
+            vector_db_id=knowledge_bank_id, query="test", params={"limit": 1}
+        )
+
+        # If we get results, the database exists and has content
+        if hasattr(results, "chunks") and results.chunks:
+            print(f"✅ Vector database '{knowledge_bank_id}' exists and contains documents")
+            return True
+        print(f"📭 Vector database '{knowledge_bank_id}' exists but is empty")
+        return False
+
+    except Exception as e:
+        error_str = str(e).lower()
+        if "not served" in error_str or "not found" in error_str or "invalid value" in error_str:
+            print(f"❌ Vector database '{knowledge_bank_id}' does not exist")
+            return False
+        print(f"⚠️  Error checking vector database: {e}")
+        return False
+
+
+def _warn_untracked_content(knowledge_bank_id: str) -> None:
+    """Explain why a knowledge bank the manifest has no record of is not ingested into."""
+    print(
+        f"⚠️  '{knowledge_bank_id}' was ingested before documents were tracked in "
+        f"{MANIFEST_FILE}, it is used as it is and not updated"
+    )
+    print(
+        "   Ingesting into it again would insert every document a second time. To have it "
+        f"kept up to date, unregister it (llama-stack-client vector_dbs unregister "
+        f"{knowledge_bank_id}) and run again to re-create it."
+    )
+
+
+def _has_untracked_content(client: LlamaStackClient, knowledge_bank_id: str) -> bool:
+    """
+    Whether the knowledge bank holds chunks the manifest has no record of.
+
+    Llama Stack has no way to list the chunks of a vector database, so the manifest
+    can not be rebuilt from the server.
+    """
+    if MANIFEST.documents or not _check_vector_database_exists_and_has_content(
+        client, knowledge_bank_id
+    ):
+        return False
+    _warn_untracked_content(knowledge_bank_id)
+    return True
+
+
+def _filter_pushdown_supported(client: LlamaStackClient, knowledge_bank_id: str) -> bool:
+    """
+    Find out once per knowledge bank whether the server can filter searches by metadata.
+
+    Only the vector store search API takes metadata filters, servers without it and
+    knowledge banks registered as plain vector databases have to be filtered locally.
+    """
+    supported = FILTER_PUSHDOWN.get(knowledge_bank_id)
+    if supported is None:
+        try:
+            client.vector_stores.search(
+                vector_store_id=knowledge_bank_id,
+                query="test",
+                filters={"type": "eq", "key": "type", "value": "markdown"},
+                max_num_results=1,
+            )
+            supported = True
+        except Exception as e:
+            if is_transient(e):
+                return False  # ask again next time
+            print(f"🏷️  Server can not filter '{knowledge_bank_id}' by metadata, filtering locally")
+            supported = False
+        FILTER_PUSHDOWN[knowledge_bank_id] = supported
+    return supported
+
+
+def _query_server(
+    client: LlamaStackClient,
+    query: str,
+    knowledge_bank_id: str,
+    limit: int,
+    server_filters: Optional[dict] = None,
+) -> list:
+    """Query the server for chunks with their scores, through vector store search if filtering."""
+    with SCHEDULER.slot(INTERACTIVE):
+        deadline = getattr(SEARCH_DEADLINE, "at", None)
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("deadline passed while waiting for a server slot")
+            timeout = getattr(client, "timeout", None)
+            if isinstance(timeout, (int, float)):
+                remaining = min(remaining, timeout)  # such as RETRIEVAL_SERVER_TIMEOUT
+            client = client.with_options(timeout=remaining, max_retries=0)
+        if server_filters:
+            results = client.vector_stores.search(
+                vector_store_id=knowledge_bank_id,
+                query=query,
+                filters=server_filters,
+                max_num_results=limit,
+            )
+            return [
+                Hit(
+                    "".join(part.text for part in result.content if part.type == "text"),
+                    result.attributes or {},
+                    result.score,
+                )
+                for result in results.data
+            ]
+        results = client.vector_io.query(
+            vector_db_id=knowledge_bank_id, query=query, params={"limit": limit}
+        )
+    chunks = getattr(results, "chunks", None) or []
+    scores = getattr(results, "scores", None) or [0.0] * len(chunks)
+    return [
+        Hit(chunk.content, getattr(chunk, "metadata", None) or {}, score)
+        for chunk, score in zip(chunks, scores)
+    ]
+
+
+def _search_chunks(
+    client: LlamaStackClient,
+    query: str,
+    knowledge_bank_id: str,
+    top_k: int,
+    *,
+    local_index: Optional[LocalVectorIndex] = None,
+    retrieval: str = RETRIEVAL_MODE,
+    metadata_filter: Optional[MetadataFilter] = None,
+) -> list:
+    """
+    Find the current chunks most relevant to the query, on the server or in the local index.
+
+    With retrieval "local" only the local index is searched. With "auto" the server is
+    asked first and the local index answers if the server fails or is slower than
+    RETRIEVAL_SERVER_TIMEOUT. A metadata filter is pushed down to the server if it
+    supports filtering; otherwise the local index, which filters before scoring, answers
+    filtered searches if there is one, and failing that the server's results are filtered.
+
+    Returns:
+        Chunks with content and metadata, most relevant first
+    """
+    if local_index is not None and retrieval == "local":
+        return local_index.search(query, top_k, metadata_filter=metadata_filter)
+
+    pushdown = bool(
+        metadata_filter and metadata_filter.server_filters()
+    ) and _filter_pushdown_supported(client, knowledge_bank_id)
+    if local_index is not None and metadata_filter and not pushdown:
+        return local_index.search(query, top_k, metadata_filter=metadata_filter)
+
+    if local_index is not None:
+        # Fall back straight away rather than retrying a slow or failing server
+        client = client.with_options(timeout=RETRIEVAL_SERVER_TIMEOUT, max_retries=0)
+
+    # On the server the document_id of chunks inserted with rag_tool is their section's
+    server_filter = metadata_filter.renamed("document_id", "doc_id") if metadata_filter else None
+
+    # Query the vector database, asking for extra chunks if some will be dropped
+    # for belonging to superseded or deleted versions of a document, or for not
+    # matching the parts of the filter the server could not apply
+    limit = top_k * 2 if MANIFEST.has_superseded() else top_k
+    if server_filter and not (pushdown and not server_filter.prefixes):
+        limit *= FILTER_OVERFETCH
+    try:
+        chunks = _query_server(
+            client,
+            query,
+            knowledge_bank_id,
+            limit,
+            server_filter.server_filters() if pushdown else None,
+        )
+    except Exception as e:
+        if local_index is None:
+            raise
+        print(f"⚠️  Server retrieval failed ({e}), searching the local index")
+        return local_index.search(query, top_k, metadata_filter=metadata_filter)
+
+    return [
+        chunk
+        for chunk in chunks
+        if MANIFEST.is_current(getattr(chunk, "metadata", {}))
+        and (
+            not server_filter or server_filter.matches(_with_doc_id(getattr(chunk, "metadata", {})))
+        )
+    ][:top_k]
+
+
+def _with_doc_id(metadata: dict) -> dict:
+    """Chunk metadata with its doc_id, worked out from its section for chunks that predate it."""
+    if "doc_id" in metadata or "section_id" not in metadata:
+        return metadata
+    return {**metadata, "doc_id": str(metadata["section_id"]).rpartition("#")[0]}
+
+
+def _search_hierarchical(
+    client: LlamaStackClient,
+    query: str,
+    knowledge_bank_id: str,
+    top_k: int,
+    *,
+    local_index: Optional[LocalVectorIndex] = None,
+    retrieval: str = RETRIEVAL_MODE,
+    metadata_filter: Optional[MetadataFilter] = None,
+) -> list:
+    """
+    Find the current chunks most relevant to the query in two stages, see _search_chunks.
+
+    The HIERARCHICAL_DOCUMENTS documents whose summaries are closest to the query are
+    found first, then only their chunks are searched through a filter on their IDs,
+    which the server (if it can filter) or the local index applies before scoring
+    anything; failing both, over-fetched chunks are filtered on the client as for any
+    filter. Every chunk is searched instead if the document index has nothing for the
+    query, or if none of the chunks found are from the documents picked.
+
+    Returns:
+        Chunks with content and metadata, most relevant first
+    """
+    documents_index = local_index.documents if local_index is not None else None
+    if retrieval == "local" and documents_index is None:
+        summaries = []
+    else:
+        try:
+            summaries = _search_chunks(
+                client,
+                query,
+                _document_bank_id(knowledge_bank_id),
+                HIERARCHICAL_DOCUMENTS,
+                local_index=documents_index,
+                retrieval=retrieval,
+                # summaries only carry the metadata of the whole document
+                metadata_filter=(
+                    metadata_filter.restricted_to(DOCUMENT_KEYS) if metadata_filter else None
+                ),
+            )
+        except Exception as e:
+            print(f"⚠️  Searching the document index failed ({e}), searching every chunk")
+            summaries = []
+
+    document_ids = list(
+        dict.fromkeys(
+            summary.metadata["document_id"]
+            for summary in summaries
+            if "document_id" in (getattr(summary, "metadata", None) or {})
+        )
+    )
+    if document_ids:
+        print(
+            f"📑 Searching the chunks of {len(document_ids)} document(s): {', '.join(document_ids)}"
+        )
+        chunks = _search_chunks(
+            client,
+            query,
+            knowledge_bank_id,
+            top_k,
+            local_index=local_index,
+            retrieval=retrieval,
+            metadata_filter=(metadata_filter or MetadataFilter()).narrowed(
+                "document_id", document_ids
+            ),
+        )
+        if chunks:
+            return chunks
+        print("📑 None of the chunks found are from those documents, searching every chunk")
+
+    return _search_chunks(
+        client,
+        query,
+        knowledge_bank_id,
+        top_k,
+        local_index=local_index,
+        retrieval=retrieval,
+        metadata_filter=metadata_filter,
+    )
+
+
+def _chunk_key(chunk) -> tuple:
+    """What identifies the same chunk in the results of different searches."""
+    metadata = getattr(chunk, "metadata", None) or {}
+    return metadata.get("section_id") or metadata.get("document_id"), str(chunk.content)
+
+
+def _query_variants(client: LlamaStackClient, question: str, expansion: str) -> list:
+    """The question followed by variants of it to search with, see query_expansion.py."""
+    if expansion == "model":
+        try:
+            reply = _chat_completion(
+                client,
+                QUERY_EXPANSION_MODEL,
+                model_variant_prompt(question, QUERY_EXPANSION_VARIANTS - 1),
+                QUERY_EXPANSION_MAX_TOKENS,
+            ).completion_message.content
+            variants = parse_model_variants(question, reply, QUERY_EXPANSION_VARIANTS)
+            if len(variants) > 1:
+                return variants
+        except Exception as e:
+            print(f"⚠️  Could not get query variants from {QUERY_EXPANSION_MODEL}: {e}")
+    return local_variants(question, QUERY_EXPANSION_VARIANTS)
+
+
+def _search_expanded(
+    client: LlamaStackClient,
+    query: str,
+    knowledge_bank_id: str,
+    top_k: int,
+    *,
+    expansion: str,
+    search=_search_chunks,
+    **options,
+) -> list:
+    """
+    Find the chunks most relevant to the query by searching several variants of it at once.
+
+    The question itself is searched while the variants are being made, and the variants
+    are searched concurrently as soon as they are known, so this takes about as long as
+    one search (plus the model call with expansion "model"). The ranked results are
+    fused with reciprocal rank fusion into top_k chunks, so the context does not grow.
+
+    Args:
+        expansion: How to make the variants, "local" or "model"
+        search: Search to run for each variant, _search_chunks or _search_hierarchical
+        options: Keyword arguments for search
+
+    Returns:
+        Chunks with content and metadata, most relevant first
+    """
 
-        # Create a Document object using the Llama Stack client types
-        # This lets Llama Stack handle the chunking internally
-        document = Document(
-            document_id=doc_id,
-            content=content,
-            mime_type="text/markdown",
-            metadata={
-                "source": md_file_str,
-                "type": "markdown",
-                "title": doc_title,
-            },
-        )
+    def run(variant: str) -> list:
+        return search(client, variant, knowledge_bank_id, top_k, **options)
 
-        print("   📄 Sending full document to Llama Stack for automatic chunking")
+    searches = {query: QUERY_EXECUTOR.submit(run, query)}
+    variants = _query_variants(client, query, expansion)
+    print(f"🔀 Searching with {len(variants)} variants of the question: {variants}")
+    for variant in variants:
+        if variant not in searches:
+            searches[variant] = QUERY_EXECUTOR.submit(run, variant)
 
-        # Use the RAG tool to insert the document with automatic chunking
+    results = []
+    errors = []
+    for variant, future in searches.items():
         try:
-            client.tool_runtime.rag_tool.insert(
-                documents=[document],
-                vector_db_id=knowledge_bank_id,
-                chunk_size_in_tokens=128,  # Let Llama Stack handle optimal chunking
-            )
-            print(
-                "   ✅ Document processed successfully (Llama Stack created chunks automatically)"
-            )
-            return True, 1  # Return 1 as we processed 1 document (chunks handled internally)
+            results.append(future.result())
         except Exception as e:
-            print(f"   ⚠️  Error with RAG tool, trying vector_io.insert: {e}")
-            # Fallback to vector_io.insert if RAG tool is not available
-            client.vector_io.insert(
-                vector_db_id=knowledge_bank_id,
-                chunks=[
-                    {
-                        "content": content,
-                        "metadata": {
-                            "document_id": doc_id,
-                            "source": md_file_str,
-                            "type": "markdown",
-                            "title": doc_title,
-                        },
-                    }
-                ],
-            )
-            print("   ✅ Document processed with vector_io.insert (manual chunking)")
-            return True, 1
-
-    except Exception as e:
-        print(f"❌ Error processing {md_file}: {e}")
-        return False, 0
+            print(f"⚠️  Search for '{variant}' failed: {e}")
+            errors.append(e)
+    if not results:
+        raise errors[0]
+    return reciprocal_rank_fusion(results, key=_chunk_key, k=RRF_K, limit=top_k)
 
 
-def _ingest_markdown_documents(client: LlamaStackClient, directory: str, knowledge_bank_id: str):
+def _search_banks(
+    client: LlamaStackClient,
+    query: str,
+    knowledge_bank_id: str,
+    top_k: int,
+    *,
+    other_banks: list,
+    search=_search_chunks,
+    local_index: Optional[LocalVectorIndex] = None,
+    router: Optional[BankRouter] = None,
+    **options,
+) -> list:
     """
-    Ingest markdown documents from a directory into Llama Stack's knowledge bank.
-    Uses Llama Stack's built-in document splitting functionality.
+    Find the chunks most relevant to the query in several knowledge banks at once.
+
+    The banks are searched concurrently, each within its deadline (FAN_OUT_DEADLINES,
+    else FAN_OUT_DEADLINE) counted from when its search starts, and each request to the
+    server is given what is left of it as its timeout. Banks that miss it or fail are left out, and the chunks of
+    the others are merged into one list by their scores normalized per bank. Every
+    chunk is labelled with the bank it came from under `knowledge_bank_id`. With a
+    router only the banks it picks for the query are searched, unless it is not
+    confident about any.
 
     Args:
-        client: The Llama Stack client instance
-        directory: Directory containing markdown files
-        knowledge_bank_id: ID for the knowledge bank to store documents
-    """
-    print(f"📚 Ingesting markdown documents from {directory}...")
-    print("🔧 Using Llama Stack's built-in document splitting functionality")
+        knowledge_bank_id: The first bank to search, the one the local index belongs to
+        other_banks: The other banks to search
+        search: Search to run in each bank, _search_chunks or _search_hierarchical
+        local_index: Local vector index of knowledge_bank_id
+        router: BankRouter picking the banks worth searching
+        options: Keyword arguments for search
 
-    try:
-        # Create vector database using the faiss provider
-        _create_vector_database(client, knowledge_bank_id)
-
-        # Find all markdown files
-        md_files = _find_markdown_files(directory)
-        print(f"📄 Found {len(md_files)} markdown files")
-
-        # Process each markdown file
-        documents_added = 0
-        chunks_added = 0
-        for md_file in md_files:
-            success, chunk_count = _process_markdown_file(
-                client, md_file, directory, knowledge_bank_id
+    Returns:
+        Chunks with content, metadata and score, most relevant first
+    """
+    banks = list(dict.fromkeys([knowledge_bank_id, *other_banks]))
+    deadlines = {"default": FAN_OUT_DEADLINE, **FAN_OUT_DEADLINES}
+    route = None
+    if router is not None:
+        route = router.route(query, banks)
+        if route.picked is None:
+            print(f"🧭 No bank stands out, searching all {len(banks)}")
+        else:
+            audit = ", searching every bank to check" if route.audit else ""
+            print(f"🧭 Routed to {', '.join(route.picked)}{audit}")
+        banks = route.banks
+
+    def search_bank(bank: str, seconds: float) -> list:
+        # the server gives up when the bank's deadline does, rather than being retried
+        bank_client = client.with_options(timeout=seconds, max_retries=0)
+        SEARCH_DEADLINE.at = time.monotonic() + seconds
+        try:
+            hits = search(
+                bank_client,
+                query,
+                bank,
+                top_k,
+                local_index=local_index if bank == knowledge_bank_id else None,
+                **options,
             )
-            if success:
-                documents_added += 1
-                chunks_added += chunk_count
-
-        print(
-            f"✅ Successfully ingested {documents_added} documents (Llama Stack created chunks automatically) into knowledge bank"
-        )
-        return True
+        finally:
+            SEARCH_DEADLINE.at = None
+        return [
+            Hit(hit.content, {**(hit.metadata or {}), "knowledge_bank_id": bank}, hit.score)
+            for hit in hits
+        ]
+
+    results = fan_out(search_bank, banks, deadlines)
+    for result in results:
+        if result.error:
+            print(f"⏭️  Leaving out '{result.knowledge_bank_id}': {result.error}")
+        else:
+            print(
+                f"🏦 '{result.knowledge_bank_id}': {len(result.hits)} chunk(s) "
+                f"in {result.seconds * 1000:.0f}ms"
+            )
+    merged = merge_ranked(results, top_k, FAN_OUT_NORMALIZATION, key=_chunk_key)
+    if route is not None:
+        router.record(route, {hit.metadata["knowledge_bank_id"] for hit in merged})
+    return merged
 
-    except Exception as e:
-        print(f"❌ Error during document ingestion: {e}")
-        return False
 
+def _select_diverse(query: str, chunks: list, top_k: int) -> list:
+    """
+    Keep up to top_k of the chunks, trading relevance to the query against redundancy.
 
-def _check_vector_database_exists_and_has_content(
-    client: LlamaStackClient, knowledge_bank_id: str
-) -> bool:
+    The chunks and the query are embedded locally (see _cached_embedder) and picked by
+    maximal marginal relevance, see diversity.py.
     """
-    Check if the vector database exists and contains documents.
+    if len(chunks) <= 1:
+        return chunks[:top_k]
+    embedder = _cached_embedder()
+    vectors = embedder([query] + [str(chunk.content) for chunk in chunks])
+    picked = mmr_select(vectors[0], vectors[1:], top_k, MMR_LAMBDA, MMR_MAX_SIMILARITY)
+    print(f"🎯 Kept {len(picked)} of {len(chunks)} chunks for relevance and diversity")
+    return [chunks[i] for i in picked]
 
-    Args:
-        client: The Llama Stack client instance
-        knowledge_bank_id: ID of the knowledge bank to check
+
+def _document_contents(chunks: list) -> tuple:
+    """
+    The contents of retrieved chunks and their metadata for display, printing both.
 
     Returns:
-        True if the database exists and has content, False otherwise
+        Tuple of (document_contents, document_info), see _retrieve_relevant_documents
     """
-    try:
-        # Try to query the vector database with a simple test query
-        results = client.vector_io.query(
-            vector_db_id=knowledge_bank_id, query="test", params={"limit": 1}
-        )
+    if chunks:
+        print(f"📚 Found {len(chunks)} relevant document chunks")
+
+        # Extract content and metadata
+        document_contents = []
+        document_info = []
+
+        for i, chunk in enumerate(chunks, 1):
+            document_contents.append(chunk.content)
+
+            # Extract metadata for display
+            metadata = getattr(chunk, "metadata", {})
+            doc_title = metadata.get("title", f"Document {i}")
+            doc_source = metadata.get("source", "Unknown source")
+            doc_type = metadata.get("type", "unknown")
+            chunk_index = metadata.get("chunk_index", "Auto-generated")
+            total_chunks = metadata.get("total_chunks", "Auto-managed")
+
+            # Get a preview of the content (first 100 chars)
+            content_str = (
+                str(chunk.content) if not isinstance(chunk.content, str) else chunk.content
+            )
+            content_preview = content_str[:100] + "..." if len(content_str) > 100 else content_str
+
+            document_info.append(
+                {
+                    "index": i,
+                    "title": doc_title,
+                    "source": doc_source,
+                    "type": doc_type,
+                    "preview": content_preview,
+                    "chunk_index": chunk_index,
+                    "total_chunks": total_chunks,
+                }
+            )
 
-        # If we get results, the database exists and has content
-        if hasattr(results, "chunks") and results.chunks:
-            print(f"✅ Vector database '{knowledge_bank_id}' exists and contains documents")
-            return True
-        print(f"📭 Vector database '{knowledge_bank_id}' exists but is empty")
-        return False
+        # Display retrieved documents with full content
+        print("\n📄 Retrieved Document Chunks (Full Content):")
+        print("=" * 80)
+        for i, (doc_info, content) in enumerate(zip(document_info, document_contents), 1):
+            chunk_info = (
+                f" (Chunk {doc_info['chunk_index']}/{doc_info['total_chunks']})"
+                if doc_info["chunk_index"] != "Auto-generated"
+                else " (Auto-chunked by Llama Stack)"
+            )
+            print(f"\n📌 Chunk {i}: {doc_info['title']}{chunk_info}")
+            print(f"📂 Source: {doc_info['source']}")
+            print(f"🏷️  Type: {doc_info['type']}")
+            print("-" * 60)
+            print(content)
+            print("-" * 60)
 
-    except Exception as e:
-        error_str = str(e).lower()
-        if "not served" in error_str or "not found" in error_str or "invalid value" in error_str:
-            print(f"❌ Vector database '{knowledge_bank_id}' does not exist")
-            return False
-        print(f"⚠️  Error checking vector database: {e}")
-        return False
+        return document_contents, document_info
+    print("📚 No relevant documents found")
+    return [], []
 
 
 def _retrieve_relevant_documents(
-    client: LlamaStackClient, query: str, knowledge_bank_id: str, top_k: int = 5
+    client: LlamaStackClient,
+    query: str,
+    knowledge_bank_id: str,
+    top_k: int = 5,
+    *,
+    local_index: Optional[LocalVectorIndex] = None,
+    retrieval: str = RETRIEVAL_MODE,
+    metadata_filter: Optional[MetadataFilter] = None,
+    hierarchical: bool = HIERARCHICAL_RETRIEVAL,
+    query_expansion: Optional[str] = QUERY_EXPANSION,
+    other_banks: Optional[list] = None,
+    router: Optional[BankRouter] = None,
+    mmr: bool = MMR_SELECTION,
 ):
     """
     Retrieve relevant documents from the knowledge bank based on the query.
@@ -212,6 +1882,16 @@ def _retrieve_relevant_documents(
         query: The search query
         knowledge_bank_id: ID of the knowledge bank to search
         top_k: Number of top relevant documents to retrieve
+        local_index: Local vector index to search with retrieval "local" or "auto"
+        retrieval: Where to search, "server", "local" or "auto" (server, then local)
+        metadata_filter: Only retrieve chunks whose metadata matches this filter
+        hierarchical: Pick the closest documents first, then search only their chunks
+        query_expansion: Also search with variants of the query made "local"ly or by a
+            "model", fusing the results
+        other_banks: More knowledge banks to search along with knowledge_bank_id
+        router: Picks which of the knowledge banks to search
+        mmr: Retrieve more candidates and keep the most relevant ones that do not repeat
+            each other
 
     Returns:
         Tuple of (document_contents, document_info) where:
@@ -220,75 +1900,93 @@ def _retrieve_relevant_documents(
     """
     try:
         print(f"🔍 Searching for relevant documents for query: '{query}'")
+        if metadata_filter:
+            print(f"🏷️  Restricted to chunks matching: {metadata_filter}")
 
-        # Query the vector database
-        results = client.vector_io.query(
-            vector_db_id=knowledge_bank_id, query=query, params={"limit": top_k}
+        search = _search_hierarchical if hierarchical else _search_chunks
+        if other_banks:
+            search = functools.partial(
+                _search_banks, other_banks=other_banks, search=search, router=router
+            )
+        if query_expansion:
+            search = functools.partial(_search_expanded, expansion=query_expansion, search=search)
+        chunks = search(
+            client,
+            query,
+            knowledge_bank_id,
+            top_k * MMR_FETCH_FACTOR if mmr else top_k,
+            local_index=local_index,
+            retrieval=retrieval,
+            metadata_filter=metadata_filter,
         )
+        if mmr:
+            chunks = _select_diverse(query, chunks, top_k)
 
-        if hasattr(results, "chunks") and results.chunks:
-            print(f"📚 Found {len(results.chunks)} relevant document chunks")
-
-            # Extract content and metadata
-            document_contents = []
-            document_info = []
-
-            for i, chunk in enumerate(results.chunks, 1):
-                document_contents.append(chunk.content)
-
-                # Extract metadata for display
-                metadata = getattr(chunk, "metadata", {})
-                doc_title = metadata.get("title", f"Document {i}")
-                doc_source = metadata.get("source", "Unknown source")
-                doc_type = metadata.get("type", "unknown")
-                chunk_index = metadata.get("chunk_index", "Auto-generated")
-                total_chunks = metadata.get("total_chunks", "Auto-managed")
-
-                # Get a preview of the content (first 100 chars)
-                content_str = (
-                    str(chunk.content) if not isinstance(chunk.content, str) else chunk.content
-                )
-                content_preview = (
-                    content_str[:100] + "..." if len(content_str) > 100 else content_str
-                )
-
-                document_info.append(
-                    {
-                        "index": i,
-                        "title": doc_title,
-                        "source": doc_source,
-                        "type": doc_type,
-                        "preview": content_preview,
-                        "chunk_index": chunk_index,
-                        "total_chunks": total_chunks,
-                    }
-                )
-
-            # Display retrieved documents with full content
-            print("\n📄 Retrieved Document Chunks (Full Content):")
-            print("=" * 80)
-            for i, (doc_info, content) in enumerate(zip(document_info, document_contents), 1):
-                chunk_info = (
-                    f" (Chunk {doc_info['chunk_index']}/{doc_info['total_chunks']})"
-                    if doc_info["chunk_index"] != "Auto-generated"
-                    else " (Auto-chunked by Llama Stack)"
-                )
-                print(f"\n📌 Chunk {i}: {doc_info['title']}{chunk_info}")
-                print(f"📂 Source: {doc_info['source']}")
-                print(f"🏷️  Type: {doc_info['type']}")
-                print("-" * 60)
-                print(content)
-                print("-" * 60)
-
-            return document_contents, document_info
-        print("📚 No relevant documents found")
-        return [], []
+        return _document_contents(chunks)
 
     except Exception as e:
         print(f"❌ Error retrieving documents: {e}")
         return [], []
 
 
+def _retrieve_local_batch(local_index: LocalVectorIndex, requests: list) -> list:
+    """
+    Retrieve for several questions at once from the local index.
+
+    Questions with the same metadata filter and top_k are embedded in one call and
+    scored together, see LocalVectorIndex.search_many.
+
+    Args:
+        local_index: The local vector index
+        requests: The daemon's RetrievalRequests
+
+    Returns:
+        The relevant document contents of each request, in order
+    """
+    results: list = [[] for _ in requests]
+    groups: dict = {}
+    for position, request in enumerate(requests):
+        key = (request.metadata_filter, request.top_k)
+        groups.setdefault(key, []).append((position, request.question))
+
+    for (metadata_filter, top_k), members in groups.items():
+        print(f"🔍 Searching for relevant documents for {len(members)} queries at once")
+        try:
+            found = local_index.search_many(
+                [question for _, question in members], top_k, metadata_filter=metadata_filter
+            )
+        except Exception as e:
+            print(f"❌ Error retrieving documents: {e}")
+            continue
+        for (position, _), chunks in zip(members, found):
+            results[position] = _document_contents(chunks)[0]
+    return results
+
+
+def _build_rag_prompt(message: str, relevant_docs: list) -> str:
+    """
+    Build the context enhanced prompt sent to the model.
+
+    Args:
+        message: The question asked by the user
+        relevant_docs: List of relevant document contents
+
+    Returns:
+        The prompt including the context from the relevant documents
+    """
+    # Create context from relevant documents
+    context = "\n\n".join([f"Document {i+1}:\n{doc}" for i, doc in enumerate(relevant_docs)])
+
+    return f"""Based on the following context from the Node.js Reference Architecture documentation, please answer the question.
+
+Context:
+{context}
+
+Question: {message}
+
+Please provide a comprehensive answer using the context provided above."""
+
+
 def _query_llama_stack_with_rag(
     url: str,
     model: str,
@@ -296,6 +1994,17 @@ def _query_llama_stack_with_rag(
     knowledge_bank_id: str,
     timeout: int = 120,
     use_rag: bool = True,
+    *,
+    client: Optional[LlamaStackClient] = None,
+    local_index: Optional[LocalVectorIndex] = None,
+    retrieval: str = RETRIEVAL_MODE,
+    metadata_filter: Optional[MetadataFilter] = None,
+    hierarchical: bool = HIERARCHICAL_RETRIEVAL,
+    query_expansion: Optional[str] = QUERY_EXPANSION,
+    other_banks: Optional[list] = None,
+    router: Optional[BankRouter] = None,
+    mmr: bool = MMR_SELECTION,
+    compressor: Optional[ContextCompressor] = None,
 ):
     """
     Query the Llama Stack instance with RAG-enhanced context using the official SDK.
@@ -307,6 +2016,16 @@ def _query_llama_stack_with_rag(
         knowledge_bank_id: ID of the knowledge bank for RAG
         timeout: Request timeout in seconds
         use_rag: Whether to use RAG for context enhancement
+        client: Existing Llama Stack client to reuse, a new one is created if not provided
+        local_index: Local vector index to retrieve from with retrieval "local" or "auto"
+        retrieval: Where to retrieve from, "server", "local" or "auto" (server, then local)
+        metadata_filter: Only retrieve chunks whose metadata matches this filter
+        hierarchical: Retrieve in two stages, documents first and then their chunks
+        query_expansion: Also retrieve with variants of the message, "local" or "model"
+        other_banks: More knowledge banks to retrieve from along with knowledge_bank_id
+        router: Picks which of the knowledge banks to retrieve from
+        mmr: Drop retrieved chunks that repeat more relevant ones
+        compressor: Keeps only the sentences of the retrieved chunks that match the message
 
     Returns:
         Response object from the Llama Stack client
@@ -323,36 +2042,47 @@ def _query_llama_stack_with_rag(
     print("-" * 50)
 
     # Initialize the Llama Stack client
-    client = LlamaStackClient(
-        base_url=url,
-        timeout=timeout,
-    )
+    if client is None:
+        client = LlamaStackClient(
+            base_url=url,
+            timeout=timeout,
+        )
 
     # Enhanced message with context
     enhanced_message = message
+    compression = None
 
     if use_rag:
         try:
             # Retrieve relevant documents
             relevant_docs, doc_info = _retrieve_relevant_documents(
-                client, message, knowledge_bank_id
+                client,
+                message,
+                knowledge_bank_id,
+                local_index=local_index,
+                retrieval=retrieval,
+                metadata_filter=metadata_filter,
+                hierarchical=hierarchical,
+                query_expansion=query_expansion,
+                other_banks=other_banks,
+                router=router,
+                mmr=mmr,
             )
 
-            if relevant_docs:
-                # Create context from relevant documents
-                context = "\n\n".join(
-                    [f"Document {i+1}:\n{doc}" for i, doc in enumerate(relevant_docs)]
+            if relevant_docs and compressor is not None:
+                compression = compressor.compress(message, relevant_docs)
+                relevant_docs = compression.documents
+                doc_info = [doc_info[i] for i in compression.kept]
+                print(
+                    f"✂️  Context compressed from ~{compression.tokens_before} to "
+                    f"~{compression.tokens_after} tokens"
+                    if compression.compressed
+                    else "✂️  Context left uncompressed to compare answer latency"
                 )
 
+            if relevant_docs:
                 # Enhance the prompt with context
-                enhanced_message = f"""Based on the following context from the Node.js Reference Architecture documentation, please answer the question.
-
-Context:
-{context}
-
-Question: {message}
-
-Please provide a comprehensive answer using the context provided above."""
+                enhanced_message = _build_rag_prompt(message, relevant_docs)
 
                 print(f"📚 Enhanced prompt with {len(relevant_docs)} relevant document(s)")
                 print(f"📋 Context includes: {', '.join([info['title'] for info in doc_info])}")
@@ -367,18 +2097,70 @@ Please provide a comprehensive answer using the context provided above."""
             print("📚 Proceeding with original question without RAG")
 
     try:
-        # Make the inference request using the SDK with proper parameters
+        start = time.perf_counter()
+        response = _chat_completion(client, model, enhanced_message)
+        if compression is not None:
+            compressor.record_answer(compression.compressed, time.perf_counter() - start)
+            print(f"✂️  Context compression: {compressor.stats()}")
+        return response
+
+    except Exception as e:
+        raise Exception(f"Request failed: {e}") from e
+
+
+def _chat_completion(client: LlamaStackClient, model: str, message: str, max_tokens: int = 500):
+    """
+    Run a single chat completion for an already enhanced message.
+
+    Args:
+        client: The Llama Stack client instance
+        model: The model name to use
+        message: The (possibly context enhanced) message to send
+        max_tokens: Maximum number of tokens to generate
+
+    Returns:
+        Response object from the Llama Stack client
+    """
+    # Make the inference request using the SDK with proper parameters
+    with SCHEDULER.slot(INTERACTIVE):
         return client.inference.chat_completion(
             model_id=model,
-            messages=[{"role": "user", "content": enhanced_message}],
+            messages=[{"role": "user", "content": message}],
             sampling_params={
                 "strategy": {"type": "greedy"},
-                "max_tokens": 500,
+                "max_tokens": max_tokens,
             },
         )
 
-    except Exception as e:
-        raise Exception(f"Request failed: {e}") from e
+
+def _chat_completion_stream(
+    client: LlamaStackClient, model: str, message: str, max_tokens: int = 500
+):
+    """
+    Run a single streaming chat completion for an already enhanced message.
+
+    Args:
+        client: The Llama Stack client instance
+        model: The model name to use
+        message: The (possibly context enhanced) message to send
+        max_tokens: Maximum number of tokens to generate
+
+    Yields:
+        The text of the response as it is generated
+    """
+    with SCHEDULER.slot(INTERACTIVE):
+        response_stream = client.inference.chat_completion(
+            model_id=model,
+            messages=[{"role": "user", "content": message}],
+            sampling_params={
+                "strategy": {"type": "greedy"},
+                "max_tokens": max_tokens,
+            },
+            stream=True,
+        )
+        for chunk in response_stream:
+            if chunk.event.delta.type == "text" and chunk.event.delta.text:
+                yield chunk.event.delta.text
 
 
 def _format_response(response) -> str:
@@ -407,48 +2189,484 @@ def _format_response(response) -> str:
         return f"❌ Error formatting response: {e}\nRaw response: {response}"
 
 
+def _prepare_knowledge_bank(client: LlamaStackClient, verify_checkpoint: bool = False) -> bool:
+    """
+    Make sure the knowledge bank is populated, ingesting the markdown documents if needed.
+
+    Args:
+        client: The Llama Stack client instance
+        verify_checkpoint: Check the checkpoint of an interrupted ingestion against the server
+
+    Returns:
+        True if RAG can be used, False otherwise
+    """
+    # Check if markdown directory exists
+    if not Path(MARKDOWN_DIR).exists():
+        print(f"❌ Markdown directory not found: {MARKDOWN_DIR}")
+        print("📚 Proceeding without RAG functionality")
+        return False
+
+    print(f"📁 Found markdown directory: {MARKDOWN_DIR}")
+
+    # Check if vector database already exists and has content
+    print("\n🔍 Checking if documents are already ingested...")
+    if _check_vector_database_exists_and_has_content(client, KNOWLEDGE_BANK_ID):
+        if not MANIFEST.documents:
+            _warn_untracked_content(KNOWLEDGE_BANK_ID)
+            return True
+        print("✅ Vector database already contains documents, only ingesting changes")
+        _ingest_markdown_documents(client, MARKDOWN_DIR, KNOWLEDGE_BANK_ID, verify_checkpoint)
+        return True
+
+    # Nothing the manifest remembers is in the knowledge bank any more
+    MANIFEST.clear()
+
+    # Ingest documents into knowledge bank
+    print("\n📚 Starting document ingestion...")
+    if _ingest_markdown_documents(client, MARKDOWN_DIR, KNOWLEDGE_BANK_ID):
+        print("✅ Document ingestion completed successfully!")
+        return True
+
+    print("⚠️  Document ingestion failed, proceeding without RAG")
+    return False
+
+
+def _prepare_retrieval(
+    client: LlamaStackClient, args: argparse.Namespace
+) -> tuple[bool, Optional[LocalVectorIndex]]:
+    """
+    Get the knowledge bank and, for --retrieval local or auto, the local index ready.
+
+    Returns:
+        Tuple of (whether RAG can be used, the local index or None)
+    """
+    local_index = None
+    if args.retrieval != "server":
+        local_index = _load_local_index(MARKDOWN_DIR, args.local_quantization)
+    if args.retrieval == "local":
+        return local_index is not None, local_index
+
+    use_rag = _prepare_knowledge_bank(client, args.verify_checkpoint)
+    if not use_rag and local_index is not None:
+        print("📚 Retrieving from the local index while the knowledge bank is not available")
+        use_rag = True
+    return use_rag, local_index
+
+
+def _create_agent_session_pool(client: LlamaStackClient, size: int) -> tuple[str, list]:
+    """
+    Create an agent using the knowledge bank and a pool of sessions for it.
+
+    Args:
+        client: The Llama Stack client instance
+        size: Number of sessions to create
+
+    Returns:
+        Tuple of (agent_id, session_ids)
+    """
+    agentic_system_create_response = client.agents.create(
+        agent_config={
+            "model": MODEL_NAME,
+            "instructions": "You are a helpful assistant, answer questions only based on information in the documents provided",
+            "toolgroups": [
+                {
+                    "name": "builtin::rag/knowledge_search",
+                    "args": {"vector_db_ids": [KNOWLEDGE_BANK_ID]},
+                }
+            ],
+            "tool_choice": "auto",
+            "input_shields": [],
+            "output_shields": [],
+            "max_infer_iters": 10,
+        }
+    )
+    agent_id = agentic_system_create_response.agent_id
+
+    session_ids = [
+        client.agents.session.create(agent_id, session_name=f"daemon-{i}").session_id
+        for i in range(size)
+    ]
+    return agent_id, session_ids
+
+
+def _agent_turn(client: LlamaStackClient, agent_id: str, session_id: str, message: str) -> str:
+    """
+    Ask the agent a question in the given session and return the answer.
+
+    Args:
+        client: The Llama Stack client instance
+        agent_id: ID of the agent to use
+        session_id: ID of the session to use
+        message: The question to ask
+
+    Returns:
+        The text of the agent response
+    """
+    with SCHEDULER.slot(INTERACTIVE):
+        response_stream = client.agents.turn.create(
+            agent_id=agent_id,
+            session_id=session_id,
+            stream=True,
+            messages=[{"role": "user", "content": message}],
+        )
+
+        response = ""
+        for chunk in response_stream:
+            if (
+                hasattr(chunk, "event")
+                and hasattr(chunk.event, "payload")
+                and chunk.event.payload.event_type == "turn_complete"
+            ):
+                response = response + chunk.event.payload.turn.output_message.content
+    return response
+
+
+def _run_daemon(
+    client: LlamaStackClient,
+    use_rag: bool,
+    args: argparse.Namespace,
+    watcher: Optional[CorpusWatcher] = None,
+    local_index: Optional[LocalVectorIndex] = None,
+    *,
+    router: Optional[BankRouter] = None,
+    compressor: Optional[ContextCompressor] = None,
+) -> None:
+    """
+    Serve questions over a local socket, reusing the warm client, knowledge bank and agent.
+
+    Args:
+        client: The Llama Stack client instance
+        use_rag: Whether the knowledge bank can be used
+        args: Parsed command line arguments
+        watcher: Corpus watcher keeping the knowledge bank up to date, if any
+        local_index: Local vector index used with --retrieval local or auto
+        router: Knowledge bank router used with --route
+        compressor: Context compressor used with --compress-context
+    """
+    if args.mode == "agent":
+        print(f"🤖 Creating agent with {DAEMON_AGENT_SESSIONS} session(s)...")
+        agent_id, session_ids = _create_agent_session_pool(client, DAEMON_AGENT_SESSIONS)
+        service = rag_daemon.AgentService(
+            ask=lambda session_id, question: _agent_turn(client, agent_id, session_id, question),
+            session_ids=session_ids,
+        )
+    else:
+
+        def retrieve(
+            question: str, metadata_filter: Optional[MetadataFilter] = None, top_k: int = 5
+        ) -> list:
+            return _retrieve_relevant_documents(
+                client,
+                question,
+                KNOWLEDGE_BANK_ID,
+                top_k,
+                local_index=local_index,
+                retrieval=args.retrieval,
+                metadata_filter=metadata_filter,
+                hierarchical=args.hierarchical,
+                query_expansion=args.query_expansion,
+                other_banks=args.knowledge_banks,
+                router=router,
+                mmr=args.mmr,
+            )[0]
+
+        # Plain local retrievals are batched, embedding and scoring the queued questions
+        # together. vector_io.query has no batch form, so the other retrievals queued
+        # together are pipelined, searched concurrently with each repeated one searched once.
+        batchable = (
+            local_index is not None
+            and args.retrieval == "local"
+            and not (args.hierarchical or args.query_expansion or args.knowledge_banks or args.mmr)
+        )
+        service = rag_daemon.RagService(
+            retrieve=retrieve,
+            build_prompt=_build_rag_prompt,
+            infer=lambda prompt, max_tokens: _chat_completion(
+                client, MODEL_NAME, prompt, max_tokens
+            ).completion_message.content,
+            use_rag=use_rag,
+            batcher=MicroBatcher(
+                dispatch_one=lambda request: retrieve(
+                    request.question, request.metadata_filter, request.top_k
+                ),
+                dispatch_batch=(
+                    functools.partial(_retrieve_local_batch, local_index) if batchable else None
+                ),
+                max_wait_ms=RETRIEVAL_BATCH_MAX_WAIT_MS,
+                max_batch=RETRIEVAL_BATCH_MAX_SIZE,
+            ),
+            degraded_max_tokens=DEGRADED_MAX_TOKENS,
+            degraded_skip_rag=DEGRADED_SKIP_RAG,
+            infer_stream=lambda prompt, max_tokens: _chat_completion_stream(
+                client, MODEL_NAME, prompt, max_tokens
+            ),
+            compressor=compressor,
+            budget=_context_budget(args.latency_slo, compressor),
+        )
+
+    admission = AdmissionController(
+        max_concurrency=ADMISSION_MAX_CONCURRENCY,
+        max_queue=ADMISSION_MAX_QUEUE,
+        queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+        # an agent turn has no cheaper path, in agent mode questions only queue or are shed
+        degrade_queue_depth=DEGRADE_QUEUE_DEPTH if args.mode != "agent" else None,
+    )
+
+    metrics = {"scheduler": SCHEDULER.stats, "payloads": HTTP_CLIENT.stats}
+    if watcher:
+        metrics["watcher"] = watcher.stats
+    if local_index is not None:
+        metrics["local_index"] = local_index.stats
+    if router is not None:
+        metrics["router"] = router.stats
+
+    daemon = rag_daemon.QueryDaemon(
+        service,
+        admission=admission,
+        ingest=rag_daemon.BackgroundIngest(
+            lambda: not _has_untracked_content(client, KNOWLEDGE_BANK_ID)
+            and _ingest_markdown_documents(client, MARKDOWN_DIR, KNOWLEDGE_BANK_ID)
+        ),
+        metrics=metrics,
+    )
+
+    try:
+        asyncio.run(
+            rag_daemon.serve(daemon, host=args.host, port=args.port, unix_socket=args.unix_socket)
+        )
+    except KeyboardInterrupt:
+        print("\n👋 Daemon stopped")
+
+
+def _parse_args() -> argparse.Namespace:
+    """Parse the command line arguments."""
+    parser = argparse.ArgumentParser(description="Llama Stack RAG-Enhanced Query Application")
+    parser.add_argument(
+        "--serve", action="store_true", help="run as a daemon answering questions over HTTP"
+    )
+    parser.add_argument(
+        "--mode",
+        choices=["chat", "agent"],
+        default="chat",
+        help="answer with retrieval + chat completion (chat) or a warm agent (agent)",
+    )
+    parser.add_argument("--host", default=DAEMON_HOST, help="address the daemon listens on")
+    parser.add_argument("--port", type=int, default=DAEMON_PORT, help="port the daemon listens on")
+    parser.add_argument(
+        "--unix-socket", default=None, help="listen on a Unix socket instead of TCP"
+    )
+    parser.add_argument(
+        "--verify-checkpoint",
+        action="store_true",
+        help="when resuming an interrupted ingestion, check what it did against the server",
+    )
+    parser.add_argument(
+        "--compress",
+        choices=["gzip", "zstd"],
+        default=REQUEST_COMPRESSION,
+        help="compress large request bodies (the server has to accept compressed bodies)",
+    )
+    parser.add_argument(
+        "--retrieval",
+        choices=["server", "local", "auto"],
+        default=RETRIEVAL_MODE,
+        help="retrieve from the server, a local vector index, or the server falling back to "
+        "the local index (auto)",
+    )
+    parser.add_argument(
+        "--filter",
+        action="append",
+        metavar="KEY=VALUE|KEY^=PREFIX",
+        help="only retrieve chunks whose metadata has KEY equal to VALUE, or starting with "
+        "PREFIX (repeat to combine)",
+    )
+    parser.add_argument(
+        "--hierarchical",
+        action="store_true",
+        default=HIERARCHICAL_RETRIEVAL,
+        help=f"pick the {HIERARCHICAL_DOCUMENTS} closest documents by their summaries first, "
+        "then search only their chunks (ingestion then keeps the summaries)",
+    )
+    parser.add_argument(
+        "--query-expansion",
+        choices=["local", "model"],
+        default=QUERY_EXPANSION,
+        help=f"also search with up to {QUERY_EXPANSION_VARIANTS - 1} variants of the question, "
+        "made from its keywords or by a model, and fuse the results",
+    )
+    parser.add_argument(
+        "--knowledge-bank",
+        action="append",
+        dest="knowledge_banks",
+        default=[],
+        metavar="ID",
+        help=f"also retrieve from this knowledge bank besides {KNOWLEDGE_BANK_ID} (repeat for more)",
+    )
+    parser.add_argument(
+        "--route",
+        action="store_true",
+        help="only retrieve from the knowledge banks (with --knowledge-bank) a question is "
+        "likely to be answered from",
+    )
+    parser.add_argument(
+        "--mmr",
+        action="store_true",
+        default=MMR_SELECTION,
+        help="retrieve more chunks and keep the relevant ones that do not repeat each other",
+    )
+    parser.add_argument(
+        "--compress-context",
+        choices=["lexical", "embedding"],
+        default=CONTEXT_COMPRESSION,
+        help=f"keep only the sentences of the retrieved chunks that best match the question, "
+        f"~{CONTEXT_TOKEN_BUDGET} tokens",
+    )
+    parser.add_argument(
+        "--latency-slo",
+        type=float,
+        default=LATENCY_SLO,
+        metavar="SECONDS",
+        help="with --serve, size the retrieved context per question to hold this p95 answer "
+        "latency",
+    )
+    parser.add_argument(
+        "--local-quantization",
+        choices=["int8", "pq"],
+        default=LOCAL_INDEX_QUANTIZATION,
+        help="quantize the local index to use less memory, rescoring the best candidates exactly",
+    )
+    parser.add_argument(
+        "--export-snapshot",
+        metavar="PATH",
+        help="export the knowledge bank with its embeddings to a snapshot file, then exit",
+    )
+    parser.add_argument(
+        "--import-snapshot",
+        metavar="PATH",
+        help="load a snapshot file into a new knowledge bank without re-embedding, then exit",
+    )
+    parser.add_argument(
+        "--ingest-shards",
+        action="store_true",
+        help="ingest the corpus in shards with several worker processes, then exit",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=SHARD_WORKERS,
+        help="worker processes to start on this host with --ingest-shards, or with "
+        "--ingest-worker the workers ingesting at once, which share the ingestion limit",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=None,
+        help=f"shards to split the corpus into (default {SHARDS_PER_WORKER} per worker)",
+    )
+    parser.add_argument(
+        "--ingest-worker",
+        action="store_true",
+        help="ingest shards handed out by a running --ingest-shards coordinator, then exit",
+    )
+    parser.add_argument(
+        "--worker-id",
+        default=f"{socket.gethostname().split('.')[0]}-{os.getpid()}",
+        help="name of this worker, unique across hosts",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep the knowledge bank in sync with the markdown directory as it changes",
+    )
+    args = parser.parse_args()
+    try:
+        args.metadata_filter = MetadataFilter.from_expressions(args.filter)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.route and not args.knowledge_banks:
+        parser.error("--route picks among the --knowledge-bank banks, give at least one")
+    return args
+
+
+def _run_knowledge_bank_command(
+    client: LlamaStackClient, args: argparse.Namespace
+) -> Optional[bool]:
+    """
+    Run a command that only works on the knowledge bank, such as an ingestion worker.
+
+    Returns:
+        Whether the command succeeded, or None if no such command was given
+    """
+    if args.export_snapshot:
+        return _export_snapshot(client, args.export_snapshot)
+    if args.import_snapshot:
+        return _import_snapshot(client, args.import_snapshot)
+    if args.ingest_worker:
+        _run_ingest_worker(client, args.worker_id, args.workers)
+        return True
+    if args.ingest_shards:
+        shards = args.shards or args.workers * SHARDS_PER_WORKER
+        # Workers ingest like this process would, so they get its ingestion flags
+        worker_flags = ["--compress", args.compress] if args.compress else []
+        if args.hierarchical:
+            worker_flags.append("--hierarchical")
+        return _coordinate_sharded_ingest(client, args.workers, shards, worker_flags=worker_flags)
+    return None
+
+
 def main():
     """Main function to run the Llama Stack query with RAG capabilities."""
+    args = _parse_args()
+    if args.hierarchical:
+        DOCUMENT_INDEX_BANKS.add(KNOWLEDGE_BANK_ID)
+
     print("🦙 Llama Stack RAG-Enhanced Query Application")
     print("=" * 50)
 
     # Initialize the Llama Stack client
+    HTTP_CLIENT.set_compression(args.compress)
     client = LlamaStackClient(
         base_url=LLAMA_STACK_URL,
         timeout=TIMEOUT,
+        http_client=HTTP_CLIENT,
     )
 
     try:
-        # Check if markdown directory exists
-        if Path(MARKDOWN_DIR).exists():
-            print(f"📁 Found markdown directory: {MARKDOWN_DIR}")
+        ok = _run_knowledge_bank_command(client, args)
+        if ok is not None:
+            sys.exit(0 if ok else 1)
 
-            # Check if vector database already exists and has content
-            print("\n🔍 Checking if documents are already ingested...")
-            has_content = _check_vector_database_exists_and_has_content(client, KNOWLEDGE_BANK_ID)
+        use_rag, local_index = _prepare_retrieval(client, args)
+        router = None
+        if args.route:
+            router = _open_router()
+            _profile_unknown_banks(client, router, [KNOWLEDGE_BANK_ID, *args.knowledge_banks])
+        compressor = _context_compressor(args.compress_context)
 
-            if has_content:
-                print("✅ Vector database already contains documents, skipping ingestion")
-                use_rag = True
-            else:
-                # Ingest documents into knowledge bank
-                print("\n📚 Starting document ingestion...")
-                ingestion_success = _ingest_markdown_documents(
-                    client, MARKDOWN_DIR, KNOWLEDGE_BANK_ID
-                )
+        print("\n" + "=" * 50)
 
-                if ingestion_success:
-                    print("✅ Document ingestion completed successfully!")
-                    use_rag = True
-                else:
-                    print("⚠️  Document ingestion failed, proceeding without RAG")
-                    use_rag = False
-        else:
-            print(f"❌ Markdown directory not found: {MARKDOWN_DIR}")
-            print("📚 Proceeding without RAG functionality")
-            use_rag = False
+        watcher = None
+        if args.watch:
+            if use_rag:
+                watcher = _start_corpus_watcher(client)
+            else:
+                print("⚠️  Nothing to watch, the knowledge bank is not in use")
 
-        print("\n" + "=" * 50)
+        if args.serve:
+            _run_daemon(
+                client, use_rag, args, watcher, local_index, router=router, compressor=compressor
+            )
+            return
+
+        if watcher:
+            # Without the daemon, watch mode just keeps the knowledge bank in sync
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                watcher.stop()
+                print("\n👋 Stopped watching")
+            return
 
         # Query the Llama Stack with RAG enhancement
         response_data = _query_llama_stack_with_rag(
@@ -458,12 +2676,27 @@ def main():
             knowledge_bank_id=KNOWLEDGE_BANK_ID,
             timeout=TIMEOUT,
             use_rag=use_rag,
+            client=client,
+            local_index=local_index,
+            retrieval=args.retrieval,
+            metadata_filter=args.metadata_filter,
+            hierarchical=args.hierarchical,
+            query_expansion=args.query_expansion,
+            other_banks=args.knowledge_banks,
+            router=router,
+            mmr=args.mmr,
+            compressor=compressor,
         )
 
         # Format and display the response
         formatted_response = _format_response(response_data)
         print(formatted_response)
 
+    except KeyboardInterrupt:
+        print(
+            "\n⏸️  Interrupted, an ingestion in progress resumes where it stopped on the next run"
+        )
+        sys.exit(130)
     except Exception as e:
         print(f"❌ Application failed: {e}")
         print("\n🔧 Troubleshooting tips:")
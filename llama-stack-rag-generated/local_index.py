@@ -0,0 +1,762 @@
+#!/usr/bin/env python3
+"""
+Vector index kept next to the client, for retrieval without the server.
+
+The index holds normalized embeddings in a NumPy array and scores a query
+against them with a dot product (cosine similarity). Small indexes are
+searched exhaustively; once an inverted file (IVF) has been built, the
+vectors are grouped by their nearest k-means centroid and only the lists of
+the `nprobe` centroids closest to the query are scored. An index is saved to
+and loaded from a .npz file without pickling anything, with the chunk texts
+back to back in a .texts file next to it. The texts are read memory-mapped
+from that file, so only the texts of the chunks found are paged in.
+
+The vectors can be quantized to take less memory: int8 keeps one byte per
+dimension with a scale per dimension (4x smaller than float32), product
+quantization (PQ) splits each vector into subvectors and keeps the index of
+the nearest of 256 centroids for each, one byte per subvector (32x smaller
+with 48 subvectors of 384 dimensions). Searches score the quantized codes and
+can then rescore the best candidates exactly with the float32 vectors, which
+a saved quantized index keeps in a separate .npy file that is memory-mapped
+rather than read, so only the rows being rescored are paged in.
+
+Searches can be restricted to the chunks whose metadata matches a filter
+(see metadata_filter.py). The matching rows are found from columns of
+metadata values before anything is scored, equality and set predicates
+through the rows grouped by value so a filter on a few documents costs a
+lookup rather than a scan. A filter matching fewer rows than the IVF would
+score is searched exhaustively, otherwise the IVF probes as many more lists
+as it takes for the usual number of candidates to match.
+
+An index can carry a second, coarse index in `documents` with one entry per
+document (its title, headings and lead paragraph), for finding the
+documents worth searching before searching their chunks. It is saved next
+to the index in a .documents.npz file.
+
+Embedders are plain callables turning a list of texts into an array with one
+row per text, with a `name` and a `dimension`:
+
+    SentenceTransformerEmbedder  runs a sentence-transformers model locally
+                                 (same vectors as the server's all-MiniLM-L6-v2)
+    HashingEmbedder              deterministic hashed bag of words, no model
+                                 needed, for tests and as a last resort
+    CachedEmbedder               remembers the embeddings of recent texts from
+                                 another embedder
+"""
+
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from vector_snapshot import from_json_array, json_array
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+_TOKEN = re.compile(r"\w+")
+# rows scored at a time over quantized codes, bounds the float32 temporaries
+_BLOCK = 65536
+# filters whose matching rows are remembered
+_FILTER_CACHE_SIZE = 64
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Vectors scaled to unit length, as float32."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _kmeans(data: np.ndarray, k: int, iterations: int, rng, spherical: bool = False) -> np.ndarray:
+    """Centroids of k clusters of data, by cosine similarity if spherical, else by distance."""
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _assign(data, centroids, spherical)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, data)
+        counts = np.bincount(assignment, minlength=k)
+        if spherical:
+            updated = normalize(sums)
+        else:
+            updated = sums / np.maximum(counts, 1)[:, None]
+        empty = counts == 0
+        updated[empty] = centroids[empty]  # keep centroids nothing was assigned to
+        centroids = updated.astype(np.float32)
+    return centroids
+
+
+def _assign(data: np.ndarray, centroids: np.ndarray, spherical: bool = False) -> np.ndarray:
+    """Index of the closest centroid for each row of data."""
+    scores = data @ centroids.T
+    if not spherical:
+        # argmin |x - c|^2 is argmax x.c - |c|^2 / 2
+        scores -= 0.5 * np.einsum("ij,ij->i", centroids, centroids)
+    return np.argmax(scores, axis=1)
+
+
+def _top(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k highest scores, highest first."""
+    k = min(k, len(scores))
+    if k == 0:
+        return np.zeros(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+class HashingEmbedder:
+    """Embeds the words and word pairs of a text into a fixed number of hashed buckets."""
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+        self.name = f"hashing-{dimension}"
+
+    def _features(self, text: str) -> list:
+        words = _TOKEN.findall(text.lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def __call__(self, texts: list) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = int.from_bytes(
+                    hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little"
+                )
+                # the top bit picks the sign so colliding features tend to cancel out
+                vectors[row, digest % self.dimension] += 1.0 if digest >> 63 else -1.0
+        return normalize(vectors)
+
+
+class SentenceTransformerEmbedder:
+    """Embeds texts with a sentence-transformers model run in this process."""
+
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
+        if SentenceTransformer is None:
+            raise ImportError("sentence-transformers is not installed")
+        self._model = SentenceTransformer(model_name)
+        self.dimension = self._model.get_sentence_embedding_dimension()
+        self.name = model_name
+
+    def __call__(self, texts: list) -> np.ndarray:
+        return self._model.encode(
+            texts, normalize_embeddings=True, convert_to_numpy=True, show_progress_bar=False
+        ).astype(np.float32)
+
+
+class CachedEmbedder:
+    """Wraps an embedder, embedding only the texts not among the most recently embedded."""
+
+    def __init__(self, embedder, size: int = 10000):
+        """
+        Args:
+            embedder: The embedder to wrap
+            size: Most embeddings remembered
+        """
+        self.embedder = embedder
+        self.dimension = embedder.dimension
+        self.name = embedder.name
+        self.size = size
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, texts: list) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        missing: dict = {}
+        with self._lock:
+            for row, text in enumerate(texts):
+                vector = self._cache.get(text)
+                if vector is None:
+                    missing.setdefault(text, []).append(row)
+                else:
+                    self._cache.move_to_end(text)
+                    vectors[row] = vector
+            self.hits += len(texts) - sum(map(len, missing.values()))
+            self.misses += len(missing)
+        if missing:
+            embedded = np.asarray(self.embedder(list(missing)), dtype=np.float32)
+            with self._lock:
+                for (text, rows), vector in zip(missing.items(), embedded):
+                    vectors[rows] = vector
+                    self._cache[text] = vector
+                while len(self._cache) > self.size:
+                    self._cache.popitem(last=False)
+        return vectors
+
+
+class _MappedTexts:
+    """Texts stored back to back in a UTF-8 file, read memory-mapped by position."""
+
+    def __init__(self, path: Path, offsets: np.ndarray):
+        """
+        Args:
+            path: The file of texts
+            offsets: Where each text starts in the file, and where the last one ends
+        """
+        size = path.stat().st_size
+        if size != offsets[-1]:
+            raise ValueError(f"{path} does not hold the texts of the index")
+        self._data = (
+            np.memmap(path, dtype=np.uint8, mode="r") if size else np.zeros(0, dtype=np.uint8)
+        )
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, row: int) -> str:
+        return self._data[self._offsets[row] : self._offsets[row + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        return (self[row] for row in range(len(self)))
+
+
+class Hit(NamedTuple):
+    """A chunk found by a search, shaped like the chunks vector_io.query returns."""
+
+    content: str
+    metadata: dict
+    score: float
+
+
+class LocalVectorIndex:
+    """Chunks and their normalized embeddings, searched exhaustively or through an IVF."""
+
+    def __init__(self, embedder, info: Optional[dict] = None):
+        """
+        Args:
+            embedder: Callable embedding a list of texts, with `name` and `dimension`
+            info: Anything to keep along with the index, such as what it was built from
+        """
+        self.embedder = embedder
+        self.dimension = embedder.dimension
+        self.info = dict(info or {})
+        # the content and metadata of every chunk, the texts memory-mapped once saved or loaded
+        self.texts = []
+        self.metadata: list = []
+        # float32 vectors, None if a quantized index was saved and loaded without them
+        self.vectors: Optional[np.ndarray] = np.zeros((0, self.dimension), dtype=np.float32)
+
+        # IVF: centroids, the row IDs grouped by centroid and where each group starts
+        self.centroids: Optional[np.ndarray] = None
+        self.list_ids: Optional[np.ndarray] = None
+        self.list_offsets: Optional[np.ndarray] = None
+        self.nprobe = 8
+
+        # Quantization: "int8" with a scale per dimension, or "pq" with a codebook per
+        # subvector; candidates per result rescored with the float32 vectors
+        self.quantization: Optional[str] = None
+        self.codes: Optional[np.ndarray] = None
+        self.scales: Optional[np.ndarray] = None
+        self.codebooks: Optional[np.ndarray] = None
+        self.rescore = 4
+
+        # Metadata values of every row by key, the rows grouped by value and the rows
+        # matching recent filters
+        self._columns: dict = {}
+        self._groups: dict = {}
+        self._filtered: dict = {}
+
+        # Coarse index of whole documents, if any
+        self.documents: Optional[LocalVectorIndex] = None
+
+        self._lock = threading.Lock()
+        self.searches = 0
+        self.search_seconds = 0.0
+
+    def __len__(self) -> int:
+        return len(self.metadata)
+
+    def add(self, chunks: list, embeddings: Optional[np.ndarray] = None) -> None:
+        """
+        Add chunks to the index, dropping the IVF and quantization which have to be redone.
+
+        Args:
+            chunks: Dicts with the content and metadata of each chunk
+            embeddings: Their embeddings, computed with the embedder if not given
+        """
+        if self.vectors is None:
+            raise ValueError("chunks can not be added to an index loaded without its vectors")
+        if embeddings is None:
+            embeddings = self.embedder([chunk["content"] for chunk in chunks])
+        embeddings = normalize(embeddings).reshape(len(chunks), self.dimension)
+        self.texts = [*self.texts, *(chunk["content"] for chunk in chunks)]
+        self.metadata.extend(chunk["metadata"] for chunk in chunks)
+        self.vectors = np.concatenate([self.vectors, embeddings])
+        self.centroids = self.list_ids = self.list_offsets = None
+        self.quantization = self.codes = self.scales = self.codebooks = None
+        self._columns, self._groups, self._filtered = {}, {}, {}
+
+    def embeddings_for(self, chunks: list, key: str) -> tuple:
+        """
+        Embeddings of chunks, reusing those of this index for the chunks already in it.
+
+        A chunk is already in the index if one with the same metadata value of key has
+        the same content, so after a change only the changed chunks are embedded.
+
+        Args:
+            chunks: Dicts with the content and metadata of each chunk
+            key: Metadata key identifying a chunk across versions, such as a section ID
+
+        Returns:
+            The embeddings, and how many of the chunks had to be embedded
+        """
+        rows = {}
+        if self.vectors is not None:
+            rows = {metadata.get(key): row for row, metadata in enumerate(self.metadata)}
+            rows.pop(None, None)
+        embeddings = np.zeros((len(chunks), self.dimension), dtype=np.float32)
+        missing = []
+        for position, chunk in enumerate(chunks):
+            row = rows.get(chunk["metadata"].get(key))
+            if row is not None and self.texts[row] == chunk["content"]:
+                embeddings[position] = self.vectors[row]
+            else:
+                missing.append(position)
+        if missing:
+            embeddings[missing] = self.embedder(
+                [chunks[position]["content"] for position in missing]
+            )
+        return embeddings, len(missing)
+
+    def build_ivf(self, nlist: Optional[int] = None, iterations: int = 10, seed: int = 0) -> None:
+        """
+        Cluster the vectors with k-means so searches only score the closest clusters.
+
+        Args:
+            nlist: Number of clusters, about 4 * sqrt(number of chunks) if not given
+            iterations: Rounds of k-means
+            seed: Seed for picking the initial centroids and the training sample
+        """
+        count = len(self.vectors)
+        nlist = min(nlist or int(4 * np.sqrt(count)), count)
+        if nlist < 2:
+            return
+        rng = np.random.default_rng(seed)
+        # a sample of a few hundred vectors per cluster is plenty to place the centroids
+        sample = self.vectors[rng.choice(count, size=min(count, nlist * 256), replace=False)]
+        centroids = _kmeans(sample, nlist, iterations, rng, spherical=True)
+
+        assignment = _assign(self.vectors, centroids, spherical=True)
+        self.list_ids = np.argsort(assignment, kind="stable").astype(np.int64)
+        self.list_offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(assignment, minlength=nlist))]
+        ).astype(np.int64)
+        self.centroids = centroids
+
+    def quantize(
+        self,
+        kind: str,
+        subvectors: int = 48,
+        iterations: int = 10,
+        seed: int = 0,
+        recall_k: int = 10,
+    ) -> dict:
+        """
+        Quantize the vectors, keeping the float32 ones only for rescoring.
+
+        Args:
+            kind: "int8" or "pq"
+            subvectors: Number of subvectors for PQ, must divide the dimension
+            iterations: Rounds of k-means when training the PQ codebooks
+            seed: Seed for the PQ training sample and the recall measurement
+            recall_k: k to measure recall@k against exact float32 search at
+
+        Returns:
+            Memory used before and after, and recall@k with and without rescoring
+        """
+        if kind == "int8":
+            # symmetric per dimension so a dot product only needs the query scaled
+            self.scales = np.maximum(np.abs(self.vectors).max(axis=0), 1e-12) / 127
+            self.codes = np.round(self.vectors / self.scales).astype(np.int8)
+            self.scales = self.scales.astype(np.float32)
+        elif kind == "pq":
+            if self.dimension % subvectors:
+                raise ValueError(
+                    f"{subvectors} subvectors do not divide {self.dimension} dimensions"
+                )
+            rng = np.random.default_rng(seed)
+            split = self.vectors.reshape(len(self.vectors), subvectors, -1)
+            sample = split[rng.choice(len(split), size=min(len(split), 256 * 64), replace=False)]
+            centroids = min(256, len(sample))
+            self.codebooks = np.stack(
+                [_kmeans(sample[:, m], centroids, iterations, rng) for m in range(subvectors)]
+            )
+            self.codes = np.stack(
+                [_assign(split[:, m], self.codebooks[m]) for m in range(subvectors)], axis=1
+            ).astype(np.uint8)
+        else:
+            raise ValueError(f"unknown quantization: {kind}")
+        self.quantization = kind
+
+        report = {
+            "quantization": kind,
+            "float32_mb": round(self.vectors.nbytes / 1e6, 3),
+            "quantized_mb": round(self._quantized_bytes() / 1e6, 3),
+        }
+        report.update(self.measure_recall(recall_k, seed=seed))
+        self.info["quantization_report"] = report
+        return report
+
+    def _quantized_bytes(self) -> int:
+        return sum(
+            array.nbytes for array in (self.codes, self.scales, self.codebooks) if array is not None
+        )
+
+    def _candidates(self, query: np.ndarray, nprobe: int) -> Optional[np.ndarray]:
+        """Row IDs in the IVF lists closest to the query, None to search everything."""
+        if self.centroids is None or nprobe >= len(self.centroids):
+            return None
+        closest = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate(
+            [self.list_ids[self.list_offsets[i] : self.list_offsets[i + 1]] for i in closest]
+        )
+
+    def _column(self, key: str) -> np.ndarray:
+        """The value of a metadata key for every row, as strings, built on first use."""
+        column = self._columns.get(key)
+        if column is None:
+            column = np.array([str(metadata.get(key, "")) for metadata in self.metadata])
+            self._columns[key] = column
+        return column
+
+    def _rows_with(self, key: str, values) -> np.ndarray:
+        """Rows whose value of a metadata key is one of values, sorted."""
+        groups = self._groups.get(key)
+        if groups is None:
+            column = self._column(key)
+            order = np.argsort(column, kind="stable")
+            keys, starts = np.unique(column[order], return_index=True)
+            groups = (keys, np.append(starts, len(order)), order)
+            self._groups[key] = groups
+        keys, bounds, order = groups
+        positions = np.searchsorted(keys, values)
+        found = [
+            order[bounds[i] : bounds[i + 1]]
+            for i, value in zip(positions, values)
+            if i < len(keys) and keys[i] == value
+        ]
+        return np.sort(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+
+    def filter_rows(self, metadata_filter) -> np.ndarray:
+        """Rows whose metadata matches a MetadataFilter."""
+        rows = self._filtered.get(metadata_filter)
+        if rows is None:
+            lookups = [(key, [value]) for key, value in metadata_filter.equals]
+            lookups += [(key, list(values)) for key, values in metadata_filter.one_of]
+            for key, values in lookups:
+                matching = self._rows_with(key, values)
+                rows = matching if rows is None else np.intersect1d(rows, matching)
+            if rows is None:
+                rows = np.arange(len(self.metadata))
+            for key, prefix in metadata_filter.prefixes:
+                rows = rows[np.char.startswith(self._column(key)[rows], prefix)]
+            with self._lock:
+                if len(self._filtered) >= _FILTER_CACHE_SIZE:
+                    self._filtered.clear()
+                self._filtered[metadata_filter] = rows
+        return rows
+
+    def _score(self, query: np.ndarray, ids: Optional[np.ndarray]) -> np.ndarray:
+        """Scores of the query against rows ids (every row if None), from the codes if quantized."""
+        if self.quantization is None:
+            return (self.vectors if ids is None else self.vectors[ids]) @ query
+        codes = self.codes if ids is None else self.codes[ids]
+        if self.quantization == "int8":
+            scaled = query * self.scales
+
+            def score_block(block):
+                return block.astype(np.float32) @ scaled
+
+        else:
+            # lookup table of the query's dot product with every centroid of every subvector
+            subvectors = len(self.codebooks)
+            table = np.einsum("mcd,md->mc", self.codebooks, query.reshape(subvectors, -1))
+            positions = np.arange(subvectors)
+
+            def score_block(block):
+                return table[positions, block].sum(axis=1)
+
+        return np.concatenate(
+            [score_block(codes[start : start + _BLOCK]) for start in range(0, len(codes), _BLOCK)]
+            or [np.zeros(0, dtype=np.float32)]
+        )
+
+    def _search_rows(
+        self,
+        query: np.ndarray,
+        k: int,
+        nprobe: int,
+        rescore: int,
+        allowed: Optional[np.ndarray] = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Rows of the k best chunks for a normalized query, among allowed if given."""
+        if allowed is not None and self.centroids is not None:
+            # probe more lists so as many candidates survive the filter as without one
+            nprobe = int(np.ceil(nprobe * len(self.metadata) / max(len(allowed), 1)))
+        ids = self._candidates(query, nprobe)
+        if allowed is not None:
+            if ids is None or len(allowed) <= len(ids):
+                ids = allowed  # the filter narrows the search down more than the IVF
+            else:
+                ids = ids[np.isin(ids, allowed, assume_unique=True)]
+        scores = self._score(query, ids)
+        rescoring = self.quantization is not None and rescore > 0 and self.vectors is not None
+        top = _top(scores, k * rescore if rescoring else k)
+        rows = top if ids is None else ids[top]
+        scores = scores[top]
+        if rescoring:
+            scores = self.vectors[rows] @ query
+            best = _top(scores, k)
+            rows, scores = rows[best], scores[best]
+        return rows, scores
+
+    def search_vector(
+        self,
+        query: np.ndarray,
+        k: int,
+        nprobe: Optional[int] = None,
+        metadata_filter=None,
+    ) -> list:
+        """
+        Find the chunks closest to an embedding.
+
+        Args:
+            query: Embedding of the query
+            k: Number of chunks wanted
+            nprobe: IVF lists to search, defaults to `self.nprobe`
+            metadata_filter: MetadataFilter the chunks have to match, if any
+
+        Returns:
+            Up to k Hits, closest first
+        """
+        start = time.perf_counter()
+        query = normalize(query).reshape(self.dimension)
+        allowed = self.filter_rows(metadata_filter) if metadata_filter else None
+        rows, scores = self._search_rows(query, k, nprobe or self.nprobe, self.rescore, allowed)
+        hits = [
+            Hit(self.texts[row], self.metadata[row], float(score))
+            for row, score in zip(rows, scores)
+        ]
+        with self._lock:
+            self.searches += 1
+            self.search_seconds += time.perf_counter() - start
+        return hits
+
+    def search(self, text: str, k: int, nprobe: Optional[int] = None, metadata_filter=None) -> list:
+        """Find the chunks closest to a text, see search_vector."""
+        return self.search_vector(self.embedder([text])[0], k, nprobe, metadata_filter)
+
+    def search_many(
+        self, texts: list, k: int, nprobe: Optional[int] = None, metadata_filter=None
+    ) -> list:
+        """
+        Find the chunks closest to each of several texts.
+
+        The texts are embedded in one call. Without IVF, quantization or a filter they are
+        scored with one matrix product; otherwise each is searched as in search_vector.
+
+        Returns:
+            One list of up to k Hits per text, closest first
+        """
+        queries = normalize(np.asarray(self.embedder(texts), dtype=np.float32))
+        if self.centroids is not None or self.quantization is not None or metadata_filter:
+            return [self.search_vector(query, k, nprobe, metadata_filter) for query in queries]
+
+        start = time.perf_counter()
+        scores = self.vectors @ queries.T
+        results = []
+        for column in scores.T:
+            rows = _top(column, k)
+            results.append(
+                [Hit(self.texts[row], self.metadata[row], float(column[row])) for row in rows]
+            )
+        with self._lock:
+            self.searches += len(texts)
+            self.search_seconds += time.perf_counter() - start
+        return results
+
+    def measure_recall(self, k: int = 10, queries: int = 200, seed: int = 0) -> dict:
+        """
+        Recall@k of searches against exact float32 search, with and without rescoring.
+
+        Stored vectors are used as the queries, leaving the query's own row out of both
+        result lists.
+        """
+        if self.vectors is None or len(self.vectors) <= k:
+            return {}
+        rng = np.random.default_rng(seed)
+        sample = rng.choice(len(self.vectors), size=min(queries, len(self.vectors)), replace=False)
+        settings = {f"recall_at_{k}": 0}
+        if self.quantization is not None:
+            settings[f"recall_at_{k}_rescored"] = self.rescore
+        recall = dict.fromkeys(settings, 0.0)
+        for row in sample:
+            query = np.asarray(self.vectors[row])
+            exact = set(_top(self.vectors @ query, k + 1).tolist()) - {row}
+            for name, rescore in settings.items():
+                found = set(self._search_rows(query, k + 1, self.nprobe, rescore)[0].tolist())
+                recall[name] += len(exact & (found - {row})) / len(exact)
+        return {name: round(total / len(sample), 4) for name, total in recall.items()}
+
+    def _vectors_path(self, path: Path) -> Path:
+        return path.with_name(f"{path.stem}.vectors.npy")
+
+    def _documents_path(self, path: Path) -> Path:
+        return path.with_name(f"{path.stem}.documents.npz")
+
+    def _texts_path(self, path: Path) -> Path:
+        return path.with_name(f"{path.stem}.texts")
+
+    def _save_texts(self, path: Path) -> np.ndarray:
+        """Write the texts back to back to a .texts file, returning where each starts."""
+        texts_path = self._texts_path(path)
+        tmp_path = texts_path.with_name(f".{texts_path.name}.tmp")
+        offsets = np.zeros(len(self.texts) + 1, dtype=np.int64)
+        with tmp_path.open("wb") as f:
+            for row, text in enumerate(self.texts):
+                offsets[row + 1] = offsets[row] + f.write(text.encode("utf-8"))
+        tmp_path.replace(texts_path)
+        return offsets
+
+    def save(self, path: str) -> None:
+        """
+        Write the index atomically to a .npz file.
+
+        The texts of the chunks go in a .texts file next to it, and from then on are read
+        memory-mapped from that file. A quantized index keeps its float32 vectors, used for
+        rescoring, in a .vectors.npy file next to it instead, and from then on reads them
+        memory-mapped from that file rather than holding them in memory. The document
+        index, if there is one, goes in a .documents.npz file.
+        """
+        path = Path(path)
+        if self.documents is not None:
+            self.documents.save(self._documents_path(path))
+        else:
+            self._documents_path(path).unlink(missing_ok=True)
+        offsets = self._save_texts(path)
+        self.texts = _MappedTexts(self._texts_path(path), offsets)
+        arrays = {
+            "metadata": json_array(self.metadata),
+            "text_offsets": offsets,
+            "info": json_array(
+                {
+                    **self.info,
+                    "embedder": self.embedder.name,
+                    "quantization": self.quantization,
+                }
+            ),
+        }
+        if self.quantization is None:
+            arrays["vectors"] = self.vectors
+            self._vectors_path(path).unlink(missing_ok=True)
+        else:
+            arrays["codes"] = self.codes
+            arrays.update(
+                {"scales": self.scales}
+                if self.quantization == "int8"
+                else {"codebooks": self.codebooks}
+            )
+            if self.vectors is not None:
+                vectors_path = self._vectors_path(path)
+                tmp_path = vectors_path.with_name(f".{vectors_path.name}.tmp")
+                with tmp_path.open("wb") as f:
+                    np.save(f, np.asarray(self.vectors))
+                tmp_path.replace(vectors_path)
+                # only the rows that are rescored are read from the file
+                self.vectors = np.load(vectors_path, mmap_mode="r")
+        if self.centroids is not None:
+            arrays.update(
+                centroids=self.centroids, list_ids=self.list_ids, list_offsets=self.list_offsets
+            )
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with tmp_path.open("wb") as f:
+            np.savez(f, **arrays)
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: str, embedder) -> "LocalVectorIndex":
+        """
+        Read an index written by save.
+
+        Args:
+            path: File to read
+            embedder: Embedder for queries, must be the one the index was built with
+
+        Returns:
+            The loaded index
+        """
+        path = Path(path)
+        with np.load(path, allow_pickle=False) as data:
+            info = from_json_array(data["info"])
+            if info.pop("embedder") != embedder.name:
+                raise ValueError(f"index {path} was not built with {embedder.name}")
+            index = cls(embedder, info)
+            index.quantization = info.pop("quantization", None)
+            if "chunks" in data:
+                # saved before the texts had a file of their own
+                chunks = from_json_array(data["chunks"])
+                index.texts = [chunk["content"] for chunk in chunks]
+                index.metadata = [chunk["metadata"] for chunk in chunks]
+            else:
+                index.texts = _MappedTexts(index._texts_path(path), data["text_offsets"])
+                index.metadata = from_json_array(data["metadata"])
+            if index.quantization is None:
+                index.vectors = data["vectors"]
+            else:
+                index.codes = data["codes"]
+                index.scales = data.get("scales")
+                index.codebooks = data.get("codebooks")
+                vectors_path = index._vectors_path(path)
+                # only the rows that are rescored are read from the file
+                index.vectors = (
+                    np.load(vectors_path, mmap_mode="r") if vectors_path.exists() else None
+                )
+            if "centroids" in data:
+                index.centroids = data["centroids"]
+                index.list_ids = data["list_ids"]
+                index.list_offsets = data["list_offsets"]
+        if index._documents_path(path).exists():
+            index.documents = cls.load(index._documents_path(path), embedder)
+        rows = len(index.codes if index.codes is not None else index.vectors)
+        if (
+            rows != len(index)
+            or len(index.texts) != len(index)
+            or (index.vectors is not None and index.vectors.shape != (rows, index.dimension))
+        ):
+            raise ValueError(f"index {path} is inconsistent with its {len(index)} chunks")
+        return index
+
+    def stats(self) -> dict:
+        """Size of the index and how long searches take."""
+        if self.quantization is None:
+            resident = self.vectors.nbytes
+        else:
+            resident = self._quantized_bytes()
+            if self.vectors is not None and not isinstance(self.vectors, np.memmap):
+                resident += self.vectors.nbytes
+        with self._lock:
+            return {
+                "embedder": self.embedder.name,
+                "chunks": len(self),
+                "mode": "ivf" if self.centroids is not None else "exact",
+                "lists": 0 if self.centroids is None else len(self.centroids),
+                "nprobe": self.nprobe,
+                "storage": self.quantization or "float32",
+                "rescore": self.rescore if self.quantization and self.vectors is not None else 0,
+                "index_mb": round(resident / 1e6, 3),
+                **self.info.get("quantization_report", {}),
+                "documents": 0 if self.documents is None else len(self.documents),
+                "searches": self.searches,
+                "avg_search_ms": (
+                    round(self.search_seconds * 1000 / self.searches, 3) if self.searches else 0
+                ),
+            }
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Filters restricting retrieval to chunks whose metadata matches.
+
+A filter is a conjunction of predicates on the chunk metadata written at
+ingestion (source, type, title, document_id, section, ...): a key equal to a
+value, equal to one of several values, or starting with a prefix. Filters
+are hashable so they can be part of cache and coalescing keys. They are
+written in JSON as
+
+    {"type": "markdown", "source": {"prefix": "nodejs-reference-architecture/docs/development/"},
+     "document_id": ["docs/development/npm-proxy", "docs/development/code-consistency"]}
+
+and on the command line as `type=markdown` and `source^=nodejs-reference-architecture/docs/development/`.
+"""
+
+from typing import Optional
+
+
+class MetadataFilter:
+    """Equality, set membership and prefix predicates that all have to hold for a chunk."""
+
+    def __init__(
+        self,
+        equals: Optional[dict] = None,
+        prefixes: Optional[dict] = None,
+        one_of: Optional[dict] = None,
+    ):
+        """
+        Args:
+            equals: Metadata keys and the value each has to be equal to
+            prefixes: Metadata keys and the prefix each has to start with
+            one_of: Metadata keys and the values each has to be one of
+        """
+        self.equals = tuple(sorted((key, str(value)) for key, value in (equals or {}).items()))
+        self.prefixes = tuple(sorted((key, str(value)) for key, value in (prefixes or {}).items()))
+        self.one_of = tuple(
+            sorted(
+                (key, tuple(sorted({str(value) for value in values})))
+                for key, values in (one_of or {}).items()
+            )
+        )
+
+    @classmethod
+    def from_json(cls, value) -> Optional["MetadataFilter"]:
+        """Filter from its JSON form, None if value is None. Raises ValueError if malformed."""
+        if value is None:
+            return None
+        if not isinstance(value, dict):
+            raise ValueError("a filter must be an object of metadata keys")
+        equals, prefixes, one_of = {}, {}, {}
+        for key, predicate in value.items():
+            if isinstance(predicate, dict) and set(predicate) == {"prefix"}:
+                prefixes[key] = predicate["prefix"]
+            elif isinstance(predicate, list) and all(
+                isinstance(item, (str, int, float, bool)) for item in predicate
+            ):
+                one_of[key] = predicate
+            elif isinstance(predicate, (str, int, float, bool)):
+                equals[key] = predicate
+            else:
+                raise ValueError(
+                    f"'{key}' must be a value, a list of values or {{\"prefix\": ...}}"
+                )
+        return cls(equals, prefixes, one_of) or None
+
+    @classmethod
+    def from_expressions(cls, expressions: Optional[list]) -> Optional["MetadataFilter"]:
+        """Filter from `key=value` and `key^=prefix` expressions, None if there are none."""
+        equals, prefixes = {}, {}
+        for expression in expressions or []:
+            key, operator, value = expression.partition("=")
+            if not operator or not key:
+                raise ValueError(f"expected key=value or key^=prefix, got '{expression}'")
+            if key.endswith("^"):
+                prefixes[key[:-1]] = value
+            else:
+                equals[key] = value
+        return cls(equals, prefixes) or None
+
+    def matches(self, metadata: dict) -> bool:
+        """Whether a chunk with this metadata passes the filter."""
+        return (
+            all(key in metadata and str(metadata[key]) == value for key, value in self.equals)
+            and all(key in metadata and str(metadata[key]) in values for key, values in self.one_of)
+            and all(str(metadata.get(key, "")).startswith(prefix) for key, prefix in self.prefixes)
+        )
+
+    def narrowed(self, key: str, values) -> "MetadataFilter":
+        """This filter with the added predicate that key is one of values."""
+        return MetadataFilter(
+            dict(self.equals), dict(self.prefixes), {**dict(self.one_of), key: values}
+        )
+
+    def renamed(self, key: str, new_key: str) -> "MetadataFilter":
+        """This filter with the predicates on key applied to new_key instead."""
+
+        def rename(predicates) -> dict:
+            return {new_key if name == key else name: value for name, value in predicates}
+
+        return MetadataFilter(rename(self.equals), rename(self.prefixes), rename(self.one_of))
+
+    def restricted_to(self, keys) -> Optional["MetadataFilter"]:
+        """The predicates of this filter on the given keys only, None if there are none."""
+        return (
+            MetadataFilter(
+                {key: value for key, value in self.equals if key in keys},
+                {key: prefix for key, prefix in self.prefixes if key in keys},
+                {key: values for key, values in self.one_of if key in keys},
+            )
+            or None
+        )
+
+    def server_filters(self) -> Optional[dict]:
+        """
+        The equality and set predicates as vector store search filters, None if there are none.
+
+        The search API has no prefix comparison, prefix predicates are applied to the
+        results instead.
+        """
+        comparisons = [{"type": "eq", "key": key, "value": value} for key, value in self.equals]
+        for key, values in self.one_of:
+            alternatives = [{"type": "eq", "key": key, "value": value} for value in values]
+            comparisons.append(
+                alternatives[0]
+                if len(alternatives) == 1
+                else {"type": "or", "filters": alternatives}
+            )
+        if len(comparisons) > 1:
+            return {"type": "and", "filters": comparisons}
+        return comparisons[0] if comparisons else None
+
+    def to_json(self) -> dict:
+        return {
+            **dict(self.equals),
+            **{key: list(values) for key, values in self.one_of},
+            **{key: {"prefix": p} for key, p in self.prefixes},
+        }
+
+    def __bool__(self) -> bool:
+        return bool(self.equals or self.prefixes or self.one_of)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, MetadataFilter) and (self.equals, self.prefixes, self.one_of) == (
+            other.equals,
+            other.prefixes,
+            other.one_of,
+        )
+
+    def __hash__(self) -> int:
+        return hash((self.equals, self.prefixes, self.one_of))
+
+    def __repr__(self) -> str:
+        predicates = [f"{key}={value}" for key, value in self.equals]
+        predicates += [f"{key} in ({', '.join(values)})" for key, values in self.one_of]
+        predicates += [f"{key}^={prefix}" for key, prefix in self.prefixes]
+        return " ".join(predicates)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Micro-batching of concurrent retrieval requests.
+
+Requests that arrive within a few milliseconds of each other are collected
+and dispatched together, either as a single batch call where the API allows
+it or as pipelined concurrent calls otherwise. Identical requests in the same
+batch are only dispatched once.
+"""
+
+import asyncio
+import time
+from typing import Callable, Optional
+
+
+class MicroBatcher:
+    """Collects requests for up to max_wait_ms (or max_batch requests) and dispatches them together."""
+
+    def __init__(
+        self,
+        dispatch_one: Callable,
+        dispatch_batch: Optional[Callable[[list], list]] = None,
+        max_wait_ms: float = 5.0,
+        max_batch: int = 16,
+    ):
+        """
+        Args:
+            dispatch_one: Handles a single request, used for pipelined concurrent dispatch
+            dispatch_batch: Handles a list of requests in one call, returning results in order
+            max_wait_ms: Longest time the first request of a batch waits for others to join
+            max_batch: Largest number of requests dispatched together
+        """
+        self.dispatch_one = dispatch_one
+        self.dispatch_batch = dispatch_batch
+        self.max_wait_ms = max_wait_ms
+        self.max_batch = max_batch
+
+        self._pending: list = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+        self.total_queue_ms = 0.0
+        self.max_queue_ms = 0.0
+
+    async def submit(self, item):
+        """Queue a request (which must be hashable) and wait for its result."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future, time.perf_counter()))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_ms / 1000, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        """Dispatch everything collected so far."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._dispatch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, batch: list) -> None:
+        """Run one batch and hand the results back to the waiting requests."""
+        now = time.perf_counter()
+        for _item, _future, queued in batch:
+            queue_ms = (now - queued) * 1000
+            self.total_queue_ms += queue_ms
+            self.max_queue_ms = max(self.max_queue_ms, queue_ms)
+        self.batches += 1
+        self.items += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+
+        unique = list(dict.fromkeys(item for item, _future, _queued in batch))
+        try:
+            if self.dispatch_batch is not None:
+                results = await asyncio.to_thread(self.dispatch_batch, unique)
+            else:
+                results = await asyncio.gather(
+                    *(asyncio.to_thread(self.dispatch_one, item) for item in unique),
+                    return_exceptions=True,
+                )
+        except Exception as e:
+            results = [e] * len(unique)
+        by_item = dict(zip(unique, results))
+
+        for item, future, _queued in batch:
+            if future.done():
+                continue
+            result = by_item[item]
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        """Batch size and queueing delay seen so far."""
+        return {
+            "batches": self.batches,
+            "requests": self.items,
+            "mean_batch_size": round(self.items / self.batches, 2) if self.batches else 0,
+            "largest_batch": self.largest_batch,
+            "mean_queue_ms": round(self.total_queue_ms / self.items, 2) if self.items else 0,
+            "max_queue_ms": round(self.max_queue_ms, 2),
+        }
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Query variants for multi-query retrieval, and reciprocal rank fusion of their results.
+
+A short question often misses chunks that use other words for the same
+thing. Searching with a few variants of the question and fusing the ranked
+lists finds more of them without asking for more chunks per search. Variants
+are made locally from the question's keywords and its parts (for questions
+like "x and y"), or asked of a model with model_variant_prompt and read back
+with parse_model_variants.
+
+Reciprocal rank fusion scores an item 1 / (k + rank) in every list it is in
+and sums those up, so items found by several variants rise to the top and the
+scores of different searches never have to be compared.
+"""
+
+import re
+from typing import Callable, Hashable, Optional
+
+_WORD = re.compile(r"[\w.+#-]*\w")
+# question words, auxiliaries and other words that only carry the shape of a question
+_STOPWORD_TEXT = """
+    a an the and or of to in on for with by at from as is are was were be been being it its
+    this that these those i we you he she they me my our your do does did doing can could
+    should would will shall may might must what which who whom whose when where why how
+    if then than so there here about into over any some all no not vs versus
+"""
+_STOPWORDS = frozenset(_STOPWORD_TEXT.split())
+# where a compound question splits into parts that are worth searching on their own
+_PARTS = re.compile(r"\s*(?:,|;|\band\b|\bor\b|\bvs\.?|\bversus\b)\s*", re.IGNORECASE)
+# numbering or bullets a model puts in front of its lines
+_LIST_MARKER = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s*")
+
+
+def keywords(text: str) -> str:
+    """The words of a text without the ones that only make it a question."""
+    return " ".join(word for word in _WORD.findall(text.lower()) if word not in _STOPWORDS)
+
+
+def local_variants(question: str, count: int = 3) -> list:
+    """
+    Variants of a question made without a model.
+
+    Args:
+        question: The question as asked
+        count: Most variants to return, the question itself included
+
+    Returns:
+        The question followed by its keywords and the keywords of each of its parts,
+        without duplicates
+    """
+    variants = [question, keywords(question)]
+    parts = [keywords(part) for part in _PARTS.split(question)]
+    if len([part for part in parts if part]) > 1:
+        variants.extend(parts)
+
+    unique = []
+    seen = set()
+    for variant in variants:
+        normalized = " ".join(variant.lower().split())
+        if normalized and normalized not in seen:
+            seen.add(normalized)
+            unique.append(variant)
+    return unique[:count]
+
+
+def model_variant_prompt(question: str, count: int) -> str:
+    """Prompt asking a model for count search queries for a question."""
+    return (
+        f"Write {count} different search queries for finding documentation that answers "
+        "the question below. Use other words than the question where you can. Reply with "
+        "one query per line and nothing else.\n\n"
+        f"Question: {question}"
+    )
+
+
+def parse_model_variants(question: str, reply: str, count: int) -> list:
+    """
+    The variants in a model's reply to model_variant_prompt.
+
+    Returns:
+        The question followed by up to count - 1 queries from the reply
+    """
+    variants = [question]
+    seen = {" ".join(question.lower().split())}
+    for line in reply.splitlines():
+        variant = _LIST_MARKER.sub("", line).strip().strip('"')
+        normalized = " ".join(variant.lower().split())
+        if normalized and normalized not in seen:
+            seen.add(normalized)
+            variants.append(variant)
+    return variants[:count]
+
+
+def reciprocal_rank_fusion(
+    result_lists: list, key: Callable[[object], Hashable], k: int = 60, limit: Optional[int] = None
+) -> list:
+    """
+    Fuse ranked lists of results into one.
+
+    Args:
+        result_lists: Lists of results, best first
+        key: Identifies the same result across lists
+        k: Damping constant, larger values flatten the difference between ranks
+        limit: Most results to return, all of them if None
+
+    Returns:
+        The distinct results by descending fused score; ties keep the order they
+        were first seen in
+    """
+    scores: dict = {}
+    first: dict = {}
+    for results in result_lists:
+        for rank, result in enumerate(results, 1):
+            identity = key(result)
+            scores[identity] = scores.get(identity, 0.0) + 1.0 / (k + rank)
+            first.setdefault(identity, result)
+    fused = sorted(first, key=lambda identity: -scores[identity])
+    return [first[identity] for identity in fused[:limit]]
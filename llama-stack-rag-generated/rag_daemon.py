@@ -0,0 +1,559 @@
+#!/usr/bin/env python3
+"""
+Long running query daemon for the Llama Stack RAG application.
+
+The expensive setup (client construction, knowledge bank checks, agent and
+session creation) is done once by the caller. After that each question only
+costs retrieval plus inference. Questions are served over a small HTTP API on
+either a TCP port or a Unix socket:
+
+    POST /v1/ask     {"question": "...", "use_rag": true, "stream": false, "filter": {...}}
+    POST /v1/ingest  (re-ingest the documents in the background)
+    GET  /metrics
+    GET  /health
+"""
+
+import asyncio
+import contextlib
+import json
+import time
+from dataclasses import dataclass
+from http import HTTPStatus
+from pathlib import Path
+from typing import AsyncIterator, Callable, Iterable, Optional
+
+from admission import AdmissionController, OverloadedError
+from context_compression import ContextCompressor, estimate_tokens
+from latency_budget import ContextBudgetController, trim_documents
+from metadata_filter import MetadataFilter
+from micro_batcher import MicroBatcher
+from singleflight import Flight, SingleFlight, normalize_question
+
+
+@dataclass(frozen=True)
+class RetrievalRequest:
+    """One question's retrieval, as queued on the micro-batcher (so it must be hashable)."""
+
+    question: str
+    metadata_filter: Optional[MetadataFilter]
+    top_k: int
+
+
+class RagService:
+    """Answers questions with retrieval + chat completion using warm callables."""
+
+    def __init__(
+        self,
+        retrieve: Callable[..., list],
+        build_prompt: Callable[[str, list], str],
+        infer: Callable[[str, int], str],
+        *,
+        use_rag: bool = True,
+        batcher: Optional[MicroBatcher] = None,
+        top_k: int = 5,
+        max_tokens: int = 500,
+        degraded_max_tokens: int = 200,
+        degraded_skip_rag: bool = False,
+        infer_stream: Optional[Callable[[str, int], Iterable[str]]] = None,
+        compressor: Optional[ContextCompressor] = None,
+        budget: Optional[ContextBudgetController] = None,
+    ):
+        """
+        Args:
+            retrieve: Returns the relevant document contents for (question, metadata filter,
+                top_k), restricted to chunks matching the filter if there is one
+            build_prompt: Builds the context enhanced prompt from a question and documents
+            infer: Runs inference for (prompt, max_tokens) and returns the answer text
+            use_rag: Whether the knowledge bank can be used at all
+            batcher: Micro-batcher that concurrent retrievals are funnelled through, as
+                RetrievalRequests
+            top_k: Number of chunks retrieved per question, unless a budget controller
+                chooses it
+            max_tokens: Maximum number of tokens generated per answer
+            degraded_max_tokens: Maximum number of tokens generated when overloaded
+            degraded_skip_rag: Whether to skip retrieval when overloaded
+            infer_stream: Runs inference for (prompt, max_tokens) yielding the answer text as it
+                is generated, used instead of infer when the caller wants the tokens
+            compressor: Compresses the retrieved documents before the prompt is built, and
+                keeps the answer latency with and without compression
+            budget: Chooses top_k and the context token budget of every question from the
+                recent answer latency
+        """
+        self.retrieve = retrieve
+        self.build_prompt = build_prompt
+        self.infer = infer
+        self.use_rag = use_rag
+        self.batcher = batcher
+        self.top_k = top_k
+        self.max_tokens = max_tokens
+        self.degraded_max_tokens = degraded_max_tokens
+        self.degraded_skip_rag = degraded_skip_rag
+        self.infer_stream = infer_stream
+        self.compressor = compressor
+        self.budget = budget
+
+    def _stream_inference(self, prompt: str, max_tokens: int, on_token, loop) -> tuple:
+        """
+        Run streaming inference (in a worker thread), handing tokens to the event loop.
+
+        Returns:
+            The answer text and the seconds until its first token
+        """
+        start = time.perf_counter()
+        first_token_seconds = None
+        pieces = []
+        for piece in self.infer_stream(prompt, max_tokens):
+            if first_token_seconds is None:
+                first_token_seconds = time.perf_counter() - start
+            pieces.append(piece)
+            loop.call_soon_threadsafe(on_token, piece)
+        return "".join(pieces), first_token_seconds
+
+    async def answer(
+        self,
+        question: str,
+        use_rag: Optional[bool] = None,
+        degraded: bool = False,
+        on_token: Optional[Callable[[str], None]] = None,
+        metadata_filter: Optional[MetadataFilter] = None,
+    ) -> dict:
+        """Answer a single question, returning the answer along with timings."""
+        start = time.perf_counter()
+        prompt = question
+        documents = []
+        compression = None
+        budget = self.budget.budget() if self.budget is not None else None
+        if self.use_rag and use_rag is not False and not (degraded and self.degraded_skip_rag):
+            request = RetrievalRequest(
+                question, metadata_filter, budget.top_k if budget else self.top_k
+            )
+            if self.batcher is not None:
+                documents = await self.batcher.submit(request)
+            else:
+                documents = await asyncio.to_thread(
+                    self.retrieve, request.question, request.metadata_filter, request.top_k
+                )
+            if documents and self.compressor is not None:
+                compression = self.compressor.compress(
+                    question, documents, budget.context_tokens if budget else None
+                )
+                documents = compression.documents
+            if documents and budget is not None and not (compression and compression.compressed):
+                # questions held out from compression still keep to the budget
+                documents = trim_documents(documents, budget.context_tokens)
+            if documents:
+                prompt = self.build_prompt(question, documents)
+        retrieved = time.perf_counter()
+
+        max_tokens = self.degraded_max_tokens if degraded else self.max_tokens
+        first_token_seconds = None
+        if on_token is not None and self.infer_stream is not None:
+            answer, first_token_seconds = await asyncio.to_thread(
+                self._stream_inference, prompt, max_tokens, on_token, asyncio.get_running_loop()
+            )
+        else:
+            answer = await asyncio.to_thread(self.infer, prompt, max_tokens)
+            if on_token is not None:
+                on_token(answer)
+        finished = time.perf_counter()
+        if compression is not None:
+            self.compressor.record_answer(compression.compressed, finished - retrieved)
+        if self.budget is not None:
+            self.budget.record(estimate_tokens(prompt), finished - start, first_token_seconds)
+
+        return {
+            "answer": answer,
+            "degraded": degraded,
+            "documents": len(documents),
+            "retrieval_ms": round((retrieved - start) * 1000, 1),
+            "inference_ms": round((finished - retrieved) * 1000, 1),
+        }
+
+    def metrics(self) -> dict:
+        """Metrics exported on /metrics."""
+        metrics = {}
+        if self.batcher:
+            metrics["retrieval_batching"] = self.batcher.stats()
+        if self.compressor:
+            metrics["context_compression"] = self.compressor.stats()
+        if self.budget:
+            metrics["context_budget"] = self.budget.stats()
+        return metrics
+
+
+class AgentService:
+    """Answers questions with a warm agent, handing out one session per in-flight question."""
+
+    def __init__(self, ask: Callable[[str, str], str], session_ids: list):
+        """
+        Args:
+            ask: Runs an agent turn for (session_id, question) and returns the answer text
+            session_ids: IDs of the pre-created sessions to use
+        """
+        self.ask = ask
+        self.session_ids = list(session_ids)
+        self._sessions: Optional[asyncio.Queue] = None
+
+    async def answer(
+        self,
+        question: str,
+        on_token: Optional[Callable[[str], None]] = None,
+    ) -> dict:
+        """
+        Answer a single question on the first free session.
+
+        The agent decides on its own when to search the knowledge bank and an agent
+        turn has no token limit, so there is no use_rag, filter or degraded path here.
+        """
+        if self._sessions is None:
+            self._sessions = asyncio.Queue()
+            for session_id in self.session_ids:
+                self._sessions.put_nowait(session_id)
+
+        start = time.perf_counter()
+        session_id = await self._sessions.get()
+        try:
+            answer = await asyncio.to_thread(self.ask, session_id, question)
+        finally:
+            self._sessions.put_nowait(session_id)
+        if on_token is not None:
+            on_token(answer)
+
+        return {
+            "answer": answer,
+            "inference_ms": round((time.perf_counter() - start) * 1000, 1),
+        }
+
+    def metrics(self) -> dict:
+        """Metrics exported on /metrics."""
+        return {
+            "free_sessions": self._sessions.qsize() if self._sessions else len(self.session_ids)
+        }
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Optional[tuple[str, str, dict, bytes]]:
+    """Read one HTTP request, returning None when the peer closed the connection."""
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    method, path, _version = request_line.decode("latin-1").split(maxsplit=2)
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get("content-length", 0))
+    body = await reader.readexactly(length) if length else b""
+    return method, path, headers, body
+
+
+def _write_response(
+    writer: asyncio.StreamWriter, status: HTTPStatus, payload: dict, keep_alive: bool
+) -> None:
+    """Write a JSON response."""
+    body = json.dumps(payload).encode("utf-8")
+    head = (
+        f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    writer.write(head.encode("latin-1") + body)
+
+
+async def _write_stream(
+    writer: asyncio.StreamWriter, lines: AsyncIterator[dict], keep_alive: bool
+) -> None:
+    """Write a streamed NDJSON response using chunked transfer encoding."""
+    head = (
+        "HTTP/1.1 200 OK\r\n"
+        "Content-Type: application/x-ndjson\r\n"
+        "Transfer-Encoding: chunked\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    writer.write(head.encode("latin-1"))
+    async for line in lines:
+        data = (json.dumps(line) + "\n").encode("utf-8")
+        writer.write(f"{len(data):X}\r\n".encode("latin-1") + data + b"\r\n")
+        await writer.drain()
+    writer.write(b"0\r\n\r\n")
+
+
+def _error_payload(error: Exception) -> tuple[HTTPStatus, dict]:
+    """Status and payload for a question that could not be answered."""
+    if isinstance(error, OverloadedError):
+        return HTTPStatus.SERVICE_UNAVAILABLE, {"error": f"overloaded: {error}"}
+    print(f"❌ Error answering question: {error}")
+    return HTTPStatus.BAD_GATEWAY, {"error": str(error)}
+
+
+class BackgroundIngest:
+    """Runs (re-)ingestion in a background thread, at most one run at a time."""
+
+    def __init__(self, ingest: Callable[[], bool]):
+        """
+        Args:
+            ingest: Ingests the documents, returning True on success
+        """
+        self.ingest = ingest
+        self.runs = 0
+        self.last_result: Optional[bool] = None
+        self._task: Optional[asyncio.Future] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> bool:
+        """Start an ingestion run, returning False if one is already running."""
+        if self.running:
+            return False
+        self.runs += 1
+        self._task = asyncio.ensure_future(self._run())
+        return True
+
+    async def _run(self) -> None:
+        try:
+            self.last_result = await asyncio.to_thread(self.ingest)
+        except Exception as e:
+            print(f"❌ Background ingestion failed: {e}")
+            self.last_result = False
+
+    def stats(self) -> dict:
+        return {"running": self.running, "runs": self.runs, "last_result": self.last_result}
+
+
+class QueryDaemon:
+    """Routes HTTP requests to the service and its helpers."""
+
+    def __init__(
+        self,
+        service,
+        admission: Optional[AdmissionController] = None,
+        ingest: Optional[BackgroundIngest] = None,
+        metrics: Optional[dict] = None,
+        coalesce: bool = True,
+    ):
+        """
+        Args:
+            service: A RagService or AgentService answering the questions
+            admission: Admission controller shedding load before it reaches the service
+            ingest: Background ingestion started by POST /v1/ingest
+            metrics: Extra metrics for /metrics, as a mapping of name to a callable returning them
+            coalesce: Whether identical in-flight questions share one computation
+        """
+        self.service = service
+        self.admission = admission
+        self.ingest = ingest
+        self.extra_metrics = metrics or {}
+        self.coalesce = coalesce
+        self.flights = SingleFlight()
+
+    def metrics(self) -> dict:
+        """Everything reported by /metrics."""
+        metrics = self.service.metrics()
+        if self.admission is not None:
+            metrics["admission"] = self.admission.stats()
+        if self.ingest is not None:
+            metrics["ingestion"] = self.ingest.stats()
+        if self.coalesce:
+            metrics["coalescing"] = self.flights.stats()
+        for name, source in self.extra_metrics.items():
+            metrics[name] = source()
+        return metrics
+
+    async def _answer(
+        self,
+        question: str,
+        use_rag: Optional[bool],
+        on_token,
+        metadata_filter: Optional[MetadataFilter] = None,
+    ) -> dict:
+        """Answer a question through admission control (run once per flight)."""
+        if self.admission is None:
+            return await self._answer_admitted(question, use_rag, on_token, metadata_filter)
+        async with self.admission.admit() as ticket:
+            return await self._answer_admitted(
+                question, use_rag, on_token, metadata_filter, degraded=ticket.degraded
+            )
+
+    async def _answer_admitted(
+        self,
+        question: str,
+        use_rag: Optional[bool],
+        on_token,
+        metadata_filter: Optional[MetadataFilter],
+        degraded: bool = False,
+    ) -> dict:
+        """Answer an admitted question, with the options only retrieval + chat completion has."""
+        if not isinstance(self.service, RagService):
+            return await self.service.answer(question, on_token=on_token)
+        return await self.service.answer(
+            question,
+            use_rag=use_rag,
+            degraded=degraded,
+            on_token=on_token,
+            metadata_filter=metadata_filter,
+        )
+
+    async def _stream_lines(self, flight: Flight, coalesced: bool) -> AsyncIterator[dict]:
+        """The NDJSON lines of a streamed answer: the tokens followed by the result."""
+        async for token in flight.stream():
+            yield {"token": token}
+        try:
+            result = await flight.result()
+        except Exception as e:
+            yield _error_payload(e)[1]
+            return
+        yield {"done": True, **result, "coalesced": coalesced}
+
+    def _parse_ask(self, body: bytes) -> tuple:
+        """
+        Read the body of a /v1/ask request.
+
+        Returns:
+            The request, its question, use_rag and metadata filter
+
+        Raises:
+            ValueError: If the body is not a valid request
+        """
+        try:
+            request = json.loads(body or b"{}")
+        except json.JSONDecodeError as e:
+            raise ValueError(f"invalid JSON: {e}") from e
+        question = request.get("question") if isinstance(request, dict) else None
+        if not isinstance(question, str) or not question.strip():
+            raise ValueError("'question' must be a non empty string")
+
+        try:
+            metadata_filter = MetadataFilter.from_json(request.get("filter"))
+            if metadata_filter and not isinstance(self.service, RagService):
+                raise ValueError("not supported in agent mode")
+        except ValueError as e:
+            raise ValueError(f"invalid filter: {e}") from e
+
+        use_rag = request.get("use_rag")
+        if use_rag is not None and not isinstance(use_rag, bool):
+            raise ValueError("'use_rag' must be true, false or null")
+        if use_rag is not None and not isinstance(self.service, RagService):
+            raise ValueError("'use_rag' is not supported in agent mode")
+        return request, question, use_rag, metadata_filter
+
+    async def _handle_ask(self, body: bytes) -> tuple[HTTPStatus, object]:
+        """
+        Answer the question in the body of a /v1/ask request.
+
+        Identical questions (after normalization) with the same parameters that are
+        already in flight are not computed again, the caller shares the running flight.
+        """
+        try:
+            request, question, use_rag, metadata_filter = self._parse_ask(body)
+        except ValueError as e:
+            return HTTPStatus.BAD_REQUEST, {"error": str(e)}
+
+        key = (
+            (normalize_question(question), use_rag, metadata_filter) if self.coalesce else object()
+        )
+        flight, leader = self.flights.join(
+            key, lambda on_token: self._answer(question, use_rag, on_token, metadata_filter)
+        )
+
+        if request.get("stream"):
+            # hold the headers back until there is some output so that errors such as
+            # being shed before anything was generated still get a proper status code
+            await flight.wait_for_output()
+            if flight.tokens or not flight.failed:
+                return HTTPStatus.OK, self._stream_lines(flight, coalesced=not leader)
+
+        try:
+            result = await flight.result()
+        except Exception as e:
+            return _error_payload(e)
+        return HTTPStatus.OK, {**result, "coalesced": not leader}
+
+    def _handle_ingest(self) -> tuple[HTTPStatus, dict]:
+        """Start a background ingestion run."""
+        if self.ingest is None:
+            return HTTPStatus.NOT_FOUND, {"error": "ingestion is not available"}
+        if not self.ingest.start():
+            return HTTPStatus.CONFLICT, {"error": "ingestion is already running"}
+        return HTTPStatus.ACCEPTED, {"status": "started"}
+
+    async def dispatch(self, method: str, path: str, body: bytes) -> tuple[HTTPStatus, object]:
+        """Route a request."""
+        routes = {
+            ("GET", "/health"): lambda: (HTTPStatus.OK, {"status": "ok"}),
+            ("GET", "/metrics"): lambda: (HTTPStatus.OK, self.metrics()),
+            ("POST", "/v1/ingest"): self._handle_ingest,
+        }
+        if (method, path) in routes:
+            return routes[(method, path)]()
+        if path != "/v1/ask":
+            return HTTPStatus.NOT_FOUND, {"error": f"unknown path {path}"}
+        if method != "POST":
+            return HTTPStatus.METHOD_NOT_ALLOWED, {"error": "use POST"}
+        return await self._handle_ask(body)
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Serve requests on a connection until the client closes it."""
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except (ValueError, asyncio.IncompleteReadError):
+                    _write_response(
+                        writer, HTTPStatus.BAD_REQUEST, {"error": "malformed request"}, False
+                    )
+                    break
+                if request is None:
+                    break
+
+                method, path, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                status, payload = await self.dispatch(method, path, body)
+                if isinstance(payload, dict):
+                    _write_response(writer, status, payload, keep_alive)
+                else:
+                    await _write_stream(writer, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+
+async def serve(
+    daemon: QueryDaemon,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    unix_socket: Optional[str] = None,
+) -> None:
+    """
+    Serve questions until cancelled.
+
+    Args:
+        daemon: The daemon handling the requests
+        host: Address to listen on when using TCP
+        port: Port to listen on when using TCP
+        unix_socket: Path of a Unix socket to listen on instead of TCP
+    """
+    if unix_socket:
+        Path(unix_socket).unlink(missing_ok=True)
+        server = await asyncio.start_unix_server(daemon.handle_connection, path=unix_socket)
+        print(f"🛰️  Serving questions on unix socket {unix_socket}")
+    else:
+        server = await asyncio.start_server(daemon.handle_connection, host, port)
+        print(f"🛰️  Serving questions on http://{host}:{port}/v1/ask")
+
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Client-side priority scheduling of requests sent to the Llama Stack server.
+
+Interactive query traffic and background ingestion traffic share a fixed
+number of server slots. Interactive requests can use every slot and are
+always woken first. Bulk requests only use spare capacity: while no
+questions have been seen for a short grace period they may use all but a
+reserved slot, and as soon as query traffic arrives they are held to their
+weighted share. Requests already in flight are never interrupted, bulk
+traffic yields by not starting new requests.
+"""
+
+import contextlib
+import threading
+import time
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+
+class PriorityScheduler:
+    """Weighted concurrency limits for interactive and bulk traffic."""
+
+    def __init__(
+        self,
+        total_slots: int = 8,
+        interactive_weight: int = 3,
+        bulk_weight: int = 1,
+        reserved_interactive_slots: int = 1,
+        idle_grace: float = 2.0,
+    ):
+        """
+        Args:
+            total_slots: Number of requests allowed in flight against the server
+            interactive_weight: Share of the slots interactive traffic gets under contention
+            bulk_weight: Share of the slots bulk traffic gets under contention
+            reserved_interactive_slots: Slots bulk traffic never uses, so a new question never waits
+            idle_grace: Seconds without interactive traffic before bulk may use the spare slots
+        """
+        self.total_slots = total_slots
+        self.busy_bulk_slots = max(
+            1, total_slots * bulk_weight // (interactive_weight + bulk_weight)
+        )
+        self.idle_bulk_slots = max(1, total_slots - reserved_interactive_slots)
+        self.idle_grace = idle_grace
+
+        self._condition = threading.Condition()
+        self._active = {INTERACTIVE: 0, BULK: 0}
+        self._waiting_interactive = 0
+        self._last_interactive = float("-inf")
+
+        self._acquired = {INTERACTIVE: 0, BULK: 0}
+        self._wait_seconds = {INTERACTIVE: 0.0, BULK: 0.0}
+
+    def _bulk_limit(self) -> int:
+        """Slots bulk traffic may use right now."""
+        interactive_busy = (
+            self._waiting_interactive
+            or self._active[INTERACTIVE]
+            or time.monotonic() - self._last_interactive < self.idle_grace
+        )
+        return self.busy_bulk_slots if interactive_busy else self.idle_bulk_slots
+
+    def _can_start(self, priority: str) -> bool:
+        """Whether a request of the given priority may start now."""
+        if sum(self._active.values()) >= self.total_slots:
+            return False
+        if priority == INTERACTIVE:
+            return True
+        return not self._waiting_interactive and self._active[BULK] < self._bulk_limit()
+
+    @contextlib.contextmanager
+    def slot(self, priority: str = INTERACTIVE):
+        """Hold a server slot of the given priority for the duration of the block."""
+        start = time.monotonic()
+        with self._condition:
+            if priority == INTERACTIVE:
+                self._waiting_interactive += 1
+                self._last_interactive = start
+            try:
+                while not self._can_start(priority):
+                    # bulk limits depend on time, so re-check even without a notify
+                    self._condition.wait(timeout=self.idle_grace)
+            finally:
+                if priority == INTERACTIVE:
+                    self._waiting_interactive -= 1
+            self._active[priority] += 1
+            self._acquired[priority] += 1
+            self._wait_seconds[priority] += time.monotonic() - start
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._active[priority] -= 1
+                if priority == INTERACTIVE:
+                    self._last_interactive = time.monotonic()
+                self._condition.notify_all()
+
+    def stats(self) -> dict:
+        """In-flight requests and time spent waiting per priority class."""
+        with self._condition:
+            return {
+                priority: {
+                    "in_flight": self._active[priority],
+                    "requests": self._acquired[priority],
+                    "mean_wait_ms": (
+                        round(self._wait_seconds[priority] / self._acquired[priority] * 1000, 2)
+                        if self._acquired[priority]
+                        else 0
+                    ),
+                }
+                for priority in (INTERACTIVE, BULK)
+            }
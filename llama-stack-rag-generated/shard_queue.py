@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+File-based work queue handing out shards of the corpus to ingestion workers.
+
+The queue is a directory, normally on a filesystem shared by every host that
+runs workers. Each shard is a small JSON file whose name records its state:
+
+    shard-0003.pending            waiting for a worker
+    shard-0003.claimed.<worker>   being ingested, rewritten with its progress
+    shard-0003.done               finished
+
+A shard is claimed with an atomic rename, so no lock server or database is
+needed (SQLite locking is not reliable over NFS, renames are). A worker keeps
+its claim alive by rewriting its progress, and touches a heartbeat file of its
+own (`.worker-<worker>.heartbeat`) while it holds a shard. A claim that has not
+been touched for the lease time, and whose worker's heartbeat has stopped, is
+put back to pending for another worker to pick up.
+
+Progress is written with the claim moved aside to a hidden name
+(`.shard-0003.claimed.<worker>.held`), taken with a single rename that fails
+if the claim has been put back meanwhile. That way, a worker that lost its
+claim can never re-create it next to the pending shard.
+"""
+
+import contextlib
+import heapq
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+
+def plan_shards(files: list, shard_count: int) -> list:
+    """
+    Split files into shards of roughly equal size in bytes.
+
+    Args:
+        files: Paths of the files to split up
+        shard_count: Number of shards wanted
+
+    Returns:
+        List of shards, each a dict with the files in it and their total size
+    """
+    sized = sorted(((Path(f).stat().st_size, str(f)) for f in files), reverse=True)
+    shards = [{"files": [], "bytes": 0} for _ in range(max(1, min(shard_count, len(sized))))]
+    # largest file first onto the smallest shard so far
+    smallest = [(0, i) for i in range(len(shards))]
+    for size, path in sized:
+        total, i = heapq.heappop(smallest)
+        shards[i]["files"].append(path)
+        shards[i]["bytes"] += size
+        heapq.heappush(smallest, (total + size, i))
+    return shards
+
+
+class Shard:
+    """A shard claimed by this worker, along with its progress."""
+
+    def __init__(self, shard_id: str, path: Path, data: dict):
+        self.shard_id = shard_id
+        self.path = path
+        self.files = data["files"]
+        self.bytes = data["bytes"]
+        self.done_files = 0
+        self.failed: list = []
+        self.done_bytes = 0
+        self._lock = threading.Lock()
+
+    def advance(self, path, ok: bool) -> None:
+        """Count a file of the shard as finished."""
+        size = Path(path).stat().st_size if Path(path).exists() else 0
+        with self._lock:
+            self.done_files += 1
+            if not ok:
+                self.failed.append(str(path))
+            self.done_bytes += size
+
+    def progress(self) -> dict:
+        """The shard's files along with how far through them the worker is."""
+        with self._lock:
+            return {
+                "files": self.files,
+                "bytes": self.bytes,
+                "done_files": self.done_files,
+                "failed_files": len(self.failed),
+                "failed": list(self.failed),
+                "done_bytes": self.done_bytes,
+            }
+
+
+class ShardQueue:
+    """Directory of shard files that workers claim, report progress on and complete."""
+
+    def __init__(self, directory: str, lease: float = 120.0):
+        """
+        Args:
+            directory: Directory holding the queue, shared by every worker
+            lease: Seconds a claim lasts without a progress report before it is handed out again
+        """
+        self.directory = Path(directory)
+        self.lease = lease
+
+    def _heartbeat_path(self, worker: str) -> Path:
+        return self.directory / f".worker-{worker}.heartbeat"
+
+    def beat(self, worker: str) -> None:
+        """Show that worker is alive."""
+        self._heartbeat_path(worker).touch()
+
+    def _alive(self, worker: str) -> bool:
+        """Whether worker has shown it is alive within the lease."""
+        try:
+            return time.time() - self._heartbeat_path(worker).stat().st_mtime < self.lease
+        except FileNotFoundError:
+            return False
+
+    def _write(self, path: Path, data: dict, tag: str) -> None:
+        """Write a shard file atomically, tag keeps concurrent writers' temp files apart."""
+        tmp_path = path.with_name(f".{path.name}.{tag}.tmp")
+        tmp_path.write_text(json.dumps(data), encoding="utf-8")
+        tmp_path.replace(path)
+
+    def create(self, shards: list) -> None:
+        """Replace whatever is in the queue with a new set of pending shards."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for pattern in ("shard-*", ".shard-*", ".worker-*"):
+            for path in self.directory.glob(pattern):
+                path.unlink(missing_ok=True)
+        for i, shard in enumerate(shards):
+            self._write(self.directory / f"shard-{i:04d}.pending", shard, "create")
+
+    def claim(self, worker: str) -> Optional[Shard]:
+        """
+        Claim a pending shard.
+
+        Args:
+            worker: Name of the worker claiming it, unique across hosts and without dots
+
+        Returns:
+            The claimed shard, or None if no shard is pending
+        """
+        if "." in worker:
+            raise ValueError(f"worker name can not contain '.': {worker}")
+        self.reclaim_stale()
+        for path in sorted(self.directory.glob("shard-*.pending")):
+            shard_id = path.name.split(".")[0]
+            claimed = self.directory / f"{shard_id}.claimed.{worker}"
+            try:
+                path.rename(claimed)
+                # the rename keeps the pending shard's time, which may be older than the lease
+                os.utime(claimed)
+                self.beat(worker)
+                data = json.loads(claimed.read_text(encoding="utf-8"))
+            except FileNotFoundError:
+                continue  # another worker got there first
+            return Shard(shard_id, claimed, data)
+        return None
+
+    def _held_path(self, path: Path) -> Path:
+        return path.with_name(f".{path.name}.held")
+
+    def _update(self, shard: Shard, destination: Path) -> bool:
+        """Write the progress of a claimed shard and move it to destination, False if lost."""
+        held = self._held_path(shard.path)
+        try:
+            shard.path.rename(held)  # fails if the claim was put back or completed
+            os.utime(held)
+        except FileNotFoundError:
+            return False
+        self._write(held, shard.progress(), shard.path.name.split(".")[-1])
+        held.rename(destination)
+        return True
+
+    def report(self, shard: Shard) -> bool:
+        """Record the progress of a shard, renewing the claim. False if the claim was lost."""
+        return self._update(shard, shard.path)
+
+    @contextlib.contextmanager
+    def hold(self, shard: Shard):
+        """Keep reporting progress on shard, and so keep the claim, until the block exits."""
+        stop = threading.Event()
+        worker = shard.path.name.split(".", 2)[2]
+
+        def heartbeat():
+            while not stop.wait(self.lease / 4):
+                self.beat(worker)
+                if not self.report(shard):
+                    print(f"⚠️  Lost the claim on {shard.shard_id}, it took longer than the lease")
+                    return
+
+        thread = threading.Thread(target=heartbeat, name=f"{shard.shard_id}-lease", daemon=True)
+        thread.start()
+        try:
+            yield shard
+        finally:
+            stop.set()
+            thread.join()
+
+    def complete(self, shard: Shard) -> bool:
+        """Mark a claimed shard as done. False if the claim was lost."""
+        return self._update(shard, self.directory / f"{shard.shard_id}.done")
+
+    def reclaim_stale(self) -> int:
+        """
+        Put claims whose lease ran out back to pending, returning how many there were.
+
+        A claim is left alone while its worker's heartbeat goes on, as the worker is only
+        slow to report then.
+        """
+        reclaimed = 0
+        # a held claim whose lease ran out belongs to a worker that died while reporting
+        for path in [
+            *self.directory.glob("shard-*.claimed.*"),
+            *self.directory.glob(".shard-*.claimed.*.held"),
+        ]:
+            worker = path.name.lstrip(".").split(".")[2]
+            try:
+                if time.time() - path.stat().st_mtime < self.lease or self._alive(worker):
+                    continue
+                path.rename(self.directory / f"{path.name.lstrip('.').split('.')[0]}.pending")
+                reclaimed += 1
+            except FileNotFoundError:
+                continue  # completed, or reclaimed by someone else, meanwhile
+        return reclaimed
+
+    def finished(self) -> bool:
+        """Whether no shard is pending or claimed (also true if there is no queue)."""
+        return not any(
+            any(self.directory.glob(pattern))
+            for pattern in ("shard-*.pending", "shard-*.claimed.*", ".shard-*.held")
+        )
+
+    def status(self) -> dict:
+        """Shard counts by state, bytes ingested and the progress of each worker."""
+        status = {"pending": 0, "claimed": 0, "done": 0, "bytes": 0, "done_bytes": 0}
+        status["failed_files"] = 0
+        status["failed"] = []
+        workers: dict = {}
+        for path in self.directory.glob("shard-*"):
+            state = path.name.split(".")[1]
+            try:
+                data = json.loads(path.read_text(encoding="utf-8"))
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue  # changed state while being read
+            status[state] += 1
+            status["bytes"] += data["bytes"]
+            if state == "done":
+                status["done_bytes"] += data["bytes"]
+                status["failed_files"] += data.get("failed_files", 0)
+                status["failed"].extend(data.get("failed", []))
+            elif state == "claimed":
+                status["done_bytes"] += data.get("done_bytes", 0)
+                worker = path.name.split(".", 2)[2]
+                workers[worker] = f"{data.get('done_files', 0)}/{len(data['files'])} files"
+        status["workers"] = workers
+        return status
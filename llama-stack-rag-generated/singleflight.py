@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Singleflight coalescing of identical in-flight questions.
+
+The first caller asking a question starts the computation, callers asking
+the same question while it is still in flight wait on that computation and
+share its result. Tokens streamed by the computation are recorded so that
+callers joining late still see the stream from the start.
+"""
+
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+
+def normalize_question(question: str) -> str:
+    """Case and whitespace insensitive form of a question used to key flights."""
+    return " ".join(question.lower().split())
+
+
+class Flight:
+    """One in-flight computation and the tokens it has streamed so far."""
+
+    def __init__(self):
+        self.tokens: list = []
+        self.followers = 0
+        self.done = False
+        self._result = None
+        self._error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+
+    def _wake(self) -> None:
+        """Wake everyone waiting for a change."""
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def emit(self, token: str) -> None:
+        """Record a streamed token (must be called on the event loop)."""
+        self.tokens.append(token)
+        self._wake()
+
+    def finish(self, result, error: Optional[BaseException] = None) -> None:
+        """Record the outcome of the computation."""
+        self.done = True
+        self._result = result
+        self._error = error
+        self._wake()
+
+    @property
+    def failed(self) -> bool:
+        """Whether the computation finished with an error."""
+        return self.done and self._error is not None
+
+    async def wait_for_output(self) -> None:
+        """Wait until the first token has been streamed or the flight has finished."""
+        while not (self.tokens or self.done):
+            await self._changed.wait()
+
+    async def stream(self) -> AsyncIterator[str]:
+        """Yield every token from the start of the flight until it finishes."""
+        sent = 0
+        while True:
+            while sent < len(self.tokens):
+                yield self.tokens[sent]
+                sent += 1
+            if self.done:
+                return
+            await self._changed.wait()
+
+    async def result(self):
+        """Wait for the flight to finish, returning its result or raising its error."""
+        while not self.done:
+            await self._changed.wait()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class SingleFlight:
+    """Map of in-flight computations keyed by normalized question and parameters."""
+
+    def __init__(self):
+        self._flights: dict = {}
+        self._tasks: set = set()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def join(
+        self, key, compute: Callable[[Callable[[str], None]], Awaitable]
+    ) -> tuple[Flight, bool]:
+        """
+        Join the flight for key, starting it if nothing is in flight.
+
+        Args:
+            key: Hashable key, normally the normalized question plus parameters
+            compute: Async callable run by the leader, passed a function to stream tokens
+
+        Returns:
+            Tuple of (flight, leader) where leader is True if this call started the flight
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            flight.followers += 1
+            self.coalesced += 1
+            return flight, False
+
+        flight = Flight()
+        self._flights[key] = flight
+        self.leaders += 1
+        # run detached from the caller so followers are not hurt if the leader disconnects
+        task = asyncio.ensure_future(self._run(key, flight, compute))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return flight, True
+
+    async def _run(self, key, flight: Flight, compute) -> None:
+        result, error = None, None
+        try:
+            result = await compute(flight.emit)
+        except Exception as e:
+            error = e
+        finally:
+            del self._flights[key]
+        flight.finish(result, error)
+
+    def stats(self) -> dict:
+        """Number of computations started and of callers that shared one."""
+        total = self.leaders + self.coalesced
+        return {
+            "in_flight": len(self._flights),
+            "computations": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesced_ratio": round(self.coalesced / total, 3) if total else 0,
+        }
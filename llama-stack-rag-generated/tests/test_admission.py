@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, OverloadedError
+
+
+def test_sheds_when_the_queue_is_full():
+    async def scenario():
+        admission = AdmissionController(max_concurrency=1, max_queue=0)
+        async with admission.admit():
+            with pytest.raises(OverloadedError):
+                async with admission.admit():
+                    pass
+        return admission.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["admitted"] == 1
+    assert stats["shed_queue_full"] == 1
+    assert stats["in_flight"] == 0
+
+
+def test_sheds_questions_that_wait_past_the_deadline():
+    async def scenario():
+        admission = AdmissionController(max_concurrency=1, max_queue=4, queue_timeout=0.05)
+        async with admission.admit():
+            with pytest.raises(OverloadedError):
+                async with admission.admit():
+                    pass
+        return admission.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["shed_deadline"] == 1
+    assert stats["queue_depth"] == 0
+
+
+def test_hands_the_slot_to_the_next_waiter_and_marks_deep_queues_degraded():
+    async def scenario():
+        admission = AdmissionController(max_concurrency=1, max_queue=4, degrade_queue_depth=1)
+        order = []
+
+        async def ask(name):
+            async with admission.admit() as ticket:
+                order.append((name, ticket.degraded))
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(ask("first"), ask("second"), ask("third"))
+        return order, admission.stats()
+
+    order, stats = asyncio.run(scenario())
+    assert order == [("first", False), ("second", False), ("third", True)]
+    assert stats["admitted"] == 3
+    assert stats["degraded"] == 1
+    assert stats["in_flight"] == 0
@@ -0,0 +1,35 @@
+from context_compression import ContextCompressor, estimate_tokens, split_sentences
+
+
+def test_split_sentences_keeps_list_items_and_code_blocks_whole():
+    text = "First one. Second one.\n\n- item one\n- item two\n\n```\ncode\n\nmore\n```\n"
+    assert split_sentences(text) == [
+        "First one.",
+        "Second one.",
+        "- item one",
+        "- item two",
+        "```\ncode\n\nmore\n```",
+    ]
+
+
+def test_keeps_the_matching_sentences_within_budget_in_order():
+    documents = [
+        "Pino is a fast logger. The weather is nice. Use pino for logging in Node.js.",
+        "Nothing relevant here at all.",
+    ]
+    compressor = ContextCompressor(budget_tokens=14)
+    compression = compressor.compress("which logger, pino?", documents)
+    assert compression.compressed
+    assert compression.kept == [0]
+    assert "weather" not in compression.documents[0]
+    assert compression.documents[0].index("fast logger") < compression.documents[0].index("Use")
+    assert compression.tokens_after <= 14
+    assert compression.tokens_before == sum(estimate_tokens(d) for d in documents)
+
+
+def test_held_out_questions_are_left_as_they_were():
+    compressor = ContextCompressor(budget_tokens=1, holdout=1.0)
+    compression = compressor.compress("q", ["a. b. c."])
+    assert not compression.compressed
+    assert compression.documents == ["a. b. c."]
+    assert compressor.stats()["held_out"] == 1
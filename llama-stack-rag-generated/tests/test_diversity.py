@@ -0,0 +1,21 @@
+import numpy as np
+
+from diversity import mmr_select
+
+
+def test_relevance_only_ranks_by_similarity_to_the_query():
+    query = np.array([1.0, 0.0])
+    candidates = np.array([[0.5, 0.5], [1.0, 0.0], [0.0, 1.0]])
+    assert mmr_select(query, candidates, 3, lambda_=1.0) == [1, 0, 2]
+
+
+def test_near_duplicates_give_way_to_diverse_candidates():
+    query = np.array([1.0, 1.0, 0.0])
+    candidates = np.array([[1.0, 0.9, 0.0], [1.0, 0.91, 0.0], [0.9, 1.0, 0.6]])
+    assert mmr_select(query, candidates, 2, lambda_=0.5) == [1, 2]
+    assert mmr_select(query, candidates, 3, max_similarity=0.99) == [1, 2]
+
+
+def test_nothing_to_pick():
+    assert mmr_select(np.ones(2), np.zeros((0, 2)), 3) == []
+    assert mmr_select(np.ones(2), np.ones((2, 2)), 0) == []
@@ -0,0 +1,47 @@
+from doc_manifest import DocumentManifest, content_hash, split_sections
+
+
+def test_split_sections_slugs_headings_and_ignores_headings_in_code():
+    content = "intro text\n# Setup\nstep\n```\n# not a heading\n```\n# Setup\nagain\n"
+    sections = split_sections(content)
+    assert [section_id for section_id, _, _ in sections] == ["intro", "setup", "setup-2"]
+    assert "# not a heading" in sections[1][2]
+
+
+def test_only_changed_sections_are_inserted_again_under_a_new_version(tmp_path):
+    manifest = DocumentManifest(str(tmp_path / "manifest.json"))
+    hashes = {"intro": content_hash("a"), "setup": content_hash("b")}
+    assert manifest.changed_sections("doc", hashes) == {"intro": 1, "setup": 1}
+    manifest.record_upsert("doc", "v1", "doc.md", hashes, {"intro": 1, "setup": 1})
+
+    changed = {**hashes, "setup": content_hash("b2")}
+    assert manifest.changed_sections("doc", changed) == {"setup": 2}
+    assert manifest.is_current({"section_id": "doc#setup", "section_version": 1})
+    manifest.record_upsert("doc", "v2", "doc.md", changed, {"setup": 2})
+    assert not manifest.is_current({"section_id": "doc#setup", "section_version": 1})
+    assert manifest.is_current({"section_id": "doc#setup", "section_version": 2})
+
+
+def test_journal_survives_a_run_that_did_not_save(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    manifest = DocumentManifest(path)
+    manifest.record_upsert("doc", "v1", "doc.md", {"intro": "h"}, {"intro": 1})
+    manifest.record_delete("gone")  # not in the manifest, nothing to journal
+
+    recovered = DocumentManifest(path)
+    assert recovered.is_unchanged("doc", "v1")
+    assert recovered.recovered == {"doc"}
+
+    recovered.save()
+    assert DocumentManifest(path).recovered == set()
+    assert DocumentManifest(path).is_unchanged("doc", "v1")
+
+
+def test_reserved_versions_are_skipped_after_an_insert_cut_short(tmp_path):
+    manifest = DocumentManifest(str(tmp_path / "manifest.json"))
+    manifest.record_upsert("doc", "v1", "doc.md", {"intro": "h1"}, {"intro": 1})
+    manifest.record_pending("doc", {"intro": 2})  # died before the upsert was recorded
+
+    reloaded = DocumentManifest(str(tmp_path / "manifest.json"))
+    assert not reloaded.is_unchanged("doc", "v1")
+    assert reloaded.changed_sections("doc", {"intro": "h2"}) == {"intro": 3}
@@ -0,0 +1,46 @@
+import time
+
+from ingest_control import AIMDLimiter, InsertPathBreaker
+
+
+def test_limit_grows_while_requests_are_fast():
+    limiter = AIMDLimiter(initial=2, maximum=8)
+    for _ in range(20):
+        limiter.record(time.monotonic() - 0.1, ok=True)  # all about as fast
+    assert 2 < limiter.limit <= 8
+    assert limiter.stats()["increases"] == 20
+
+
+def test_limit_halves_once_per_round_trip_on_failures():
+    limiter = AIMDLimiter(initial=8, minimum=1)
+    started = time.monotonic()
+    limiter.record(started, ok=False)
+    limiter.record(started, ok=False)  # sent before the first decrease, already counted
+    assert limiter.limit == 4
+    limiter.record(time.monotonic(), ok=False)
+    assert limiter.limit == 2
+    assert limiter.decreases == 2
+
+
+def test_slot_blocks_beyond_the_limit():
+    limiter = AIMDLimiter(initial=1)
+    with limiter.slot():
+        assert limiter.in_flight == 1
+    assert limiter.in_flight == 0
+
+
+def test_breaker_switches_after_repeated_failures_and_tries_the_preferred_path_again():
+    breaker = InsertPathBreaker(failure_threshold=2, retry_after=0.05)
+    breaker.configure(lambda: ["rag_tool", "vector_io"])
+    breaker.configure(lambda: ["never", "probed"])  # the probe only runs once
+    breaker.record("rag_tool", ok=False)
+    assert breaker.current() == "rag_tool"
+    breaker.record("rag_tool", ok=False)
+    assert breaker.current() == "vector_io"
+
+    time.sleep(0.06)
+    assert breaker.current() == "rag_tool"  # the trial
+    assert breaker.current() == "vector_io"  # only one trial at a time
+    breaker.record("rag_tool", ok=True)
+    assert breaker.current() == "rag_tool"
+    assert breaker.switches == 2
@@ -0,0 +1,32 @@
+from latency_budget import ContextBudgetController, trim_documents
+
+
+def test_trim_documents_keeps_at_least_the_first():
+    assert trim_documents(["x" * 400, "y" * 400], 50) == ["x" * 400]
+    assert trim_documents(["x" * 40, "y" * 40], 50) == ["x" * 40, "y" * 40]
+
+
+def test_budget_shrinks_when_the_slo_is_missed_and_grows_back_slowly():
+    controller = ContextBudgetController(1.0, top_k=4, context_tokens=800, adjust_every=5)
+    for _ in range(5):
+        controller.record(1000, 2.0)
+    shrunk = controller.budget()
+    assert shrunk.context_tokens <= 400
+    assert shrunk.top_k < 4
+
+    for _ in range(5):
+        controller.record(300, 0.1)
+    grown = controller.budget()
+    assert shrunk.context_tokens < grown.context_tokens <= shrunk.context_tokens + 200
+    assert controller.stats()["shrinks"] == 1
+    assert controller.stats()["expansions"] == 1
+
+
+def test_budget_stays_within_its_bounds():
+    controller = ContextBudgetController(
+        1.0, context_tokens=200, min_context_tokens=128, adjust_every=1
+    )
+    for _ in range(10):
+        controller.record(1000, 5.0)
+    assert controller.budget().context_tokens == 128
+    assert controller.budget().top_k >= 1
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from local_index import HashingEmbedder, LocalVectorIndex
+from metadata_filter import MetadataFilter
+
+TOPICS = ["npm", "docker", "logging", "testing", "typescript", "security", "ci", "graphql"]
+
+
+def build_index(count=400):
+    index = LocalVectorIndex(HashingEmbedder(64))
+    index.add(
+        [
+            {
+                "content": f"{TOPICS[i % len(TOPICS)]} guide part {i} about {TOPICS[i % 3]}",
+                "metadata": {"doc_id": f"doc{i % 10}", "i": i},
+            }
+            for i in range(count)
+        ]
+    )
+    return index
+
+
+def test_search_finds_the_matching_chunk_and_respects_filters():
+    index = build_index()
+    hits = index.search("docker guide part 9 about ci", 3)
+    assert hits[0].metadata["i"] == 9
+    filtered = index.search("docker guide", 5, metadata_filter=MetadataFilter({"doc_id": "doc3"}))
+    assert filtered
+    assert {hit.metadata["doc_id"] for hit in filtered} == {"doc3"}
+
+
+def test_save_and_load_give_the_same_results(tmp_path):
+    index = build_index()
+    index.build_ivf()
+    before = index.search("logging guide part 42", 5)
+    index.save(str(tmp_path / "index.npz"))
+    loaded = LocalVectorIndex.load(str(tmp_path / "index.npz"), HashingEmbedder(64))
+    assert len(loaded) == len(index)
+    assert loaded.search("logging guide part 42", 5) == before
+    assert (tmp_path / "index.texts").exists()
+
+
+def test_load_refuses_an_index_of_another_embedder(tmp_path):
+    build_index().save(str(tmp_path / "index.npz"))
+    with pytest.raises(ValueError):
+        LocalVectorIndex.load(str(tmp_path / "index.npz"), HashingEmbedder(32))
+
+
+@pytest.mark.parametrize("kind", ["int8", "pq"])
+def test_quantized_index_keeps_recall_and_survives_a_round_trip(tmp_path, kind):
+    vectors = np.random.default_rng(0).standard_normal((1000, 64))
+    index = LocalVectorIndex(HashingEmbedder(64))
+    index.add([{"content": f"chunk {i}", "metadata": {"i": i}} for i in range(1000)], vectors)
+    report = index.quantize(kind, subvectors=16)
+    assert report["quantized_mb"] < report["float32_mb"]
+    assert report["recall_at_10_rescored"] >= 0.95
+    index.save(str(tmp_path / "index.npz"))
+    assert isinstance(index.vectors, np.memmap)
+    loaded = LocalVectorIndex.load(str(tmp_path / "index.npz"), HashingEmbedder(64))
+    assert loaded.quantization == kind
+    assert loaded.search_vector(vectors[16], 1)[0].metadata["i"] == 16
+    assert loaded.search_vector(vectors[16], 1)[0].content == "chunk 16"
+
+
+def test_embeddings_for_reuses_unchanged_chunks():
+    index = build_index(count=4)
+    chunks = [
+        {"content": index.texts[0], "metadata": {"i": 0}},
+        {"content": "changed text", "metadata": {"i": 1}},
+        {"content": "new text", "metadata": {"i": 99}},
+    ]
+    embeddings, embedded = index.embeddings_for(chunks, "i")
+    assert embedded == 2
+    assert np.allclose(embeddings[0], index.vectors[0])
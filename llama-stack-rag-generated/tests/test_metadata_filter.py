@@ -0,0 +1,44 @@
+import pytest
+
+from metadata_filter import MetadataFilter
+
+
+def test_matches_equality_set_and_prefix_predicates():
+    metadata_filter = MetadataFilter.from_json(
+        {"type": "markdown", "doc_id": ["a", "b"], "source": {"prefix": "docs/"}}
+    )
+    assert metadata_filter.matches({"type": "markdown", "doc_id": "a", "source": "docs/a.md"})
+    assert not metadata_filter.matches({"type": "markdown", "doc_id": "c", "source": "docs/c.md"})
+    assert not metadata_filter.matches({"type": "markdown", "doc_id": "a", "source": "x/a.md"})
+    assert not metadata_filter.matches({"doc_id": "a", "source": "docs/a.md"})
+
+
+def test_from_expressions_and_malformed_filters():
+    assert MetadataFilter.from_expressions(["type=markdown", "source^=docs/"]) == MetadataFilter(
+        {"type": "markdown"}, {"source": "docs/"}
+    )
+    assert MetadataFilter.from_expressions([]) is None
+    with pytest.raises(ValueError):
+        MetadataFilter.from_expressions(["no-operator"])
+    with pytest.raises(ValueError):
+        MetadataFilter.from_json({"type": {"unknown": 1}})
+
+
+def test_server_filters_leave_prefixes_out_and_renamed_moves_predicates():
+    metadata_filter = MetadataFilter(
+        {"type": "markdown"}, {"source": "docs/"}, {"document_id": ["a", "b"]}
+    )
+    assert metadata_filter.renamed("document_id", "doc_id").server_filters() == {
+        "type": "and",
+        "filters": [
+            {"type": "eq", "key": "type", "value": "markdown"},
+            {
+                "type": "or",
+                "filters": [
+                    {"type": "eq", "key": "doc_id", "value": "a"},
+                    {"type": "eq", "key": "doc_id", "value": "b"},
+                ],
+            },
+        ],
+    }
+    assert MetadataFilter(prefixes={"source": "docs/"}).server_filters() is None
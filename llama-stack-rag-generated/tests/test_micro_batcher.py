@@ -0,0 +1,54 @@
+import asyncio
+import time
+
+from micro_batcher import MicroBatcher
+
+
+def test_collects_concurrent_requests_into_one_batch_call():
+    batches = []
+
+    def dispatch_batch(items):
+        batches.append(list(items))
+        return [item * 2 for item in items]
+
+    async def scenario():
+        batcher = MicroBatcher(dispatch_one=None, dispatch_batch=dispatch_batch, max_wait_ms=20)
+        results = await asyncio.gather(*(batcher.submit(n) for n in (1, 2, 1, 3)))
+        return results, batcher.stats()
+
+    results, stats = asyncio.run(scenario())
+    assert results == [2, 4, 2, 6]
+    assert batches == [[1, 2, 3]]  # the repeated request is dispatched once
+    assert stats["batches"] == 1
+    assert stats["requests"] == 4
+
+
+def test_pipelines_requests_without_a_batch_call_and_passes_errors_on():
+    def dispatch_one(item):
+        time.sleep(0.05)
+        if item == "bad":
+            raise ValueError(item)
+        return item.upper()
+
+    async def scenario():
+        batcher = MicroBatcher(dispatch_one=dispatch_one, max_wait_ms=5)
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *(batcher.submit(item) for item in ("a", "b", "bad")), return_exceptions=True
+        )
+        return results, time.perf_counter() - start
+
+    results, seconds = asyncio.run(scenario())
+    assert results[:2] == ["A", "B"]
+    assert isinstance(results[2], ValueError)
+    assert seconds < 0.15  # dispatched concurrently, not one after the other
+
+
+def test_flushes_at_max_batch_without_waiting():
+    async def scenario():
+        batcher = MicroBatcher(
+            dispatch_one=None, dispatch_batch=lambda items: items, max_wait_ms=10000, max_batch=2
+        )
+        return await asyncio.wait_for(asyncio.gather(batcher.submit(1), batcher.submit(2)), 1)
+
+    assert asyncio.run(scenario()) == [1, 2]
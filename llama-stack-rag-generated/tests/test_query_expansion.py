@@ -0,0 +1,20 @@
+from query_expansion import reciprocal_rank_fusion
+
+
+def test_results_found_by_several_lists_rank_first():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "d"], ["b", "c"]], key=str)
+    assert fused[0] == "b"
+    assert fused.index("c") < fused.index("d")
+    assert sorted(fused) == ["a", "b", "c", "d"]
+
+
+def test_limit_and_ties_keep_first_seen_order():
+    assert reciprocal_rank_fusion([["x"], ["y"]], key=str) == ["x", "y"]
+    assert reciprocal_rank_fusion([["a", "b", "c"]], key=str, limit=2) == ["a", "b"]
+
+
+def test_key_identifies_the_same_result_across_lists():
+    first = {"id": 1, "text": "from the question"}
+    again = {"id": 1, "text": "from a variant"}
+    fused = reciprocal_rank_fusion([[first], [again]], key=lambda result: result["id"])
+    assert fused == [first]
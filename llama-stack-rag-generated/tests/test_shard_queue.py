@@ -0,0 +1,55 @@
+import os
+import time
+
+from shard_queue import ShardQueue, plan_shards
+
+
+def test_plan_shards_balances_bytes(tmp_path):
+    files = []
+    for name, size in {"a": 900, "b": 500, "c": 400, "d": 100}.items():
+        path = tmp_path / f"{name}.md"
+        path.write_text("x" * size)
+        files.append(path)
+    shards = plan_shards(files, 2)
+    assert sorted(shard["bytes"] for shard in shards) == [900, 1000]
+
+
+def test_every_shard_is_claimed_once_and_completed(tmp_path):
+    queue = ShardQueue(str(tmp_path / "queue"))
+    queue.create([{"files": ["a.md"], "bytes": 1}, {"files": ["b.md"], "bytes": 1}])
+    first = queue.claim("w1")
+    second = queue.claim("w2")
+    assert {first.shard_id, second.shard_id} == {"shard-0000", "shard-0001"}
+    assert queue.claim("w3") is None
+
+    first.advance("a.md", ok=False)
+    assert queue.report(first)
+    assert queue.status()["workers"] == {"w1": "1/1 files", "w2": "0/1 files"}
+    assert queue.complete(first)
+    assert queue.complete(second)
+    assert queue.finished()
+    assert queue.status()["failed"] == ["a.md"]
+
+
+def test_a_claim_from_an_old_queue_is_not_stale(tmp_path):
+    queue = ShardQueue(str(tmp_path / "queue"), lease=10)
+    queue.create([{"files": [], "bytes": 0}])
+    old = time.time() - 100
+    for path in (tmp_path / "queue").iterdir():
+        os.utime(path, (old, old))
+    queue.claim("w1")
+    assert queue.reclaim_stale() == 0
+
+
+def test_claims_of_dead_workers_go_back_to_pending(tmp_path):
+    queue = ShardQueue(str(tmp_path / "queue"), lease=10)
+    queue.create([{"files": [], "bytes": 0}])
+    shard = queue.claim("w1")
+    old = time.time() - 100
+    os.utime(shard.path, (old, old))
+    assert queue.reclaim_stale() == 0  # the worker's heartbeat goes on
+
+    os.utime(tmp_path / "queue" / ".worker-w1.heartbeat", (old, old))
+    assert queue.reclaim_stale() == 1
+    assert not queue.report(shard)  # the claim is lost
+    assert queue.claim("w2").shard_id == shard.shard_id
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight, normalize_question
+
+
+def test_normalize_question_ignores_case_and_whitespace():
+    assert normalize_question("  How do I   LOG? ") == normalize_question("how do i log?")
+
+
+def test_concurrent_callers_share_one_computation_and_its_stream():
+    async def scenario():
+        flights = SingleFlight()
+        calls = 0
+
+        async def compute(emit):
+            nonlocal calls
+            calls += 1
+            for token in ("a", "b"):
+                emit(token)
+                await asyncio.sleep(0.01)
+            return "ab"
+
+        leader, led = flights.join("q", compute)
+        await asyncio.sleep(0.015)  # join after the first token was streamed
+        follower, followed = flights.join("q", compute)
+        streamed = [token async for token in follower.stream()]
+        return calls, led, followed, streamed, await leader.result(), flights.stats()
+
+    calls, led, followed, streamed, result, stats = asyncio.run(scenario())
+    assert calls == 1
+    assert (led, followed) == (True, False)
+    assert streamed == ["a", "b"]
+    assert result == "ab"
+    assert stats["coalesced"] == 1
+    assert stats["in_flight"] == 0
+
+
+def test_errors_reach_every_caller_and_the_next_call_starts_afresh():
+    async def scenario():
+        flights = SingleFlight()
+
+        async def fail(_emit):
+            raise RuntimeError("model down")
+
+        flight, _ = flights.join("q", fail)
+        with pytest.raises(RuntimeError):
+            await flight.result()
+        _, leader = flights.join("q", fail)
+        return flight.failed, leader
+
+    failed, leader = asyncio.run(scenario())
+    assert failed
+    assert leader
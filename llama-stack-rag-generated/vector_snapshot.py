@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Portable snapshots of the chunks in a knowledge bank along with their embeddings.
+
+A snapshot is a single compressed NumPy .npz file holding:
+
+    embeddings          float32 array with one row per chunk
+    chunks              UTF-8 JSON table of the content and metadata of each chunk
+    summary_embeddings  float32 array with one row per document summary
+    summaries           UTF-8 JSON table of the content and metadata of each summary
+    info                UTF-8 JSON with the embedding model, its dimension and the manifest
+
+Loading a snapshot never unpickles anything, so snapshots can be shared safely.
+"""
+
+import json
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+
+def json_array(data) -> np.ndarray:
+    """Data as UTF-8 JSON in a uint8 array, to store in an .npz file without pickling."""
+    return np.frombuffer(json.dumps(data).encode("utf-8"), dtype=np.uint8)
+
+
+def from_json_array(array: np.ndarray):
+    """The data stored by json_array."""
+    return json.loads(array.tobytes().decode("utf-8"))
+
+
+class Snapshot(NamedTuple):
+    """The contents of a snapshot."""
+
+    embeddings: np.ndarray
+    chunks: list
+    info: dict
+    summary_embeddings: np.ndarray
+    summaries: list  # empty for snapshots taken without them
+
+
+def save_snapshot(
+    path: str,
+    embeddings: np.ndarray,
+    chunks: list,
+    info: dict,
+    *,
+    summary_embeddings: Optional[np.ndarray] = None,
+    summaries: Optional[list] = None,
+) -> None:
+    """
+    Write a snapshot atomically.
+
+    Args:
+        path: File to write
+        embeddings: One embedding per chunk
+        chunks: Dicts with the content and metadata of each chunk
+        info: Embedding model, embedding dimension and anything else needed to load it
+        summary_embeddings: One embedding per document summary
+        summaries: Dicts with the content and metadata of each document summary
+    """
+    summaries = summaries or []
+    if summary_embeddings is None:
+        summary_embeddings = np.zeros((0, info["embedding_dimension"]), dtype=np.float32)
+    if len(embeddings) != len(chunks):
+        raise ValueError(f"{len(embeddings)} embeddings for {len(chunks)} chunks")
+    if len(summary_embeddings) != len(summaries):
+        raise ValueError(f"{len(summary_embeddings)} embeddings for {len(summaries)} summaries")
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with tmp_path.open("wb") as f:
+        np.savez_compressed(
+            f,
+            embeddings=np.asarray(embeddings, dtype=np.float32),
+            chunks=json_array(chunks),
+            summary_embeddings=np.asarray(summary_embeddings, dtype=np.float32),
+            summaries=json_array(summaries),
+            info=json_array(info),
+        )
+    tmp_path.replace(path)
+
+
+def load_snapshot(path: str) -> Snapshot:
+    """
+    Read a snapshot.
+
+    Args:
+        path: File to read
+
+    Returns:
+        The Snapshot
+    """
+    with np.load(path, allow_pickle=False) as snapshot:
+        info = from_json_array(snapshot["info"])
+        dimension = info["embedding_dimension"]
+        loaded = Snapshot(
+            snapshot["embeddings"],
+            from_json_array(snapshot["chunks"]),
+            info,
+            (
+                snapshot["summary_embeddings"]
+                if "summary_embeddings" in snapshot
+                else np.zeros((0, dimension), dtype=np.float32)
+            ),
+            from_json_array(snapshot["summaries"]) if "summaries" in snapshot else [],
+        )
+    for embeddings, items, name in (
+        (loaded.embeddings, loaded.chunks, "chunks"),
+        (loaded.summary_embeddings, loaded.summaries, "summaries"),
+    ):
+        if embeddings.shape != (len(items), dimension):
+            raise ValueError(
+                f"snapshot {path} is inconsistent: embeddings {embeddings.shape} for "
+                f"{len(items)} {name} of dimension {dimension}"
+            )
+    return loaded
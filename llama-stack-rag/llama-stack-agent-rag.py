@@ -5,6 +5,8 @@ import logging
 from pathlib import Path
 from llama_stack_client import LlamaStackClient
 from strip_markdown import strip_markdown
+from packed_corpus import PackedCorpus
+from ingest_checkpoint import IngestCheckpoint
 
 # remove logging we otherwise get by default
 logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -13,6 +15,11 @@ logging.getLogger("httpx").setLevel(logging.WARNING)
 model_id = "meta-llama/Llama-3.1-8B-Instruct"
 SHOW_RAG_DOCUMENTS = False
 
+# ingestion progress, so an interrupted run resumes instead of starting over
+CHECKPOINT_FILE = Path(f".{Path(__file__).stem}.ingest-checkpoint")
+# preprocessed docs, so warm starts do not read and convert every file again
+CORPUS_PACK_FILE = Path(".rag-corpus.pack")
+
 # Initialize client
 client = LlamaStackClient(
     base_url="http://10.1.2.128:8321",
@@ -28,42 +35,55 @@ def main():
     providers = client.providers.list()
     provider = next(p for p in providers if p.api == "vector_io")
 
-    # register a vector database
-    vector_db_id = f"test-vector-db-{uuid.uuid4()}"
-    client.vector_dbs.register(
-        vector_db_id=vector_db_id,
-        provider_id=provider.provider_id,
-        embedding_model="all-MiniLM-L6-v2",
-    )
+    # resume an interrupted ingestion if there is a checkpoint from it and the
+    # vector database it was filling is still there
+    checkpoint = IngestCheckpoint(CHECKPOINT_FILE)
+    registered = [vector_db.identifier for vector_db in client.vector_dbs.list()]
+    if checkpoint.resume(registered):
+        vector_db_id = checkpoint.vector_db_id
+        print(
+            f"Resuming ingestion into {vector_db_id}, "
+            f"{len(checkpoint.done)} documents already inserted"
+        )
+    else:
+        # register a vector database
+        vector_db_id = f"test-vector-db-{uuid.uuid4()}"
+        client.vector_dbs.register(
+            vector_db_id=vector_db_id,
+            provider_id=provider.provider_id,
+            embedding_model="all-MiniLM-L6-v2",
+        )
+        checkpoint.start(vector_db_id)
 
     # read in all of the files to be used with RAG
     rag_documents = []
     docs_path = Path("/home/user1/newpull/nodejs-reference-architecture/docs")
 
-    i = 0
-    for file_path in docs_path.rglob("*.md"):
-        i += 1
-        if file_path.is_file():
-            with open(file_path, "r", encoding="utf-8") as f:
-                contents = f.read()
-
-            # Convert markdown to plain text using strip_markdown
-            plain_text = strip_markdown(contents)
-
-            rag_documents.append(
-                {
-                    "document_id": f"doc-{i}",
-                    "content": plain_text,
-                    "mime_type": "text/plain",
-                    "metadata": {},
-                }
-            )
+    # the files are converted to plain text using strip_markdown once and kept in a
+    # packed corpus file, which is only rebuilt when the docs change
+    corpus = PackedCorpus.open(docs_path, CORPUS_PACK_FILE, strip_markdown)
+    for doc_id, plain_text in corpus:
+        rag_documents.append(
+            {
+                "document_id": doc_id,
+                "content": plain_text,
+                "mime_type": "text/plain",
+                "metadata": {},
+            }
+        )
 
-    client.tool_runtime.rag_tool.insert(
-        documents=rag_documents,
-        vector_db_id=vector_db_id,
-        chunk_size_in_tokens=126,
-    )
+    # insert the documents one at a time, checkpointing each, so a resumed run
+    # never inserts a document it already inserted
+    for doc in rag_documents:
+        if doc["document_id"] in checkpoint.done:
+            continue
+        client.tool_runtime.rag_tool.insert(
+            documents=[doc],
+            vector_db_id=vector_db_id,
+            chunk_size_in_tokens=126,
+        )
+        checkpoint.record(doc["document_id"])
+    checkpoint.finish()
 
     ########################
     # Create the agent